@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import os
+import os, sys
 import re
 import json, uuid
 import html
@@ -19,6 +19,9 @@ from models import Channel, User, get_messages
 
 SCRIPT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
 
+sys.path.insert(0, os.path.join(SCRIPT_DIRECTORY, "..", "src"))
+from slack_text import SlackTextCodec
+
 DATABASE_URL = "sqlite:///{}".format(os.path.join(SCRIPT_DIRECTORY, "history.db"))
 
 # settings for serving files
@@ -37,6 +40,8 @@ SLACK_TEAM_DOMAIN = os.environ["SLACK_TEAM_DOMAIN"]
 
 PAGE_SIZE = 5000
 
+SLACK_FILE_LINK_MATCHER = re.compile(r"\bhttps://{}\.slack\.com/files/[^/]+/(\w+)/([^/\s]+)".format(re.escape(SLACK_TEAM_DOMAIN)))
+
 # set up application
 app = flask.Flask(__name__)
 app.secret_key = SESSION_SECRET_KEY # used to encrypt flask.session cookies on the client side
@@ -147,25 +152,41 @@ def set_request_arg(request_args, arg_name, arg_value=None):
 def url_from_request_args(request_args):
     return flask.request.path + "?" + urlencode(request_args)
 
+def get_channel_name_by_id(channel_id):
+    channel = Channel.query.filter_by(channel_id=channel_id).first()
+    return None if channel is None else channel.channel_name
+def get_user_name_by_id(user_id):
+    user = User.query.filter_by(user_id=user_id).first()
+    return None if user is None else user.user_name
+def get_user_real_name_by_id(user_id):
+    user = User.query.filter_by(user_id=user_id).first()
+    return None if user is None else user.user_real_name
+def get_text_codec():
+    """Returns the text codec for the current request, which remembers channel and user names so that each one is only looked up once per page."""
+    if "text_codec" not in flask.g:
+        flask.g.text_codec = SlackTextCodec(get_channel_name_by_id, get_user_name_by_id, get_user_real_name_by_id)
+    return flask.g.text_codec
+
 @app.template_filter("html_from_slack_sendable_text")
 def html_from_slack_sendable_text(message):
     channel_id, user_id, sendable_text = message.channel_id, message.user_id, message.value
     request_args = flask.request.args.to_dict()
+    text_codec = get_text_codec()
 
-    def process_special_sequence(match):
-        original, body = match.group(0), match.group(1).split("|")[0]
+    def process_special_sequence(original, body):
         if body.startswith("#"):  # channel reference
             new_url = url_from_request_args(set_request_arg(request_args, "channel_ids", body[1:]))
-            channel = Channel.query.filter_by(channel_id=body[1:]).first()
-            channel_name = "[DELETED]" if channel is None else channel.channel_name  # apparently channels can be truly deleted, rather than just archived
+            channel_name = text_codec.get_channel_name_by_id(body[1:])
+            if channel_name is None: channel_name = "[DELETED]"  # apparently channels can be truly deleted, rather than just archived
             return """<a href="{new_url}">#{channel_name}</a>""".format(
                 new_url=html.escape(new_url), channel_name=html.escape(channel_name)
             )
         if body.startswith("@"):  # user reference
+            user_name = text_codec.get_user_name_by_id(body[1:])
+            if user_name is None: user_name = body[1:]  # user isn't in the archive, show their ID rather than the raw sequence
             new_url = url_from_request_args(set_request_arg(request_args, "user_ids", body[1:]))
-            user = User.query.filter_by(user_id=body[1:]).first()
             return """<a href="{new_url}" title="{user_real_name}">@{user_name}</a>""".format(
-                new_url=html.escape(new_url), user_name=html.escape(user.user_name), user_real_name=html.escape(user.user_real_name)
+                new_url=html.escape(new_url), user_name=html.escape(user_name), user_real_name=html.escape(text_codec.get_user_real_name_by_id(body[1:]) or "")
             )
         if body in {"!channel", "!group"}:
             return """<strong>@channel</strong>"""
@@ -179,10 +200,11 @@ def html_from_slack_sendable_text(message):
         return """<a href="{}">{}</a>""".format(archived_url, original)
 
     # process Slack special sequences
-    html_text = re.sub(r"<(.*?)>", process_special_sequence, sendable_text)
+    html_text = text_codec.replace_special_sequences(sendable_text, process_special_sequence)
 
     # process Slack file links
-    html_text = re.sub(r"\bhttps://{}\.slack\.com/files/[^/]+/(\w+)/([^/\s]+)".format(SLACK_TEAM_DOMAIN), process_slack_file_link, html_text)
+    if "slack.com/files/" in html_text:
+        html_text = SLACK_FILE_LINK_MATCHER.sub(process_slack_file_link, html_text)
 
     return html_text
 
@@ -1,14 +1,198 @@
 #!/usr/bin/env python3
 
-import time, json, sys, re
+import os, time, json, sys, re, random
 from datetime import datetime
 import traceback
 import logging
+import selectors, threading, socket
+import asyncio
+import functools
+import concurrent.futures
 from collections import deque
-from functools import lru_cache
 
 from slackclient import SlackClient
 
+from slack_text import SlackTextCodec, text_to_sendable_text
+from slack_web import SlackWebClient
+from metrics import Metrics
+from logs import LogExcerpt
+
+class TokenBucket:
+    """Rate limiter that allows an average of `rate` events per second, with bursts of up to `capacity` events at once."""
+    def __init__(self, rate, capacity):
+        assert rate > 0, "`rate` must be a positive number rather than \"{}\"".format(rate)
+        assert capacity >= 1, "`capacity` must be at least 1 rather than \"{}\"".format(capacity)
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.last_refill_time = capacity, time.monotonic()
+
+    def get_available_time(self, current_time):
+        """Returns the monotonic time at which the next event will be allowed, given that it's currently monotonic time `current_time`."""
+        self.tokens = min(self.capacity, self.tokens + (current_time - self.last_refill_time) * self.rate)
+        self.last_refill_time = current_time
+        return current_time + max(0, (1 - self.tokens) / self.rate)
+
+    def take(self, current_time):
+        """Record an event at monotonic time `current_time`."""
+        self.get_available_time(current_time) # bring the token count up to date
+        self.tokens -= 1
+
+class OutgoingMessage:
+    """
+    Message waiting to be sent by an `OutboundMessageQueue`.
+
+    The `sent` attribute is a `concurrent.futures.Future` that resolves to the message ID once the message has been written to the RTM websocket. The `reply` attribute is a `concurrent.futures.Future` that resolves to the message timestamp once the server acknowledges the message.
+    """
+    def __init__(self, message_id, sendable_text, channel_id, thread_id, priority):
+        self.message_id, self.sendable_text, self.channel_id, self.thread_id, self.priority = message_id, sendable_text, channel_id, thread_id, priority
+        self.sent, self.reply = concurrent.futures.Future(), concurrent.futures.Future()
+        self.sent_time = None # monotonic time at which the message was written to the RTM websocket
+
+    def __repr__(self): return "<OutgoingMessage {} to {}>".format(self.message_id, self.channel_id)
+
+class OutboundMessageQueue:
+    """
+    Queue of outgoing messages, with one lane for each priority, rate limited by a token bucket for the whole workspace as well as a token bucket for each channel.
+
+    Higher priority lanes are always drained first. Within a lane, messages for the same channel are sent in order, but a channel that has used up its own rate limit doesn't hold up messages for other channels.
+    """
+    PRIORITIES = ("interactive", "normal", "background") # in descending order of priority
+
+    def __init__(self, workspace_rate=1, workspace_burst=3, channel_rate=1, channel_burst=1):
+        self.lock = threading.Lock()
+        self.lanes = {priority: deque() for priority in self.PRIORITIES}
+        self.workspace_bucket = TokenBucket(workspace_rate, workspace_burst)
+        self.channel_rate, self.channel_burst = channel_rate, channel_burst
+        self.channel_buckets = {} # mapping from channel IDs to the token bucket for that channel
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def get_channel_bucket(self, channel_id):
+        if channel_id not in self.channel_buckets: self.channel_buckets[channel_id] = TokenBucket(self.channel_rate, self.channel_burst)
+        return self.channel_buckets[channel_id]
+
+    def put(self, outgoing_message):
+        """Add `outgoing_message` to the end of the lane for its priority."""
+        assert outgoing_message.priority in self.lanes, "`priority` must be one of {} rather than \"{}\"".format(", ".join(self.PRIORITIES), outgoing_message.priority)
+        with self.lock: self.lanes[outgoing_message.priority].append(outgoing_message)
+
+    def pop_ready(self, current_time):
+        """Removes and returns the next message that can be sent at monotonic time `current_time` without exceeding any rate limits, or `None` if there are no such messages."""
+        with self.lock:
+            if self.workspace_bucket.get_available_time(current_time) > current_time: return None
+            for priority in self.PRIORITIES:
+                lane, limited_channels = self.lanes[priority], set()
+                for i, outgoing_message in enumerate(lane):
+                    if outgoing_message.channel_id in limited_channels: continue # an earlier message for this channel is still waiting
+                    channel_bucket = self.get_channel_bucket(outgoing_message.channel_id)
+                    if channel_bucket.get_available_time(current_time) > current_time:
+                        limited_channels.add(outgoing_message.channel_id)
+                        continue
+                    del lane[i]
+                    self.workspace_bucket.take(current_time)
+                    channel_bucket.take(current_time)
+                    return outgoing_message
+            return None
+
+    def get_next_send_time(self, current_time):
+        """Returns the monotonic time at which the next queued message can be sent, or `None` if the queue is empty."""
+        with self.lock:
+            channel_ids = {outgoing_message.channel_id for lane in self.lanes.values() for outgoing_message in lane}
+            if not channel_ids: return None
+            channel_available_time = min(self.get_channel_bucket(channel_id).get_available_time(current_time) for channel_id in channel_ids)
+            return max(self.workspace_bucket.get_available_time(current_time), channel_available_time)
+
+class SlackDirectory:
+    """
+    Index of the channels and users in a Slack team, allowing constant-time lookups by ID, name, or real name.
+
+    The index is loaded once from the Slack client's team data after connecting, then kept up to date incrementally from RTM events.
+    """
+    EVENT_TYPES = frozenset({"channel_created", "channel_joined", "channel_rename", "group_joined", "group_rename", "im_created", "im_open", "channel_deleted", "group_archive", "team_join", "user_change"}) # RTM event types that can change the index
+
+    def __init__(self):
+        self.channel_names_by_id, self.channel_ids_by_name = {}, {}
+        self.user_names_by_id, self.user_ids_by_name = {}, {}
+        self.user_real_names_by_id, self.user_ids_by_real_name = {}, {}
+        self.user_infos_by_id = {} # mapping from user IDs to user metadata dictionaries, filled in by `load_user_infos` and kept up to date by user events
+        self.direct_message_channel_ids_by_user_id = {} # mapping from user IDs to the IDs of our direct message channels with them, filled in by `load_direct_message_channels` and kept up to date by IM events
+
+    def load(self, login_data):
+        """Rebuild the index from the channels and users in `login_data`, the response from the [`rtm.start`](https://api.slack.com/methods/rtm.start) Slack API method."""
+        directory = SlackDirectory()
+        for entry in login_data.get("channels", []) + login_data.get("groups", []): directory.add_channel(entry["id"], entry["name"])
+        for entry in login_data.get("ims", []): directory.add_channel(entry["id"], entry["id"]) # direct messages don't have names, so use the ID like the Slack library does
+        for entry in login_data.get("users", []): directory.add_user(entry["id"], entry["name"], entry.get("real_name") or entry.get("profile", {}).get("real_name"))
+
+        # swap in the new indices all at once, so that lookups from other threads never see a partially loaded directory
+        self.channel_names_by_id, self.channel_ids_by_name = directory.channel_names_by_id, directory.channel_ids_by_name
+        self.user_names_by_id, self.user_ids_by_name = directory.user_names_by_id, directory.user_ids_by_name
+        self.user_real_names_by_id, self.user_ids_by_real_name = directory.user_real_names_by_id, directory.user_ids_by_real_name
+        for channel_id in list(self.direct_message_channel_ids_by_user_id.values()): self.add_direct_message_channel(channel_id) # keep direct messages we opened ourselves, which the Slack client might not know about
+
+    def load_user_infos(self, user_infos):
+        """Replace the cached user metadata with the [user metadata dictionaries](https://api.slack.com/types/user) in `user_infos`."""
+        self.user_infos_by_id = {user_info["id"]: user_info for user_info in user_infos} # swap in the new cache all at once, like in `load`
+
+    def load_direct_message_channels(self, ims):
+        """Replace the direct message channel index with the [IM objects](https://api.slack.com/types/im) in `ims`."""
+        self.direct_message_channel_ids_by_user_id = {im["user"]: im["id"] for im in ims if "user" in im and "id" in im}
+        for channel_id in self.direct_message_channel_ids_by_user_id.values(): self.add_direct_message_channel(channel_id)
+
+    def add_direct_message_channel(self, channel_id):
+        """Add the direct message channel with ID `channel_id` to the channel index, if it isn't already there."""
+        if channel_id not in self.channel_names_by_id: self.add_channel(channel_id, channel_id) # direct messages don't have names, so the Slack client names them by ID
+
+    def add_channel(self, channel_id, channel_name):
+        """Add the channel with ID `channel_id` and name `channel_name` to the index, replacing any previous name for that channel."""
+        # the new entries are written before the stale one is removed, so that lookups from other threads never find the channel missing
+        previous_name = self.channel_names_by_id.get(channel_id)
+        self.channel_names_by_id[channel_id] = channel_name
+        self.channel_ids_by_name.setdefault(channel_name, channel_id) # if two channels have the same name, the first one wins
+        if previous_name is not None and previous_name != channel_name and self.channel_ids_by_name.get(previous_name) == channel_id: del self.channel_ids_by_name[previous_name]
+
+    def remove_channel(self, channel_id):
+        channel_name = self.channel_names_by_id.pop(channel_id, None)
+        if self.channel_ids_by_name.get(channel_name) == channel_id: del self.channel_ids_by_name[channel_name]
+
+    def add_user(self, user_id, user_name, real_name):
+        """Add the user with ID `user_id`, username `user_name`, and real name `real_name` to the index, replacing any previous names for that user."""
+        # like in `add_channel`, the new entries are written before the stale ones are removed
+        previous_name, previous_real_name = self.user_names_by_id.get(user_id), self.user_real_names_by_id.get(user_id)
+        self.user_names_by_id[user_id], self.user_real_names_by_id[user_id] = user_name, real_name
+        self.user_ids_by_name.setdefault(user_name, user_id) # if two users have the same name, the first one wins
+        if real_name: self.user_ids_by_real_name.setdefault(real_name, user_id)
+        if previous_name != user_name and self.user_ids_by_name.get(previous_name) == user_id: del self.user_ids_by_name[previous_name]
+        if previous_real_name != real_name and self.user_ids_by_real_name.get(previous_real_name) == user_id: del self.user_ids_by_real_name[previous_real_name]
+
+    def update_from_event(self, message_dict):
+        """Update the index from the RTM event `message_dict`, if it's an event that changes channels or users. Returns `True` if the index changed, `False` otherwise."""
+        event_type = message_dict.get("type")
+        if event_type not in self.EVENT_TYPES: return False
+        if event_type in {"channel_created", "channel_joined", "channel_rename", "group_joined", "group_rename", "im_created"}:
+            channel = message_dict.get("channel")
+            if isinstance(channel, dict) and "id" in channel:
+                self.add_channel(channel["id"], channel.get("name", channel["id"])) # direct messages don't have names, so the Slack client names them by ID
+                if event_type == "im_created" and isinstance(message_dict.get("user"), str):
+                    self.direct_message_channel_ids_by_user_id[message_dict["user"]] = channel["id"]
+                return True
+        elif event_type == "im_open":
+            if isinstance(message_dict.get("user"), str) and isinstance(message_dict.get("channel"), str):
+                self.direct_message_channel_ids_by_user_id[message_dict["user"]] = message_dict["channel"]
+                self.add_direct_message_channel(message_dict["channel"])
+                return True
+        elif event_type in {"channel_deleted", "group_archive"}:
+            if isinstance(message_dict.get("channel"), str):
+                self.remove_channel(message_dict["channel"])
+                return True
+        elif event_type in {"team_join", "user_change"}:
+            user = message_dict.get("user")
+            if isinstance(user, dict) and "id" in user and "name" in user:
+                self.add_user(user["id"], user["name"], user.get("real_name", user.get("profile", {}).get("real_name")))
+                self.user_infos_by_id[user["id"]] = user # these events include the full user metadata dictionary
+                return True
+        return False
+
 class SlackBot:
     """
     Slack bot base class. Includes lots of useful functionality that bots often require, such as messaging, connection management, and interfacing with APIs.
@@ -17,6 +201,9 @@ class SlackBot:
 
     This class is intended to be subclassed, with the `on_step` and `on_message` methods overridden to do more useful things.
     """
+    SHEDDABLE_EVENT_TYPES = frozenset({"ping", "pong", "presence_change", "user_typing", "reconnect_url"}) # event types that aren't passed to `on_message` while the bot is overloaded (their effects on the connection, like updating `reconnect_url`, still apply)
+    REACTION_EVENT_TYPES = frozenset({"reaction_added", "reaction_removed"}) # event types that are handled after everything else while the bot is overloaded
+
     def __init__(self, token, logger=None):
         assert isinstance(token, str), "`token` must be a valid Slack API token"
         assert logger is None or not isinstance(logger, logging.Logger), "`logger` must be `None` or a logging function"
@@ -24,18 +211,52 @@ class SlackBot:
         self.client = SlackClient(token)
         if logger is None: self.logger = logging.getLogger(self.__class__.__name__)
         else: self.logger = logger
+        self.web_client = SlackWebClient(token, base_url=os.environ.get("SLACK_API_URL", "https://slack.com/api/"), logger=self.logger) # Web API calls go through here rather than the Slack library, for connection reuse and concurrency
 
-        # cached versions of methods
-        self.get_user_info_by_id_cached = lru_cache(maxsize=256)(self.get_user_info_by_id)
+        # channel and user lookup fields
+        self.directory = SlackDirectory() # index of channels and users, for fast lookups by ID or name
+        self.text_codec = SlackTextCodec(self.get_channel_name_by_id, self.get_user_name_by_id) # converts between text formats, memoizing channel and user names
 
         # incoming message fields
         self.unprocessed_incoming_messages = deque() # store unprocessed messages to allow message peeking
+        self.receive_lock = threading.Lock() # messages can be peeked at from other threads, such as when waiting for a message to finish sending
+        self.receive_mode = "select" # either "select" (block on the RTM websocket until a frame arrives or something is due) or "poll" (check the websocket every 10 milliseconds)
+        self.step_interval = 0.05 # maximum number of seconds between step handler calls in the "select" receive mode
+        self.ping_interval = 5 # number of seconds between pings to the server
+        self.shed_threshold = 200 # number of received events waiting to be handled, beyond which low-value events are shed (see `triage_incoming_messages`)
+        self.shed_log_bucket = TokenBucket(0.1, 1) # limits load shedding warnings to one every 10 seconds, since shedding can happen on every iteration of the main loop
 
         # outgoing message fields
         self.max_message_id = 1 # every message sent over RTM needs a unique positive integer ID - this should technically be handled by the Slack library, but that's broken as of now
-        self.last_say_time = 0 # store last message send timestamp to rate limit sending
+        self.send_lock = threading.Lock() # messages can be sent from multiple threads, so message IDs and websocket writes need to be synchronized
+        self.outbound_queue = OutboundMessageQueue() # messages waiting to be sent by the main loop, rate limited to stay within the Slack API limits
+        self.pending_replies = {} # mapping from message IDs to sent messages that the server hasn't acknowledged yet, in the order they were sent
+        self.reply_timeout = 30 # number of seconds after sending a message to give up waiting for the server to acknowledge it
+        self.loop_thread_id = None # identifier of the thread running the main loop
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair() # writing to `wakeup_sender` wakes up the main loop when it's waiting for incoming messages
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
         self.bot_user_id = None # ID of this bot user
 
+        # connection management fields
+        self.reconnect_url = None # URL that Slack most recently told us to use for reconnecting quickly, from the `reconnect_url` event
+        self.initial_reconnect_delay = 0.1 # maximum number of seconds to wait before the first reconnection attempt
+        self.max_reconnect_delay = 30 # maximum number of seconds to wait between reconnection attempts
+        self.reconnect_attempts = 0 # number of reconnection attempts since the last connection that stayed up for at least `stable_connection_time` seconds
+        self.stable_connection_time = 30 # number of seconds a connection has to stay up before the reconnection delay goes back to `initial_reconnect_delay`
+        self.connected_time = None # monotonic time at which the current connection was made, or `None` if we're not connected
+        self.disconnect_time = None # monotonic time at which the connection was most recently lost, or `None` if it hasn't been lost yet
+        self.directory_refresher = None # thread that reloads the channel and user directory after reconnecting
+
+        # instrumentation fields
+        self.metrics = Metrics() # counters, latency histograms, and gauges describing how the bot is performing
+        self.metrics.add_gauge("bot.unprocessed_incoming_messages", lambda: len(self.unprocessed_incoming_messages))
+        self.metrics.add_gauge("bot.outbound_queue_depth", lambda: len(self.outbound_queue))
+        self.metrics.add_gauge("bot.pending_replies", lambda: len(self.pending_replies))
+        self.metrics_path = None # path of the file to periodically write metrics to as JSON, or `None` to not write metrics
+        self.metrics_interval = 60 # number of seconds between metrics file writes
+        self.last_metrics_dump = time.monotonic()
+
     def on_step(self):
         self.logger.info("step handler called")
     def on_message(self, message_dict):
@@ -47,140 +268,371 @@ class SlackBot:
             except KeyboardInterrupt: break
             except Exception:
                 self.logger.error("main loop threw exception:\n{}".format(traceback.format_exc()))
-                self.logger.info("restarting in 5 seconds...")
-                time.sleep(5)
+                time.sleep(self.get_reconnect_delay())
         self.logger.info("shutting down...")
 
+    def get_reconnect_delay(self):
+        """Record that the connection was lost, and return the number of seconds to wait before reconnecting. This is a random delay (to avoid many bots reconnecting in lockstep) whose upper bound starts at `initial_reconnect_delay` and doubles with every attempt, up to `max_reconnect_delay`. Attempts are counted until a connection stays up for `stable_connection_time` seconds, so a connection that keeps dying right after it's made still backs off."""
+        if self.connected_time is not None and time.monotonic() - self.connected_time >= self.stable_connection_time: self.reconnect_attempts = 0
+        self.connected_time = None
+        if self.disconnect_time is None: self.disconnect_time = time.monotonic()
+        delay = random.uniform(0, min(self.max_reconnect_delay, self.initial_reconnect_delay * 2 ** self.reconnect_attempts))
+        self.reconnect_attempts += 1
+        self.logger.info("reconnecting in {:.2f} seconds (attempt {})...".format(delay, self.reconnect_attempts))
+        return delay
+
+    def connect(self):
+        """Connect to the Slack Realtime Messaging API. When reconnecting, this uses the most recent `reconnect_url` if possible, or the lighter `rtm.connect` method otherwise, and refreshes the channel and user directory in the background (see `refresh_directory`) rather than holding up the connection for it."""
+        is_reconnect = self.bot_user_id is not None
+        reconnect_url, self.reconnect_url = self.reconnect_url, None # reconnect URLs can only be used once
+        if is_reconnect and reconnect_url is not None:
+            try:
+                self.client.server.connect_slack_websocket(reconnect_url)
+                self.logger.info("reconnected to Slack realtime messaging API using reconnect URL")
+                self.refresh_directory_in_background()
+                self.on_connected()
+                return
+            except Exception:
+                self.logger.warning("reconnect URL failed, reconnecting from scratch:\n{}".format(traceback.format_exc()))
+
+        self.logger.info("connecting to Slack realtime messaging API...")
+        login_data = self.web_client.api_call("rtm.connect" if is_reconnect else "rtm.start") # when reconnecting, the directory is refreshed in the background instead, so the connection comes back as soon as possible
+        if not login_data.get("ok"): raise ConnectionError("Could not connect to Slack realtime messaging API (possibly a bad token or network issue): {}".format(login_data.get("error")))
+        self.client.server.connect_slack_websocket(login_data["url"])
+        self.logger.info("connected to Slack realtime messaging API")
+        if not is_reconnect:
+            self.directory.load(login_data)
+            self.text_codec.clear_name_cache()
+            self.load_user_infos()
+            self.load_direct_message_channels()
+
+            # obtain the bot credentials
+            authentication = self.web_client.api_call("auth.test")
+            assert authentication["ok"], "Could not authenticate with Slack API"
+            self.bot_user_id = authentication["user_id"]
+        else:
+            self.refresh_directory_in_background()
+        self.on_connected()
+
+    def refresh_directory_in_background(self):
+        """Start refreshing the channel and user directory in a background thread, unless a refresh is already running."""
+        if self.directory_refresher is not None and self.directory_refresher.is_alive(): return
+        self.directory_refresher = threading.Thread(target=self.refresh_directory, name="DirectoryRefresher", daemon=True)
+        self.directory_refresher.start()
+
+    def refresh_directory(self):
+        """Reload the channel and user directory from paginated `conversations.list` and `users.list` listings, catching up on channels, users, and direct messages that changed while we were disconnected. Used after reconnecting, since `rtm.connect` and reconnect URLs don't include the team's channels and users like `rtm.start` does."""
+        try:
+            conversations = self.get_paginated_list("conversations.list", "channels", types="public_channel,private_channel,im")
+            users = self.get_paginated_list("users.list", "members")
+        except Exception:
+            self.logger.error("directory refresh threw exception:\n{}".format(traceback.format_exc()))
+            return
+        if conversations is None or users is None:
+            self.logger.warning("directory refresh failed, so channels and users that changed while disconnected won't be known until the next reconnection")
+            return
+        ims = [conversation for conversation in conversations if conversation.get("is_im")]
+        self.directory.load({"channels": [conversation for conversation in conversations if "name" in conversation and not conversation.get("is_im")], "ims": ims, "users": users})
+        self.directory.load_user_infos(users)
+        self.directory.load_direct_message_channels(ims)
+        self.text_codec.clear_name_cache()
+        self.logger.info("refreshed directory with {} channels and {} users".format(len(conversations), len(users)))
+        self.on_directory_refreshed()
+
+    def on_directory_refreshed(self):
+        """Called from the directory refresh thread once `refresh_directory` has reloaded the directory after reconnecting."""
+        pass
+
+    def on_connected(self):
+        """Record that we connected successfully, reporting how long it took to reconnect. The reconnection delay is only reset once the connection has stayed up for a while (see `get_reconnect_delay`)."""
+        if self.disconnect_time is not None:
+            reconnect_duration = time.monotonic() - self.disconnect_time
+            self.metrics.record("bot.reconnect", reconnect_duration)
+            self.logger.info("reconnected {:.2f} seconds after losing the connection, after {} attempts".format(reconnect_duration, self.reconnect_attempts))
+        self.disconnect_time, self.connected_time = None, time.monotonic()
+
+        # messages sent over the old connection will never be acknowledged
+        for message_id, outgoing_message in list(self.pending_replies.items()):
+            del self.pending_replies[message_id]
+            if not outgoing_message.reply.done(): outgoing_message.reply.set_exception(ConnectionError("Connection was lost before the message was acknowledged"))
+
+    def process_connection_event(self, message_dict):
+        """Update the bot's internal state from the incoming RTM event `message_dict`, before it's handled by `on_message`."""
+        self.metrics.increment("bot.events_received")
+        if self.directory.update_from_event(message_dict): self.text_codec.clear_name_cache()
+        self.resolve_pending_reply(message_dict)
+        if message_dict.get("type") == "reconnect_url" and isinstance(message_dict.get("url"), str): self.reconnect_url = message_dict["url"]
+
+    def get_inbound_backlog(self):
+        """Returns the number of received events that were passed to `on_message` but haven't been handled yet. Subclasses that handle events in the background should override this, so that load shedding accounts for events they haven't gotten to yet."""
+        return 0
+
+    def triage_incoming_messages(self, message_dicts):
+        """
+        Returns the events in the list `message_dicts` that should be passed to `on_message`, in the order they should be handled.
+
+        Normally, that's all of them, in the order they were received. When there are more than `shed_threshold` events waiting to be handled (such as after a stall or reconnection, or when handlers can't keep up), the bot sheds load so that real commands still get handled promptly: events in `SHEDDABLE_EVENT_TYPES` and message acknowledgements are dropped, multiple edits of the same message are collapsed into the last one, and reactions are handled after everything else. Shed events are counted in the `bot.events_shed.*` metrics.
+        """
+        if len(message_dicts) + self.get_inbound_backlog() <= self.shed_threshold: return message_dicts
+        triaged_message_dicts, reaction_message_dicts = [], []
+        last_edit_indices = {} # mapping from (channel ID, timestamp) tuples of edited messages to the index of their most recent edit in `triaged_message_dicts`
+        shed_counts = {} # mapping from kinds of shed events to the number of them shed
+        for message_dict in message_dicts:
+            event_type = message_dict.get("type")
+            if event_type in self.SHEDDABLE_EVENT_TYPES or (event_type is None and "reply_to" in message_dict): # acknowledgements have already resolved their messages' `reply` futures
+                shed_counts[event_type or "reply"] = shed_counts.get(event_type or "reply", 0) + 1
+            elif event_type in self.REACTION_EVENT_TYPES:
+                reaction_message_dicts.append(message_dict)
+            else:
+                if event_type == "message" and message_dict.get("subtype") == "message_changed" and isinstance(message_dict.get("message"), dict):
+                    key = (message_dict.get("channel"), message_dict["message"].get("ts"))
+                    if isinstance(key[0], str) and isinstance(key[1], str):
+                        previous_index = last_edit_indices.get(key)
+                        if previous_index is not None: # an earlier edit of the same message is superseded by this one
+                            triaged_message_dicts[previous_index] = None
+                            shed_counts["message_changed"] = shed_counts.get("message_changed", 0) + 1
+                        last_edit_indices[key] = len(triaged_message_dicts)
+                triaged_message_dicts.append(message_dict)
+        for kind, count in shed_counts.items(): self.metrics.increment("bot.events_shed.{}".format(kind), count)
+        current_time = time.monotonic()
+        if self.shed_log_bucket.get_available_time(current_time) <= current_time:
+            self.shed_log_bucket.take(current_time)
+            self.logger.warning("inbound backlog of %s events, shed %s events and deferred %s reactions (see the bot.events_shed.* metrics for totals)", len(message_dicts) + self.get_inbound_backlog(), sum(shed_counts.values()), len(reaction_message_dicts))
+        return [message_dict for message_dict in triaged_message_dicts if message_dict is not None] + reaction_message_dicts
+
     def retrieve_unprocessed_incoming_messages(self):
-        result = list(self.unprocessed_incoming_messages) + self.client.rtm_read()
-        self.unprocessed_incoming_messages.clear()
+        with self.receive_lock:
+            result = list(self.unprocessed_incoming_messages) + self.client.rtm_read()
+            self.unprocessed_incoming_messages.clear()
         return result
 
     def peek_unprocessed_incoming_messages(self):
-        self.unprocessed_incoming_messages.extend(self.client.rtm_read())
-        return list(self.unprocessed_incoming_messages)
+        with self.receive_lock:
+            self.unprocessed_incoming_messages.extend(self.client.rtm_read())
+            return list(self.unprocessed_incoming_messages)
 
     def peek_new_messages(self):
-        new_messages = self.client.rtm_read()
-        self.unprocessed_incoming_messages.extend(new_messages)
+        with self.receive_lock:
+            new_messages = self.client.rtm_read()
+            self.unprocessed_incoming_messages.extend(new_messages)
         return list(new_messages)
 
     def start(self):
-        # connect to the Slack Realtime Messaging API
-        self.logger.info("connecting to Slack realtime messaging API...")
-        if not self.client.rtm_connect(): raise ConnectionError("Could not connect to Slack realtime messaging API (possibly a bad token or network issue)")
-        self.logger.info("connected to Slack realtime messaging API")
+        self.connect()
 
-        # obtain the bot credentials
-        authentication = self.client.api_call("auth.test")
-        assert authentication["ok"], "Could not authenticate with Slack API"
-        self.bot_user_id = authentication["user_id"]
-
-        last_ping = time.monotonic()
-        while True:
-            # call all the step callbacks
-            try: self.on_step()
-            except Exception:
-                self.logger.error("step processing threw exception:\n{}".format(traceback.format_exc()))
+        self.loop_thread_id = threading.get_ident()
+        selector = selectors.DefaultSelector()
+        selector.register(self.client.server.websocket.sock, selectors.EVENT_READ)
+        selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+        try:
+            last_ping = time.monotonic()
+            deadline = None
+            while True:
+                self.record_loop_lag(deadline)
 
-            # call all the message callbacks for each newly received message
-            for message_dict in self.retrieve_unprocessed_incoming_messages():
-                try: self.on_message(message_dict)
-                except KeyboardInterrupt: raise
+                # call all the step callbacks
+                try: self.on_step()
                 except Exception:
-                    self.logger.error("message processing threw exception:\n{}\n\nmessage contents:\n{}".format(traceback.format_exc(), message_dict))
-
-            # ping the server periodically to make sure our connection is kept alive
-            if time.monotonic() - last_ping > 5:
-                self.client.server.ping()
-                last_ping = time.monotonic()
-
-            # delay to avoid checking the socket too often
-            time.sleep(0.01)
-
-    def say(self, sendable_text, *, channel_id, thread_id = None):
-        """Say `sendable_text` in the channel with ID `channel_id`, returning the message ID (unique within each `SlackBot` instance)."""
+                    self.logger.error("step processing threw exception:\n{}".format(traceback.format_exc()))
+                last_step = time.monotonic()
+
+                # call all the message callbacks for each newly received message, except ones shed due to overload
+                message_dicts = self.retrieve_unprocessed_incoming_messages()
+                for message_dict in message_dicts: self.process_connection_event(message_dict)
+                for message_dict in self.triage_incoming_messages(message_dicts):
+                    try: self.on_message(message_dict)
+                    except KeyboardInterrupt: raise
+                    except Exception:
+                        self.logger.error("message processing threw exception:\n%s\n\nmessage contents:\n%s", traceback.format_exc(), LogExcerpt(message_dict))
+
+                # send any queued messages that are within the rate limits
+                self.flush_outbound_messages()
+                self.expire_pending_replies()
+                self.dump_metrics_if_due()
+
+                # ping the server periodically to make sure our connection is kept alive
+                if time.monotonic() - last_ping > self.ping_interval:
+                    self.client.server.ping()
+                    last_ping = time.monotonic()
+
+                if self.receive_mode == "poll":
+                    deadline = time.monotonic() + 0.01
+                    time.sleep(0.01) # delay to avoid checking the socket too often
+                else:
+                    deadline = min(self.get_next_step_time(last_step), last_ping + self.ping_interval)
+                    next_send_time = self.outbound_queue.get_next_send_time(time.monotonic())
+                    if next_send_time is not None: deadline = min(deadline, next_send_time)
+                    self.wait_for_incoming_messages(selector, deadline)
+        finally:
+            selector.close()
+
+    def record_loop_lag(self, deadline):
+        """Record how late the main loop woke up, given that it intended to wake up at monotonic time `deadline` (or `None` if it didn't wait). Waking up early because a message arrived doesn't count."""
+        if deadline is None: return
+        lag = time.monotonic() - deadline
+        if lag >= 0: self.metrics.record("bot.loop_lag", lag)
+
+    def dump_metrics_if_due(self):
+        """Write the metrics to `metrics_path` if it's set and it's been at least `metrics_interval` seconds since they were last written."""
+        if self.metrics_path is None or time.monotonic() - self.last_metrics_dump < self.metrics_interval: return
+        self.last_metrics_dump = time.monotonic()
+        try: self.metrics.dump(self.metrics_path)
+        except OSError:
+            self.logger.error("writing metrics failed:\n{}".format(traceback.format_exc()))
+
+    def get_next_step_time(self, last_step):
+        """Returns the monotonic time at which the step handler should next be called, given that it was last called at monotonic time `last_step`. Only used in the "select" receive mode."""
+        return last_step + self.step_interval
+
+    def wait_for_incoming_messages(self, selector, deadline):
+        """Block until the RTM websocket registered with `selector` is readable, or until monotonic time `deadline`, whichever comes first."""
+        if self.unprocessed_incoming_messages: return # messages that were peeked at earlier still need to be processed
+        sock = self.client.server.websocket.sock
+        if hasattr(sock, "pending") and sock.pending(): return # the SSL layer has already buffered decrypted data, which won't show up in `select`
+        timeout = deadline - time.monotonic()
+        if timeout > 0: selector.select(timeout)
+
+        # clear out any pending wakeups, now that we're awake
+        try:
+            while self.wakeup_receiver.recv(4096): pass
+        except BlockingIOError: pass
+
+    def wake_up(self):
+        """Wake up the main loop if it's waiting for incoming messages. Safe to call from any thread."""
+        try: self.wakeup_sender.send(b"\0")
+        except BlockingIOError: pass # there are already enough wakeups pending
+
+    def say(self, sendable_text, *, channel_id, thread_id = None, priority = "normal"):
+        """Queue `sendable_text` to be said in the channel with ID `channel_id`, returning the message ID (unique within each `SlackBot` instance) without waiting for the message to be sent. Messages with `priority` "interactive" are sent before "normal" ones, which are sent before "background" ones."""
+        return self.queue_message(sendable_text, channel_id=channel_id, thread_id=thread_id, priority=priority).message_id
+
+    def queue_message(self, sendable_text, *, channel_id, thread_id = None, priority = "normal"):
+        """Queue `sendable_text` to be said in the channel with ID `channel_id`, returning the queued `OutgoingMessage`, whose `sent` future resolves once the message has been sent."""
+        outgoing_message = self.create_outgoing_message(sendable_text, channel_id=channel_id, thread_id=thread_id, priority=priority)
+        self.outbound_queue.put(outgoing_message)
+        self.wake_up() # the main loop might be waiting for incoming messages, and needs to send this one
+        return outgoing_message
+
+    def create_outgoing_message(self, sendable_text, *, channel_id, thread_id, priority):
         assert self.get_channel_name_by_id(channel_id) is not None, "`channel_id` must be a valid channel ID rather than \"{}\"".format(channel_id)
         assert isinstance(thread_id, str) or thread_id is None, "`thread_id` must be a valid Slack timestamp or None, rather than \"{}\"".format(thread_id)
         assert isinstance(sendable_text, str), "`text` must be a string rather than \"{}\"".format(sendable_text)
+        assert priority in OutboundMessageQueue.PRIORITIES, "`priority` must be one of {} rather than \"{}\"".format(", ".join(OutboundMessageQueue.PRIORITIES), priority)
+        with self.send_lock:
+            message_id = self.max_message_id
+            self.max_message_id += 1
+        return OutgoingMessage(message_id, sendable_text, channel_id, thread_id, priority)
+
+    def flush_outbound_messages(self):
+        """Send every queued message that can be sent right now without exceeding the rate limits."""
+        while True:
+            outgoing_message = self.outbound_queue.pop_ready(time.monotonic())
+            if outgoing_message is None: break
+            self.send_outgoing_message(outgoing_message)
 
-        # rate limit sending to 1 per second, since that's the Slack API limit
-        current_time = time.monotonic()
-        if current_time - self.last_say_time < 1:
-            time.sleep(max(0, 1 - (current_time - self.last_say_time)))
-            self.last_say_time += 1
-        else:
-            self.last_say_time = current_time
-
-        self.logger.info("sending message to channel {}: {}".format(self.get_channel_name_by_id(channel_id), sendable_text))
+    def send_outgoing_message(self, outgoing_message):
+        """Write `outgoing_message` to the RTM websocket immediately, regardless of rate limits."""
+        self.logger.info("sending message to channel %s: %s", self.get_channel_name_by_id(outgoing_message.channel_id), LogExcerpt(outgoing_message.sendable_text)) # formatted by the log writer thread, if at all
 
         # the correct method to use here is `rtm_send_message`, but it's technically broken since it doesn't send the message ID so we're going to do this properly ourselves
         # the message ID allows us to correlate messages with message responses, letting us ensure that messages are actually delivered properly
         # see the "Sending messages" heading at https://api.slack.com/rtm for more details
-        message_id = self.max_message_id
-        self.max_message_id += 1
-        if thread_id is not None: # message in a thread
-            self.client.server.send_to_websocket({
-                "id": message_id,
-                "type": "message",
-                "channel": channel_id,
-                "text": sendable_text,
-                "thread_ts": thread_id,
-            })
-        else: # top-level message
-            self.client.server.send_to_websocket({
-                "id": message_id,
-                "type": "message",
-                "channel": channel_id,
-                "text": sendable_text,
-            })
-        return message_id
+        message = {
+            "id": outgoing_message.message_id,
+            "type": "message",
+            "channel": outgoing_message.channel_id,
+            "text": outgoing_message.sendable_text,
+        }
+        if outgoing_message.thread_id is not None: message["thread_ts"] = outgoing_message.thread_id # message in a thread
+        outgoing_message.sent_time = time.monotonic()
+        self.pending_replies[outgoing_message.message_id] = outgoing_message # this needs to happen before sending, since the acknowledgement could arrive at any time afterwards
+        try:
+            with self.send_lock: self.client.server.send_to_websocket(message)
+        except Exception as e:
+            del self.pending_replies[outgoing_message.message_id]
+            outgoing_message.sent.set_exception(e)
+            outgoing_message.reply.set_exception(e)
+            raise
+        outgoing_message.sent.set_result(outgoing_message.message_id)
+
+    def resolve_pending_reply(self, message_dict):
+        """Resolve the `reply` future of the sent message that `message_dict` acknowledges, if it's a message acknowledgement."""
+        if "ok" not in message_dict: return
+        outgoing_message = self.pending_replies.pop(message_dict.get("reply_to"), None)
+        if outgoing_message is None or outgoing_message.reply.done(): return
+        self.metrics.record("bot.send_to_ack", time.monotonic() - outgoing_message.sent_time)
+        if not message_dict["ok"]:
+            outgoing_message.reply.set_exception(ValueError("Message sending error: {}".format(message_dict.get("error", {}).get("msg"))))
+        elif not isinstance(message_dict.get("ts"), str):
+            outgoing_message.reply.set_exception(ValueError("Invalid message timestamp: {}".format(message_dict.get("ts"))))
+        else:
+            outgoing_message.reply.set_result(message_dict["ts"])
+
+    def expire_pending_replies(self):
+        """Give up on sent messages that the server hasn't acknowledged within `reply_timeout` seconds, failing their `reply` futures with a `TimeoutError`."""
+        expiry_time = time.monotonic() - self.reply_timeout
+        while self.pending_replies:
+            message_id, outgoing_message = next(iter(self.pending_replies.items())) # messages are in the order they were sent, so the oldest one is first
+            if outgoing_message.sent_time > expiry_time: break
+            del self.pending_replies[message_id]
+            self.metrics.increment("bot.reply_timeouts")
+            if not outgoing_message.reply.done(): outgoing_message.reply.set_exception(TimeoutError("Message was never acknowledged"))
+
+    def say_future(self, sendable_text, *, channel_id, thread_id = None, priority = "interactive"):
+        """Queue `sendable_text` to be said in the channel with ID `channel_id`, returning a `concurrent.futures.Future` that resolves to the message timestamp once the server acknowledges the message."""
+        return self.queue_message(sendable_text, channel_id=channel_id, thread_id=thread_id, priority=priority).reply
 
     def say_complete(self, sendable_text, *, channel_id, thread_id = None, timeout = 5):
         """Say `sendable_text` in the channel with ID `channel_id`, waiting for the message to finish sending (raising a `TimeoutError` if this takes more than `timeout` seconds), returning the message timestamp."""
         assert float(timeout) > 0, "`timeout` must be a positive number rather than \"{}\"".format(timeout)
-        message_id = self.say(sendable_text, channel_id=channel_id, thread_id=thread_id)
-        message_timestamp = None
+        reply = self.say_future(sendable_text, channel_id=channel_id, thread_id=thread_id)
+        if threading.get_ident() != self.loop_thread_id: # the main loop will send the message and resolve the reply for us
+            try: return reply.result(timeout)
+            except concurrent.futures.TimeoutError: raise TimeoutError("Message sending timed out")
+
+        # we're on the main loop thread, so nothing else is going to send the message or receive its reply - do that ourselves while waiting
         start_time = time.monotonic()
-        while message_timestamp is None and time.monotonic() - start_time < timeout:
-            # peek at new messages to see if the response is written
-            for message_dict in self.peek_new_messages():
-                if "ok" in message_dict and message_dict.get("reply_to") == message_id: # received reply for the sent message
-                    if not message_dict["ok"]: raise ValueError("Message sending error: {}".format(message_dict.get("error", {}).get("msg")))
-                    assert isinstance(message_dict.get("ts"), str), "Invalid message timestamp: {}".format(message_dict.get("ts"))
-                    message_timestamp = message_dict["ts"]
-                    break
-            else:
-                time.sleep(0.01)
-        if message_timestamp is None: raise TimeoutError("Message sending timed out")
-        return message_timestamp
+        while not reply.done():
+            if time.monotonic() - start_time >= timeout: raise TimeoutError("Message sending timed out")
+            self.flush_outbound_messages()
+            for message_dict in self.peek_new_messages(): self.resolve_pending_reply(message_dict)
+            time.sleep(0.01)
+        return reply.result()
+
+    def log_failed_api_call(self, description, response_future):
+        """Log an error if the Web API call that `response_future` is for failed. Used for calls that nothing waits on."""
+        try: response = response_future.result()
+        except Exception as e:
+            self.logger.error("{} failed: {}".format(description, e))
+            return
+        if not response.get("ok"): self.logger.error("{} failed: error {}".format(description, response.get("error")))
 
     def react(self, channel_id, timestamp, emoticon):
-        """React with `emoticon` to the message with timestamp `timestamp` in channel with ID `channel_id`."""
+        """React with `emoticon` to the message with timestamp `timestamp` in channel with ID `channel_id`, without waiting for the reaction to be added. Returns a `concurrent.futures.Future` that resolves to the API response."""
         assert self.get_channel_name_by_id(channel_id) is not None, "`channel_id` must be a valid channel ID rather than \"{}\"".format(channel_id)
         assert isinstance(timestamp, str), "`timestamp` must be a string rather than \"{}\"".format(timestamp)
         assert isinstance(emoticon, str), "`emoticon` must be a string rather than \"{}\"".format(emoticon)
         emoticon = emoticon.strip(":")
-        self.logger.info("adding reaction :{}: to message with timestamp {} in channel {}".format(emoticon, timestamp, self.get_channel_name_by_id(channel_id)))
-        response = self.client.api_call("reactions.add", name=emoticon, channel=channel_id, timestamp=timestamp)
-        assert response.get("ok"), "Reaction addition failed: error {}".format(response.get("error"))
+        self.logger.info("adding reaction :%s: to message with timestamp %s in channel %s", emoticon, timestamp, self.get_channel_name_by_id(channel_id))
+        response_future = self.web_client.submit("reactions.add", ordering_key=(channel_id, timestamp), name=emoticon, channel=channel_id, timestamp=timestamp) # reactions to the same message need to stay in order, like poll options
+        response_future.add_done_callback(functools.partial(self.log_failed_api_call, "Reaction addition"))
+        return response_future
 
     def unreact(self, channel_id, timestamp, emoticon):
-        """React with `emoticon` to the message with timestamp `timestamp` in channel with ID `channel_id`."""
+        """Remove the `emoticon` reaction from the message with timestamp `timestamp` in channel with ID `channel_id`, without waiting for the reaction to be removed. Returns a `concurrent.futures.Future` that resolves to the API response."""
         assert self.get_channel_name_by_id(channel_id) is not None, "`channel_id` must be a valid channel ID rather than \"{}\"".format(channel_id)
-        assert isinstance(timestamp, str), "`timestamp` must be a string rather than \"{}\"".format(sendable_text)
-        assert isinstance(emoticon, str), "`emoticon` must be a string rather than \"{}\"".format(sendable_text)
+        assert isinstance(timestamp, str), "`timestamp` must be a string rather than \"{}\"".format(timestamp)
+        assert isinstance(emoticon, str), "`emoticon` must be a string rather than \"{}\"".format(emoticon)
         emoticon = emoticon.strip(":")
-        self.logger.info("removing reaction :{}: to message with timestamp {} in channel {}".format(emoticon, timestamp, self.get_channel_name_by_id(channel_id)))
-        response = self.client.api_call("reactions.remove", name=emoticon, channel=channel_id, timestamp=timestamp)
-        assert response.get("ok"), "Reaction removal failed: error {}".format(response.get("error"))
+        self.logger.info("removing reaction :%s: to message with timestamp %s in channel %s", emoticon, timestamp, self.get_channel_name_by_id(channel_id))
+        response_future = self.web_client.submit("reactions.remove", ordering_key=(channel_id, timestamp), name=emoticon, channel=channel_id, timestamp=timestamp) # reactions to the same message need to stay in order, like poll options
+        response_future.add_done_callback(functools.partial(self.log_failed_api_call, "Reaction removal"))
+        return response_future
 
     def get_channel_name_by_id(self, channel_id):
         """Returns the name of the channel with ID `channel_id`, or `None` if there are no channels with that ID. Channels include public channels, direct messages with other users, and private groups."""
         assert isinstance(channel_id, str), "`channel_id` must be a valid channel ID rather than \"{}\"".format(channel_id)
-        for entry in self.client.server.channels:
-            if entry.id == channel_id: return entry.name
-        return None
+        return self.directory.channel_names_by_id.get(channel_id)
 
     def get_channel_id_by_name(self, channel_name):
         """Returns the ID of the channel with name `channel_name`, or `None` if there are no channels with that name. Channels include public channels, direct messages with other users, and private groups."""
@@ -193,17 +645,12 @@ class SlackBot:
         if match: return match.group(1)
 
         # search by channel name
-        for entry in self.client.server.channels:
-            if entry.name == channel_name: return entry.id
-
-        return None
+        return self.directory.channel_ids_by_name.get(channel_name)
 
     def get_user_name_by_id(self, user_id):
         """Returns the username of the user with ID `user_id`, or `None` if there are no users with that ID."""
         assert isinstance(user_id, str), "`user_id` must be a valid user ID rather than \"{}\"".format(user_id)
-        for key, entry in self.client.server.users.items():
-            if entry.id == user_id: return entry.name
-        return None
+        return self.directory.user_names_by_id.get(user_id)
 
     def get_user_id_by_name(self, user_name):
         """Returns the ID of the user with username `user_name`, or `None` if there are no users with that username."""
@@ -215,83 +662,75 @@ class SlackBot:
         match = re.match(r"^<@(\w+)(?:\|[^>]+)?>$", user_name)
         if match: return match.group(1)
 
-        # search by user name
-        for key, entry in self.client.server.users.items():
-            if entry.name == user_name: return entry.id
+        # search by user name, then by user real name
+        if user_name in self.directory.user_ids_by_name: return self.directory.user_ids_by_name[user_name]
+        return self.directory.user_ids_by_real_name.get(user_name)
 
-        # search by user real name
-        for key, entry in self.client.server.users.items():
-            if entry.real_name == user_name: return entry.id
-
-        return None
+    def get_paginated_list(self, method, field, **kwargs):
+        """Returns every entry in the `field` list of the responses to the paginated Web API method `method` with arguments `kwargs`, or `None` (logging a warning) if any page fails."""
+        entries, cursor = [], None
+        while True:
+            response = self.web_client.api_call(method, limit=500, **kwargs, **({"cursor": cursor} if cursor else {}))
+            if not response.get("ok"):
+                self.logger.warning("{} listing failed: error {}".format(method, response.get("error")))
+                return None
+            entries.extend(response.get(field, []))
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not cursor: return entries
+
+    def load_direct_message_channels(self):
+        """Fill the direct message channel index from a paginated `im.list` listing of every direct message channel we have. If the listing fails, direct message channels are opened one user at a time as needed instead."""
+        ims = self.get_paginated_list("im.list", "ims")
+        if ims is None: return # fall back to opening direct message channels individually
+        self.directory.load_direct_message_channels(ims)
+        self.logger.info("loaded {} direct message channels".format(len(ims)))
 
     def get_direct_message_channel_id_by_user_id(self, user_id):
-        """Returns the channel ID of the direct message with the user with ID `user_id`, or `None` if the ID is invalid."""
-        listing = self.client.api_call("im.list")["ims"]
-        for entry in listing:
-            if entry["user"] == user_id: return entry["id"]
-        return None
+        """Returns the channel ID of the direct message with the user with ID `user_id`, opening the direct message if it doesn't exist yet, or `None` if the ID is invalid."""
+        channel_id = self.directory.direct_message_channel_ids_by_user_id.get(user_id)
+        if channel_id is not None: return channel_id
+        response = self.web_client.api_call("im.open", user=user_id)
+        if not response.get("ok") or not isinstance(response.get("channel"), dict): return None
+        channel_id = self.directory.direct_message_channel_ids_by_user_id[user_id] = response["channel"]["id"]
+        self.directory.add_direct_message_channel(channel_id)
+        return channel_id
+
+    def load_user_infos(self):
+        """Fill the user metadata cache from a paginated `users.list` listing of every user in the team. If the listing fails, user metadata is retrieved one user at a time as needed instead."""
+        user_infos = self.get_paginated_list("users.list", "members")
+        if user_infos is None: return # fall back to retrieving users individually
+        self.directory.load_user_infos(user_infos)
+        self.logger.info("loaded user info for {} users".format(len(user_infos)))
 
     def get_user_info_by_id(self, user_id):
         """Returns a [metadata dictionary](https://api.slack.com/types/user) about the user with ID `user_id`."""
+        user_info = self.directory.user_infos_by_id.get(user_id)
+        if user_info is not None: return user_info
         assert self.get_user_name_by_id(user_id) is not None, "`user_id` must exist and be a valid user ID rather than \"{}\"".format(user_id)
-        self.logger.info("retrieving user info for user {}".format(self.get_user_name_by_id(user_id)))
-        response = self.client.api_call("users.info", user=user_id)
+        self.logger.info("retrieving user info for user %s", self.get_user_name_by_id(user_id))
+        response = self.web_client.api_call("users.info", user=user_id)
         assert response.get("ok"), "User info request failed: error {}".format(response.get("error"))
         assert isinstance(response.get("user"), dict) and "id" in response["user"], "User info response malformed: {}".format(response.get("user"))
+        self.directory.user_infos_by_id[user_id] = response["user"]
         return response["user"]
 
     def get_user_is_bot(self, user_id):
         """Returns `True` if the user with ID `user_id` is a bot user, `False` otherwise."""
         if user_id == "USLACKBOT": return True # for some reason, Slack doesn't consider Slackbot a real bot
-        user_info = self.get_user_info_by_id_cached(user_id)
+        user_info = self.get_user_info_by_id(user_id)
         return user_info.get("is_bot", False)
 
     def server_text_to_sendable_text(self, server_text):
         """Returns `server_text`, a string in Slack server message format, converted into a string in Slack sendable message format."""
-        assert isinstance(server_text, str), "`server_text` must be a string rather than \"{}\"".format(server_text)
-        text_without_special_sequences = re.sub(r"<[^<>]*>", "", server_text)
-        assert "<" not in text_without_special_sequences and ">" not in text_without_special_sequences, "Invalid special sequence in server text \"{}\", perhaps some text needs to be escaped"
-
-        # process link references
-        def process_special_sequence(match):
-            original, body = match.group(0), match.group(1).split("|")[0]
-            if body.startswith("#"): return original # channel reference, should send unchanged
-            if body.startswith("@"): return original # user reference, should send unchanged
-            if body.startswith("!"): return original # special command, should send unchanged
-            return body # link, should remove angle brackets and label in order to allow it to linkify
-        return re.sub(r"<(.*?)>", process_special_sequence, server_text)
+        return self.text_codec.server_text_to_sendable_text(server_text)
 
     def text_to_sendable_text(self, text):
         """Returns `text`, a plain text string, converted into a string in Slack sendable message format."""
-        assert isinstance(text, str), "`text` must be a string rather than \"{}\"".format(text)
-        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        return text_to_sendable_text(text)
 
     def sendable_text_to_text(self, sendable_text):
         """Returns `sendable_text`, a string in Slack sendable message format, converted into a plain text string. The transformation can lose some information for escape sequences, such as link labels."""
-        assert isinstance(sendable_text, str), "`sendable_text` must be a string rather than \"{}\"".format(sendable_text)
-        text_without_special_sequences = re.sub(r"<[^<>]*>", "", sendable_text)
-        assert "<" not in text_without_special_sequences and ">" not in text_without_special_sequences, "Invalid special sequence in sendable text \"{}\", perhaps some text needs to be escaped"
-
-        # process link references
-        def process_special_sequence(match):
-            original, body = match.group(0), match.group(1).split("|")[0]
-            if body.startswith("#"): # channel reference
-                channel_name = self.get_channel_name_by_id(body[1:])
-                if channel_name is None: return original
-                return "#" + channel_name
-            if body.startswith("@"): # user reference
-                user_name = self.get_user_name_by_id(body[1:])
-                if user_name is None: return original
-                return "@" + user_name
-            if body.startswith("!"): # special command
-                if body == "!channel": return "@channel"
-                if body == "!group": return "@group"
-                if body == "!everyone": return "@everyone"
-            return original
-        raw_text = re.sub(r"<(.*?)>", process_special_sequence, sendable_text)
-
-        return raw_text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+        return self.text_codec.sendable_text_to_text(sendable_text)
 
     def administrator_console(self, namespace):
         """Start an interactive administrator Python console with namespace `namespace`."""
@@ -308,6 +747,173 @@ class SlackBot:
         console_thread = threading.Thread(target=start_console, daemon=True) # thread dies when main thread (the only non-daemon thread) exits
         console_thread.start()
 
+class AsyncSlackBot(SlackBot):
+    """
+    Asyncio-based Slack bot base class. Exposes the same functionality as `SlackBot`, but everything that might wait on the network is a coroutine.
+
+    Incoming messages are each handled in their own task, so a slow handler for one message doesn't stop other messages from being handled in the meantime. Blocking Slack library calls are run in the event loop's default executor.
+
+    This class is intended to be subclassed, with the `on_step` and `on_message` coroutines overridden to do more useful things.
+    """
+    def __init__(self, token, logger=None):
+        super().__init__(token, logger)
+        self.loop = None # event loop that the bot is running on, available once the bot is started
+        self.synchronous_adapter = SynchronousBotAdapter(self) # synchronous interface to this bot, for use from other threads
+        self.running_tasks = set() # tasks started by the bot that haven't finished yet (the event loop only keeps weak references to tasks)
+
+    def get_inbound_backlog(self):
+        return len(self.running_tasks)
+
+    async def on_step(self):
+        self.logger.info("step handler called")
+    async def on_message(self, message_dict):
+        self.logger.info("message handler called with message {}".format(message_dict))
+
+    def start_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try: loop.run_until_complete(self.run_forever())
+        except KeyboardInterrupt: pass
+        self.logger.info("shutting down...")
+
+    async def run_forever(self):
+        while True:
+            try: await self.start() # start the main loop
+            except Exception:
+                self.logger.error("main loop threw exception:\n{}".format(traceback.format_exc()))
+                await asyncio.sleep(self.get_reconnect_delay())
+
+    async def call_blocking(self, function, *args, **kwargs):
+        """Returns the result of calling `function` with arguments `args` and keyword arguments `kwargs` in the event loop's default executor, without blocking the event loop."""
+        return await self.loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    async def api_call(self, method, **kwargs):
+        """Returns the response of calling the Slack Web API method `method` with arguments `kwargs`, without blocking the event loop."""
+        return await asyncio.wrap_future(self.web_client.submit(method, **kwargs), loop=self.loop)
+
+    def spawn(self, coroutine):
+        """Run `coroutine` in a new task on the bot's event loop, returning the task."""
+        task = self.loop.create_task(coroutine)
+        self.running_tasks.add(task)
+        task.add_done_callback(self.running_tasks.discard)
+        return task
+
+    async def run_step_handler(self):
+        try: await self.on_step()
+        except Exception:
+            self.logger.error("step processing threw exception:\n{}".format(traceback.format_exc()))
+
+    async def run_message_handler(self, message_dict):
+        try: await self.on_message(message_dict)
+        except Exception:
+            self.logger.error("message processing threw exception:\n%s\n\nmessage contents:\n%s", traceback.format_exc(), LogExcerpt(message_dict))
+
+    async def start(self):
+        self.loop = asyncio.get_event_loop()
+
+        await self.call_blocking(self.connect) # connecting makes blocking requests, so it's done in another thread
+
+        sock = self.client.server.websocket.sock
+        readable = asyncio.Event()
+        self.loop.add_reader(sock, readable.set)
+        self.loop.add_reader(self.wakeup_receiver, readable.set)
+        try:
+            last_ping = time.monotonic()
+            step_task = None
+            deadline = None
+            while True:
+                self.record_loop_lag(deadline)
+                deadline = None
+                readable.clear()
+
+                # call all the step callbacks, unless the previous step is still running
+                if step_task is None or step_task.done(): step_task = self.spawn(self.run_step_handler())
+                last_step = time.monotonic()
+
+                # start a message handler task for each newly received message, except ones shed due to overload
+                message_dicts = self.retrieve_unprocessed_incoming_messages()
+                for message_dict in message_dicts: self.process_connection_event(message_dict)
+                for message_dict in self.triage_incoming_messages(message_dicts): self.spawn(self.run_message_handler(message_dict))
+
+                # send any queued messages that are within the rate limits
+                try:
+                    while self.wakeup_receiver.recv(4096): pass
+                except BlockingIOError: pass
+                self.flush_outbound_messages()
+                self.expire_pending_replies()
+                self.dump_metrics_if_due()
+
+                # ping the server periodically to make sure our connection is kept alive
+                if time.monotonic() - last_ping > self.ping_interval:
+                    self.client.server.ping()
+                    last_ping = time.monotonic()
+
+                # wait until the websocket is readable or a message is queued, or until a step, ping, or queued message is due
+                if self.unprocessed_incoming_messages: continue
+                if hasattr(sock, "pending") and sock.pending(): continue # the SSL layer has already buffered decrypted data, which won't show up in `select`
+                deadline = min(self.get_next_step_time(last_step), last_ping + self.ping_interval)
+                next_send_time = self.outbound_queue.get_next_send_time(time.monotonic())
+                if next_send_time is not None: deadline = min(deadline, next_send_time)
+                try: await asyncio.wait_for(readable.wait(), max(0, deadline - time.monotonic()))
+                except asyncio.TimeoutError: pass
+        finally:
+            self.loop.remove_reader(sock)
+            self.loop.remove_reader(self.wakeup_receiver)
+
+    async def say(self, sendable_text, *, channel_id, thread_id = None, priority = "normal"):
+        """Coroutine version of `SlackBot.say`. Queueing a message never waits, so this returns the message ID right away."""
+        return super().say(sendable_text, channel_id=channel_id, thread_id=thread_id, priority=priority)
+
+    async def say_complete(self, sendable_text, *, channel_id, thread_id = None, timeout = 5):
+        """Say `sendable_text` in the channel with ID `channel_id`, waiting for the message to finish sending (raising a `TimeoutError` if this takes more than `timeout` seconds), returning the message timestamp."""
+        assert float(timeout) > 0, "`timeout` must be a positive number rather than \"{}\"".format(timeout)
+        reply = asyncio.wrap_future(self.say_future(sendable_text, channel_id=channel_id, thread_id=thread_id), loop=self.loop)
+        try: return await asyncio.wait_for(reply, timeout)
+        except asyncio.TimeoutError: raise TimeoutError("Message sending timed out")
+
+    async def react(self, channel_id, timestamp, emoticon):
+        """Coroutine version of `SlackBot.react`. The reaction is added in the background, so this returns the `concurrent.futures.Future` for the API response right away."""
+        return super().react(channel_id, timestamp, emoticon)
+
+    async def unreact(self, channel_id, timestamp, emoticon):
+        """Coroutine version of `SlackBot.unreact`. The reaction is removed in the background, so this returns the `concurrent.futures.Future` for the API response right away."""
+        return super().unreact(channel_id, timestamp, emoticon)
+
+    async def get_direct_message_channel_id_by_user_id(self, user_id):
+        """Coroutine version of `SlackBot.get_direct_message_channel_id_by_user_id`, which opens the direct message in the event loop's default executor if it isn't open yet."""
+        channel_id = self.directory.direct_message_channel_ids_by_user_id.get(user_id)
+        if channel_id is not None: return channel_id # avoid an executor round trip for the common case
+        return await self.call_blocking(super().get_direct_message_channel_id_by_user_id, user_id)
+
+    async def get_user_info_by_id(self, user_id):
+        """Coroutine version of `SlackBot.get_user_info_by_id`, which retrieves the user info in the event loop's default executor if it isn't cached yet."""
+        user_info = self.directory.user_infos_by_id.get(user_id)
+        if user_info is not None: return user_info # avoid an executor round trip for the common case, since this is called for nearly every message
+        return await self.call_blocking(super().get_user_info_by_id, user_id)
+
+    async def get_user_is_bot(self, user_id):
+        """Returns `True` if the user with ID `user_id` is a bot user, `False` otherwise."""
+        if user_id == "USLACKBOT": return True # for some reason, Slack doesn't consider Slackbot a real bot
+        user_info = await self.get_user_info_by_id(user_id)
+        return user_info.get("is_bot", False)
+
+class SynchronousBotAdapter:
+    """
+    Synchronous interface to an `AsyncSlackBot` instance, for code that runs outside of the bot's event loop, such as synchronous plugins and the administrator console.
+
+    Coroutine methods of the bot become blocking methods that run the coroutine on the bot's event loop and wait for its result, while all other attributes are passed through unchanged. This must not be used from the event loop thread itself, since that would deadlock.
+    """
+    def __init__(self, async_bot):
+        self.async_bot = async_bot
+
+    def __getattr__(self, name):
+        value = getattr(self.async_bot, name)
+        if not asyncio.iscoroutinefunction(value): return value
+        def call_on_event_loop(*args, **kwargs):
+            assert self.async_bot.loop is not None, "Bot must be started before calling `{}`".format(name)
+            return asyncio.run_coroutine_threadsafe(value(*args, **kwargs), self.async_bot.loop).result()
+        return call_on_event_loop
+
 class SlackDebugBot(SlackBot):
     """
     Slack debug bot - when started, exposes a command line interface for testing and debugging your Slack bot.
@@ -322,6 +928,8 @@ class SlackDebugBot(SlackBot):
         else: self.logger = logger
 
         self.messages = []
+        self.text_codec = SlackTextCodec(self.get_channel_name_by_id, self.get_user_name_by_id)
+        self.metrics = Metrics()
 
         self.max_message_id = 1
         self.channel_name = "general"
@@ -329,6 +937,8 @@ class SlackDebugBot(SlackBot):
 
     def start_loop(self): self.start()
 
+    def wake_up(self): pass # the main loop checks for input every 10 milliseconds anyway
+
     def start(self):
         import threading, queue
         import readline # this makes arrow keys work for input()
@@ -436,7 +1046,7 @@ class SlackDebugBot(SlackBot):
         self.messages.append(message)
         self.on_message(message)
 
-    def say(self, sendable_text, *, channel_id, thread_id = None):
+    def say(self, sendable_text, *, channel_id, thread_id = None, priority = "normal"):
         assert self.get_channel_name_by_id(channel_id) is not None, "`channel_id` must be a valid channel ID rather than \"{}\"".format(channel_id)
         assert isinstance(thread_id, str) or thread_id is None, "`thread_id` must be a valid Slack timestamp or None, rather than \"{}\"".format(thread_id)
         assert isinstance(sendable_text, str), "`sendable_text` must be a string rather than \"{}\"".format(sendable_text)
@@ -471,6 +1081,12 @@ class SlackDebugBot(SlackBot):
         self.max_message_id += 1
         return message_id
 
+    def say_future(self, sendable_text, *, channel_id, thread_id = None, priority = "interactive"):
+        self.say(sendable_text, channel_id=channel_id, thread_id=thread_id)
+        reply = concurrent.futures.Future()
+        reply.set_result(self.messages[-1]["ts"])
+        return reply
+
     def say_complete(self, sendable_text, *, channel_id, thread_id = None, timeout = 5):
         self.say(sendable_text, channel_id=channel_id, thread_id=thread_id)
         return self.messages[-1]["ts"]
@@ -487,6 +1103,10 @@ class SlackDebugBot(SlackBot):
         print("\r\033[K" + "#{:<11}| Botty reacted to \"{}\" with :{}:".format(self.get_channel_name_by_id(channel_id), target_message["text"], emoticon)) # clear the current line using Erase in Line ANSI escape code
         print("#{:<11}| Me: ".format(self.channel_name), end="", flush=True)
 
+        response_future = concurrent.futures.Future()
+        response_future.set_result({"ok": True})
+        return response_future
+
     def unreact(self, channel_id, timestamp, emoticon):
         assert self.get_channel_name_by_id(channel_id) is not None, "`channel_id` must be a valid channel ID rather than \"{}\"".format(channel_id)
         assert isinstance(timestamp, str), "`timestamp` must be a string rather than \"{}\"".format(sendable_text)
@@ -499,6 +1119,10 @@ class SlackDebugBot(SlackBot):
         print("\r\033[K" + "#{:<11}| Botty unreacted to \"{}\" with {}".format(self.get_channel_name_by_id(channel_id), target_message["text"], emoticon)) # clear the current line using Erase in Line ANSI escape code
         print("#{:<11}| Me: ".format(self.channel_name), end = "", flush=True)
 
+        response_future = concurrent.futures.Future()
+        response_future.set_result({"ok": True})
+        return response_future
+
     def get_channel_name_by_id(self, channel_id):
         assert isinstance(channel_id, str), "`channel_id` must be a valid channel ID rather than \"{}\"".format(channel_id)
         return channel_id[1:]
@@ -1,114 +1,760 @@
 #!/usr/bin/env python3
 
-import sys, logging
+import os, sys, re, time, logging, logging.handlers
+import traceback, threading, signal
+import ast, importlib, importlib.util
+import asyncio, contextvars, functools, itertools
+import multiprocessing, queue, pickle, zlib
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
 
-from bot import SlackBot
-
-# process settings
-#logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
-logging.basicConfig(filename="botty.log", level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+from bot import SlackBot, AsyncSlackBot, SlackDebugBot, SlackDirectory, TokenBucket
+from logs import LogExcerpt, start_background_logging
+from recent_messages import RecentMessageStore
+from scheduler import Scheduler
+from plugins.utilities import BasePlugin, AsyncBasePlugin
 
 def initialize_plugins(botty):
-    """Import, register, and initialize Botty plugins. Edit the body of this function to change which plugins are loaded."""
-    from plugins.arithmetic import ArithmeticPlugin; botty.register_plugin(ArithmeticPlugin(botty))
-    from plugins.timezones import TimezonesPlugin; botty.register_plugin(TimezonesPlugin(botty))
-    from plugins.poll import PollPlugin; botty.register_plugin(PollPlugin(botty))
-    from plugins.wiki import WikiPlugin; botty.register_plugin(WikiPlugin(botty))
-    from plugins.haiku import HaikuPlugin; botty.register_plugin(HaikuPlugin(botty))
-    from plugins.personality import PersonalityPlugin; botty.register_plugin(PersonalityPlugin(botty))
-    from plugins.events import EventsPlugin; botty.register_plugin(EventsPlugin(botty))
-    from plugins.now_i_am_dude import NowIAmDudePlugin; botty.register_plugin(NowIAmDudePlugin(botty))
-    from plugins.generate_text import GenerateTextPlugin; botty.register_plugin(GenerateTextPlugin(botty))
-    from plugins.big_text import BigTextPlugin; botty.register_plugin(BigTextPlugin(botty))
-    from plugins.uw_courses import UWCoursesPlugin; botty.register_plugin(UWCoursesPlugin(botty))
-    from plugins.spaaace import SpaaacePlugin; botty.register_plugin(SpaaacePlugin(botty))
-    from plugins.agario import AgarioPlugin; botty.register_plugin(AgarioPlugin(botty))
-    from plugins.snek import SnekPlugin; botty.register_plugin(SnekPlugin(botty))
-
-if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] in {"--help", "-h", "-?"}):
-    print("Usage: {} --help".format(sys.argv[0]))
-    print("    Show this help message")
-    print("Usage: {}".format(sys.argv[0]))
-    print("    Start the Botty chatbot for Slack in testing mode with a console chat interface")
-    print("Usage: {} SLACK_BOT_TOKEN".format(sys.argv[0]))
-    print("    Start the Botty chatbot for the Slack chat associated with SLACK_BOT_TOKEN, and enter the in-process Python REPL")
-    print("    SLACK_BOT_TOKEN is a Slack API token (can be obtained from https://api.slack.com/)")
-    sys.exit(1)
-
-DEBUG = len(sys.argv) < 2
-if DEBUG:
-    from bot import SlackDebugBot as SlackBot
-    SLACK_TOKEN = ""
-    print("No Slack API token specified in command line arguments; starting in local debug mode...")
-    print()
-else:
-    SLACK_TOKEN = sys.argv[1]
-
-class Botty(SlackBot):
+    """Register Botty plugins. Edit the body of this function to change which plugins are loaded."""
+    # plugins are registered as stand-ins, and only imported and initialized once Botty is connected (or when they're first needed), so that their dependencies and data files don't slow down startup
+    botty.register_lazy_plugin("plugins.arithmetic", "ArithmeticPlugin")
+    botty.register_lazy_plugin("plugins.timezones", "TimezonesPlugin")
+    botty.register_lazy_plugin("plugins.poll", "PollPlugin")
+    botty.register_lazy_plugin("plugins.wiki", "WikiPlugin")
+    botty.register_lazy_plugin("plugins.haiku", "HaikuPlugin")
+    botty.register_lazy_plugin("plugins.personality", "PersonalityPlugin")
+    botty.register_lazy_plugin("plugins.events", "EventsPlugin")
+    botty.register_lazy_plugin("plugins.now_i_am_dude", "NowIAmDudePlugin")
+    botty.register_lazy_plugin("plugins.generate_text", "GenerateTextPlugin")
+    botty.register_lazy_plugin("plugins.big_text", "BigTextPlugin")
+    botty.register_lazy_plugin("plugins.uw_courses", "UWCoursesPlugin")
+    botty.register_lazy_plugin("plugins.spaaace", "SpaaacePlugin")
+    botty.register_lazy_plugin("plugins.agario", "AgarioPlugin")
+    botty.register_lazy_plugin("plugins.snek", "SnekPlugin")
+
+def get_declared_triggers(module_name, class_name):
+    """Returns the `trigger_event_types` and `trigger_patterns` class attributes of the class `class_name` in the module `module_name`, read from the module's source code without importing it. Attributes that aren't written as literals in the class body are returned as `None`, which matches every event."""
+    triggers = {"trigger_event_types": None, "trigger_patterns": None}
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or not spec.origin or not spec.origin.endswith(".py"): return triggers["trigger_event_types"], triggers["trigger_patterns"]
+    with open(spec.origin, "r") as f: module_tree = ast.parse(f.read(), spec.origin)
+    for node in module_tree.body:
+        if not (isinstance(node, ast.ClassDef) and node.name == class_name): continue
+        for statement in node.body:
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1 and isinstance(statement.targets[0], ast.Name) and statement.targets[0].id in triggers:
+                try: triggers[statement.targets[0].id] = ast.literal_eval(statement.value)
+                except ValueError: pass # not a literal, so we can't know what it matches without importing the module
+    return triggers["trigger_event_types"], triggers["trigger_patterns"]
+
+class LazyPlugin(BasePlugin):
+    """
+    Stand-in for the plugin class `class_name` in the module `module_name`, which imports and initializes the plugin the first time it's needed, then replaces itself with the plugin in Botty's list of plugins.
+
+    The stand-in has the same triggers as the plugin class, read from the plugin's source code, so events the plugin wouldn't handle anyway don't cause it to be loaded. Call `load` to load the plugin right away.
+    """
+    def __init__(self, bot, module_name, class_name):
+        super().__init__(bot)
+        self.botty = bot # `bot` is replaced by a `SynchronousBotAdapter` when registered with `AsyncBotty`, but the plugin should be initialized with the bot itself
+        self.module_name, self.class_name = module_name, class_name
+        self.trigger_event_types, self.trigger_patterns = get_declared_triggers(module_name, class_name)
+        self.plugin = None # the plugin instance, once it's been loaded
+        self.lock = threading.Lock()
+
+    def __repr__(self): return "<LazyPlugin {}.{}>".format(self.module_name, self.class_name)
+
+    def load(self):
+        """Import and initialize the plugin if it hasn't been already, replace this stand-in with it in Botty's list of plugins, and return it. If the plugin fails to load, the stand-in is removed from the list of plugins and the exception is raised."""
+        with self.lock:
+            if self.plugin is not None: return self.plugin
+            start_time = time.perf_counter()
+            try:
+                plugin_class = getattr(importlib.import_module(self.module_name), self.class_name)
+                import_time = time.perf_counter() - start_time
+                plugin = plugin_class(self.botty)
+                initialization_time = time.perf_counter() - start_time - import_time
+            except Exception:
+                if self in self.botty.plugins: self.botty.plugins.remove(self)
+                raise
+            if isinstance(self.botty, AsyncBotty) and not isinstance(plugin, AsyncBasePlugin): plugin.bot = self.botty.synchronous_adapter # same as `AsyncBotty.register_plugin`
+
+            self.botty.plugin_load_times[self.class_name] = (import_time, initialization_time)
+            self.logger.info("loaded {} in {:.3f} seconds ({:.3f} seconds importing, {:.3f} seconds initializing)".format(self.class_name, import_time + initialization_time, import_time, initialization_time))
+            plugins = self.botty.plugins
+            if self in plugins: plugins[plugins.index(self)] = plugin # Botty's trigger index notices the change and rebuilds itself
+            self.plugin = plugin
+            return plugin
+
+    def on_message(self, message):
+        plugin = self.load()
+        with plugin.handler_lock: handled = plugin.on_message(message) # the loaded plugin might be called directly from other threads by now
+        if asyncio.iscoroutine(handled): handled = asyncio.run_coroutine_threadsafe(handled, self.botty.loop).result() # asynchronous plugin loaded by `AsyncBotty`, where stand-ins run in the plugin worker thread
+        return handled
+
+def load_lazy_plugins(botty):
+    """Load every `LazyPlugin` stand-in registered with `botty`, in registration order, then log how long each plugin took to import and initialize. Plugins that fail to load are logged and left out."""
+    start_time = time.perf_counter()
+    for plugin in list(botty.plugins):
+        if not isinstance(plugin, LazyPlugin): continue
+        try: plugin.load()
+        except Exception:
+            botty.logger.error("plugin {} failed to load and was disabled:\n{}".format(plugin.class_name, traceback.format_exc()))
+    botty.logger.info("loaded plugins in {:.2f} seconds\n{}".format(time.perf_counter() - start_time, format_startup_profile(botty)))
+
+def log_received_event(botty, message_dict):
+    """Dump the received event `message_dict` to the log if the DEBUG level is enabled. Dumps are sampled by `received_event_log_bucket` so that bursts of events don't flood the log, and each one says how many events were skipped before it."""
+    if not botty.logger.isEnabledFor(logging.DEBUG): return
+    current_time = time.monotonic()
+    if botty.received_event_log_bucket.get_available_time(current_time) > current_time:
+        botty.skipped_event_log_count += 1
+        return
+    botty.received_event_log_bucket.take(current_time)
+    botty.logger.debug("received message %s (%s skipped since the last one logged)", LogExcerpt(message_dict), botty.skipped_event_log_count)
+    botty.skipped_event_log_count = 0
+
+def format_startup_profile(botty):
+    """Returns a human-readable table of how long it took `botty` to connect, and how long each loaded plugin took to import and initialize, slowest first."""
+    lines = ["time to connected: {}".format("not connected yet" if botty.time_to_connected is None else "{:.3f} seconds".format(botty.time_to_connected))]
+    lines.append("{:<25} {:>11} {:>11}".format("PLUGIN", "IMPORT (ms)", "INIT (ms)"))
+    for class_name, (import_time, initialization_time) in sorted(botty.plugin_load_times.items(), key=lambda entry: -sum(entry[1])):
+        lines.append("{:<25} {:>11.1f} {:>11.1f}".format(class_name, import_time * 1000, initialization_time * 1000))
+    return "\n".join(lines)
+
+response_context = contextvars.ContextVar("response_context", default=None) # timestamp, thread ID, and channel ID of the message being handled by the current thread or task
+
+class OrderedDispatcher:
+    """Runs jobs on a pool of worker threads, such that jobs submitted with the same key run one at a time in the order they were submitted, while jobs with different keys can run in parallel."""
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.pending_jobs = {} # mapping from keys to deques of jobs that haven't started yet, for every key that has jobs running or waiting to run
+
+    def submit(self, key, function, *args):
+        """Run `function` with arguments `args` on a worker thread once all previously submitted jobs with key `key` have finished."""
+        with self.lock:
+            if key in self.pending_jobs: # there's already a worker running jobs for this key, it'll get to this one after the others
+                self.pending_jobs[key].append((function, args))
+                return
+            self.pending_jobs[key] = deque([(function, args)])
+        self.executor.submit(self.run_jobs, key)
+
+    def run_jobs(self, key):
+        while True:
+            with self.lock:
+                jobs = self.pending_jobs[key]
+                if not jobs:
+                    del self.pending_jobs[key]
+                    return
+                function, args = jobs.popleft()
+            function(*args)
+
+    def get_backlog(self):
+        """Returns the number of jobs that have been submitted but haven't started yet."""
+        with self.lock: return sum(len(jobs) for jobs in self.pending_jobs.values())
+
+class PluginTriggerIndex:
+    """
+    Index of the events that each plugin in `plugins` might handle, built from the plugins' `trigger_event_types` and `trigger_patterns` attributes, so that each event is only passed to the plugins that could possibly handle it.
+
+    Plugins are grouped by event type once, and every trigger pattern is compiled once, up front. Each pattern is searched for at most once per message, even if several plugins share it, and a plugin's remaining patterns are skipped as soon as one matches. Patterns are searched separately rather than as one big alternation, since for the built-in plugins' trigger patterns the combined pattern measured about 1.2 times slower (Python's backtracking regex engine can't use each pattern's own literal prefix and character set optimizations inside an alternation). Whether combining helps depends on the patterns, though - `PersonalityPlugin`'s patterns are about 3 times faster combined, so it prefilters with one alternation.
+    """
+    def __init__(self, plugins):
+        self.plugins = list(plugins)
+        compiled_patterns = {} # mapping from pattern strings to compiled patterns, so that plugins with the same pattern share it
+        self.plugin_triggers = [] # list of plugins, their event types, and their compiled trigger patterns, in registration order
+        for plugin in self.plugins:
+            patterns = plugin.trigger_patterns
+            if patterns is not None: patterns = [compiled_patterns[pattern] if pattern in compiled_patterns else compiled_patterns.setdefault(pattern, re.compile(pattern)) for pattern in patterns]
+            self.plugin_triggers.append((plugin, plugin.trigger_event_types, patterns))
+        self.candidates_by_event_type = {} # mapping from event types to the plugins that handle them along with their trigger patterns, filled in as event types are seen
+        self.step_plugins = [plugin for plugin in self.plugins if type(plugin).on_step not in {BasePlugin.on_step, AsyncBasePlugin.on_step}] # plugins that override `on_step`, in registration order
+
+    def get_candidates(self, message):
+        """Returns the plugins that might handle the `IncomingMessage` instance `message`, in registration order."""
+        event_type = message.event_type
+        candidates = self.candidates_by_event_type.get(event_type)
+        if candidates is None:
+            candidates = self.candidates_by_event_type[event_type] = [
+                (plugin, patterns if event_type == "message" else None) # trigger patterns only apply to messages
+                for plugin, event_types, patterns in self.plugin_triggers
+                if event_types is None or event_type in event_types
+            ]
+        if event_type != "message": return [plugin for plugin, _ in candidates]
+
+        try: text = message.text
+        except ValueError: text = None # messages without text can't match any trigger patterns
+        result, pattern_matches = [], {} # mapping from compiled patterns to whether they matched the text, for patterns that have been searched for so far
+        for plugin, patterns in candidates:
+            if patterns is None: # plugin wants every message
+                result.append(plugin)
+                continue
+            if text is None: continue
+            for pattern in patterns:
+                is_match = pattern_matches.get(pattern)
+                if is_match is None: is_match = pattern_matches[pattern] = pattern.search(text) is not None
+                if is_match:
+                    result.append(plugin)
+                    break
+        return result
+
+class BottyMixin:
+    """
+    Plugin management shared by `Botty` and `AsyncBotty`, mixed in ahead of the `SlackBot` subclass that they run on: plugin registration (including lazily loaded plugins), the trigger index, step scheduling, recent messages, and working out where responses to the message being handled should go.
+
+    Subclasses implement `on_step`, `on_message`, and the `respond`/`reply` methods on top of this, in either synchronous or asynchronous style.
+    """
     def __init__(self, token):
         super().__init__(token)
         self.plugins = []
-        self.last_message_timestamp = None
-        self.last_message_thread_id = None
-        self.last_message_channel_id = None
-        self.recent_events = deque(maxlen=2000) # store the last 2000 events
+        self.last_message_context = (None, None, None) # timestamp, thread ID, and channel ID of the most recently received message, replaced all at once so that other threads never see a mix of two messages
+        self.recent_messages = RecentMessageStore() # recent text messages in each channel and thread
+        self.scheduler = Scheduler(self.wake_up) # calls scheduled by plugins with `call_later` and `call_every`, made by the step handler
+        self.idle_step_interval = 1 # maximum number of seconds between step handler calls when no plugins override `on_step` and no scheduled calls are due sooner
+        self.trigger_index = PluginTriggerIndex(self.plugins)
+        self.creation_time = time.monotonic()
+        self.time_to_connected = None # number of seconds between creating the bot and first connecting to Slack
+        self.plugin_load_times = {} # mapping from plugin class names to the number of seconds it took to import and initialize them, for plugins registered with `register_lazy_plugin`
+        self.plugin_loader = None # thread that loads lazily registered plugins in the background
+        self.metrics.add_gauge("bot.inbound_backlog", self.get_inbound_backlog)
+        self.metrics.add_gauge("bot.recent_messages", lambda: len(self.recent_messages))
+        self.received_event_log_bucket = TokenBucket(10, 100) # limits how many received events are dumped to the log at the DEBUG level, since there can be hundreds every second
+        self.skipped_event_log_count = 0 # number of received events that weren't dumped to the log since the last one that was
 
     def register_plugin(self, plugin_instance):
         self.plugins.append(plugin_instance)
 
-    def on_step(self):
-        for plugin in self.plugins:
-            if plugin.on_step(): break
+    def register_lazy_plugin(self, module_name, class_name):
+        """Register the plugin class `class_name` from the module `module_name` without importing it yet - it's imported and initialized in the background once the bot connects, or when it's first needed, whichever comes first."""
+        self.register_plugin(LazyPlugin(self, module_name, class_name))
+
+    def load_plugins_in_background(self):
+        """Start loading every lazily registered plugin in a background thread, if that hasn't been started already."""
+        if self.plugin_loader is not None: return
+        self.plugin_loader = threading.Thread(target=load_lazy_plugins, args=(self,), name="PluginLoader", daemon=True)
+        self.plugin_loader.start()
+
+    def on_connected(self):
+        super().on_connected()
+        if self.time_to_connected is None:
+            self.time_to_connected = time.monotonic() - self.creation_time
+            self.logger.info("connected {:.3f} seconds after starting".format(self.time_to_connected))
+        self.load_plugins_in_background() # plugins are loaded after connecting, so that they don't compete with the connection for the CPU
+
+    def get_trigger_index(self):
+        if self.trigger_index.plugins != self.plugins: self.trigger_index = PluginTriggerIndex(self.plugins) # plugins were added or removed since the index was built, possibly by modifying `plugins` directly
+        return self.trigger_index
+
+    def get_candidate_plugins(self, message):
+        """Returns the plugins that might handle the `IncomingMessage` instance `message`, in registration order."""
+        return self.get_trigger_index().get_candidates(message)
+
+    def get_next_step_time(self, last_step):
+        """Returns the monotonic time at which the step handler should next be called - every `step_interval` seconds if any plugins override `on_step`, otherwise only when the next scheduled call is due (but at least every `idle_step_interval` seconds, for the bot's own housekeeping)."""
+        next_step_time = last_step + (self.step_interval if self.get_trigger_index().step_plugins else self.idle_step_interval)
+        next_call_time = self.scheduler.get_next_time()
+        return next_step_time if next_call_time is None else min(next_step_time, next_call_time)
+
+    def update_last_message(self, message):
+        """Record the `IncomingMessage` instance `message` as the most recently received message, returning its timestamp, thread ID, and channel ID, or `None` (leaving the most recently received message unchanged) if it doesn't have them."""
+        try: context = (message.timestamp, message.thread_id, message.channel_id)
+        except ValueError: return None
+        self.last_message_context = context
+        return context
+
+    def get_response_context(self):
+        """Returns the timestamp, thread ID, and channel ID of the message being handled by the current thread or task, or of the most recently received message if the current thread or task isn't handling a message."""
+        return response_context.get() or self.last_message_context
+
+    def get_response_destination(self, as_thread):
+        """Returns the channel ID and thread ID that responses to the message being handled should be said in. If `as_thread` is truthy, responses to a message that isn't in a thread start a thread for it."""
+        timestamp, thread_id, channel_id = self.get_response_context()
+        assert channel_id is not None, "No message to respond to"
+        return channel_id, thread_id or (timestamp if as_thread else None)
+
+    def get_reply_target(self):
+        """Returns the channel ID and timestamp of the message being handled, for reacting to it."""
+        timestamp, _, channel_id = self.get_response_context()
+        assert channel_id is not None and timestamp is not None, "No message to reply to"
+        return channel_id, timestamp
+
+    def respond_future(self, sendable_text, *, as_thread=True):
+        """Say `sendable_text` in the channel (and thread, if applicable) of the message being handled, returning a `concurrent.futures.Future` that resolves to the message timestamp once the message is successfully sent. If `as_thread` is truthy, this will create a thread for the message being responsed to if it wasn't in a thread."""
+        channel_id, thread_id = self.get_response_destination(as_thread)
+        return self.say_future(sendable_text, channel_id=channel_id, thread_id=thread_id)
+
+class Botty(BottyMixin, SlackBot):
+    def __init__(self, token, message_workers=0):
+        super().__init__(token)
 
-    def on_message(self, message_dict):
-        self.logger.debug("received message {}".format(message_dict))
+        # when there are message workers, messages are handled in parallel across channels/threads, but still in order within each channel/thread
+        self.dispatcher = OrderedDispatcher(message_workers) if message_workers > 0 else None
 
-        # check if the user is a bot and ignore the message if they are
-        user_id = message_dict.get("user", message_dict.get("message", {}).get("user"))
-        if isinstance(user_id, str) and self.get_user_is_bot(user_id): return
+    def get_inbound_backlog(self):
+        return 0 if self.dispatcher is None else self.dispatcher.get_backlog()
 
-        message = IncomingMessage(message_dict, is_bot_message=False)
+    def call_plugin_handler(self, plugin, handler_name, *args):
+        """
+        Returns the result of calling the plugin handler named `handler_name` on `plugin` with arguments `args`, recording how long it took and whether it handled the event.
+
+        The plugin's `handler_lock` is held during the call, so that a plugin's handlers never run at the same time as each other, even with message workers. Step handlers are called from the main loop, which shouldn't wait for a message handler on a worker thread (which might be waiting for the main loop to send a message), so a step handler is skipped if the plugin is busy, returning `False` - it's called again on the next step.
+        """
+        lock = plugin.handler_lock
+        if not lock.acquire(blocking=handler_name != "on_step"): return False
+        metric_name = "plugin.{}.{}".format(plugin.__class__.__name__, handler_name)
+        start_time, handled = time.perf_counter(), False
         try:
-            # we need to set all of these in one statement because if any of the accessors fail, none of the variables should be updated
-            self.last_message_timestamp, self.last_message_thread_id, self.last_message_channel_id = message.timestamp, message.thread_id, message.channel_id
-        except ValueError: pass
+            handled = getattr(plugin, handler_name)(*args)
+            return handled
+        finally:
+            lock.release()
+            self.metrics.record(metric_name, time.perf_counter() - start_time)
+            if handled: self.metrics.increment(metric_name + ".matches")
 
-        # save recent message events
-        if message.is_action_message: self.recent_events.append(message)
+    def on_step(self):
+        self.run_scheduled_calls()
+        for plugin in self.get_trigger_index().step_plugins:
+            if self.call_plugin_handler(plugin, "on_step"): break
+
+    def run_scheduled_calls(self):
+        """Make every scheduled call that's due, recording how long each one took. Calls to a plugin's methods hold the plugin's `handler_lock` like its handlers do, and are retried on the next step if the plugin is busy (repeating calls just skip a turn)."""
+        for scheduled_call in self.scheduler.pop_due_calls(time.monotonic()):
+            if scheduled_call.cancelled: continue
+            plugin = getattr(scheduled_call.function, "__self__", None)
+            lock = plugin.handler_lock if isinstance(plugin, BasePlugin) else None
+            if lock is not None and not lock.acquire(blocking=False):
+                self.scheduler.retry(scheduled_call, time.monotonic() + self.step_interval)
+                continue
+            start_time = time.perf_counter()
+            try: scheduled_call.function(*scheduled_call.args)
+            except Exception:
+                self.logger.error("scheduled call {} threw exception:\n{}".format(scheduled_call, traceback.format_exc()))
+            finally:
+                if lock is not None: lock.release()
+                self.metrics.record("scheduled.{}".format(getattr(scheduled_call.function, "__qualname__", "unknown")), time.perf_counter() - start_time)
 
-        for plugin in self.plugins:
-            if plugin.on_message(message):
-                self.logger.info("message handled by {}: {}".format(plugin.__class__.__name__, message))
-                break
+    def on_message(self, message_dict):
+        log_received_event(self, message_dict)
+        message = IncomingMessage(message_dict, is_bot_message=False)
+        if self.dispatcher is None:
+            self.handle_message(message)
+            return
+        try: key = (message.channel_id, message.thread_id)
+        except ValueError: key = None # events that aren't in a channel are handled in order with each other
+        self.dispatcher.submit(key, self.handle_message, message)
+
+    def handle_message(self, message):
+        try:
+            # check if the user is a bot and ignore the message if they are
+            try: user_id = message.user_id
+            except ValueError: user_id = None
+            if isinstance(user_id, str) and self.get_user_is_bot(user_id): return
+
+            context = self.update_last_message(message) # when this is `None`, responses to this event go to the most recently received message, like responses from step handlers
+
+            # save recent text messages
+            self.recent_messages.add_message(message)
+
+            token = response_context.set(context) # responses from this thread go to this message, even if other messages are being handled in parallel
+            try:
+                for plugin in self.get_candidate_plugins(message):
+                    if self.call_plugin_handler(plugin, "on_message", message):
+                        self.logger.info("message handled by %s: %s", plugin.__class__.__name__, LogExcerpt(message))
+                        break
+            finally:
+                response_context.reset(token)
+        except KeyboardInterrupt: raise
+        except Exception:
+            self.logger.error("message processing threw exception:\n%s\n\nmessage contents:\n%s", traceback.format_exc(), LogExcerpt(message.message_dict))
 
     def respond(self, sendable_text, *, as_thread=True):
-        """Say `sendable_text` in the channel/thread that most recently received a message, returning the message ID (unique within each `SlackBot` instance). If `as_thread` is truthy, this will create a thread for the message being responsed to if it wasn't in a thread."""
-        assert self.last_message_channel_id is not None, "No message to respond to"
-        thread_id = self.last_message_thread_id or (self.last_message_timestamp if as_thread else None)
-        return self.say(sendable_text, channel_id=self.last_message_channel_id, thread_id=thread_id)
+        """Say `sendable_text` in the channel/thread of the message being handled, returning the message ID (unique within each `SlackBot` instance). If `as_thread` is truthy, this will create a thread for the message being responsed to if it wasn't in a thread."""
+        channel_id, thread_id = self.get_response_destination(as_thread)
+        return self.say(sendable_text, channel_id=channel_id, thread_id=thread_id, priority="interactive")
 
     def respond_complete(self, sendable_text, *, as_thread=True):
-        """Say `sendable_text` in the channel (and thread, if applicable) that most recently received a message, waiting until the message is successfully sent, returning the message timestamp. If `as_thread` is truthy, this will create a thread for the message being responsed to if it wasn't in a thread."""
-        assert self.last_message_channel_id is not None, "No message to respond to"
-        thread_id = self.last_message_thread_id or (self.last_message_timestamp if as_thread else None)
-        return self.say_complete(sendable_text, channel_id=self.last_message_channel_id, thread_id=self.last_message_thread_id)
+        """Say `sendable_text` in the channel (and thread, if applicable) of the message being handled, waiting until the message is successfully sent, returning the message timestamp. If `as_thread` is truthy, this will create a thread for the message being responsed to if it wasn't in a thread."""
+        channel_id, thread_id = self.get_response_destination(as_thread)
+        return self.say_complete(sendable_text, channel_id=channel_id, thread_id=thread_id)
 
     def reply(self, emoticon):
-        """React with `emoticon` to the most recently received message."""
-        assert self.last_message_channel_id is not None and self.last_message_timestamp is not None, "No message to reply to"
-        return self.react(self.last_message_channel_id, self.last_message_timestamp, emoticon)
+        """React with `emoticon` to the message being handled."""
+        return self.react(*self.get_reply_target(), emoticon)
 
     def unreply(self, emoticon):
-        """Remove `emoticon` reaction from the most recently received message."""
-        assert self.last_message_channel_id is not None and self.last_message_timestamp is not None, "No message to unreply to"
-        return self.unreact(self.last_message_channel_id, self.last_message_timestamp, emoticon)
+        """Remove `emoticon` reaction from the message being handled."""
+        return self.unreact(*self.get_reply_target(), emoticon)
+
+class DebugBotty(Botty, SlackDebugBot):
+    """`Botty` running on the simulated Slack chat in the terminal provided by `SlackDebugBot`, for testing and local development without a Slack team."""
+
+class AsyncBotty(BottyMixin, AsyncSlackBot):
+    """
+    Asyncio variant of `Botty`, where each incoming message is handled in its own task.
+
+    Plugins inheriting from `AsyncBasePlugin` run directly on the event loop. Ordinary synchronous plugins run one at a time in a worker thread, talking to the bot through its `SynchronousBotAdapter`, so they keep working unchanged without having to be thread-safe.
+    """
+    def __init__(self, token):
+        super().__init__(token)
+        self.plugin_executor = ThreadPoolExecutor(max_workers=1) # worker thread for synchronous plugins
+
+    def register_plugin(self, plugin_instance):
+        if not isinstance(plugin_instance, AsyncBasePlugin): plugin_instance.bot = self.synchronous_adapter # synchronous plugins need blocking versions of the bot's coroutine methods
+        super().register_plugin(plugin_instance)
+
+    async def run_plugin_handler(self, handler, *args):
+        """Returns the result of calling the plugin handler `handler` with arguments `args`, running it in the plugin worker thread if it isn't a coroutine function. Records how long it took (including waiting for the worker thread) and whether it handled the event."""
+        metric_name = "plugin.{}.{}".format(handler.__self__.__class__.__name__, handler.__name__)
+        start_time, handled = time.perf_counter(), False
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                handled = await handler(*args)
+            else:
+                context = contextvars.copy_context() # the worker thread needs the current response context so that responses go to the right message
+                handled = await self.loop.run_in_executor(self.plugin_executor, functools.partial(context.run, handler, *args))
+            return handled
+        finally:
+            self.metrics.record(metric_name, time.perf_counter() - start_time)
+            if handled: self.metrics.increment(metric_name + ".matches")
+
+    async def on_step(self):
+        await self.run_scheduled_calls()
+        for plugin in self.get_trigger_index().step_plugins: # plugins that don't handle steps are skipped, which avoids a worker thread round trip for synchronous ones
+            if await self.run_plugin_handler(plugin.on_step): break
+
+    async def run_scheduled_calls(self):
+        """Make every scheduled call that's due, recording how long each one took. Coroutine functions are awaited on the event loop, and ordinary functions run in the plugin worker thread, like synchronous plugin handlers."""
+        for scheduled_call in self.scheduler.pop_due_calls(time.monotonic()):
+            if scheduled_call.cancelled: continue
+            start_time = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(scheduled_call.function): await scheduled_call.function(*scheduled_call.args)
+                else: await self.loop.run_in_executor(self.plugin_executor, functools.partial(scheduled_call.function, *scheduled_call.args))
+            except Exception:
+                self.logger.error("scheduled call {} threw exception:\n{}".format(scheduled_call, traceback.format_exc()))
+            finally:
+                self.metrics.record("scheduled.{}".format(getattr(scheduled_call.function, "__qualname__", "unknown")), time.perf_counter() - start_time)
+
+    async def on_message(self, message_dict):
+        log_received_event(self, message_dict)
+
+        message = IncomingMessage(message_dict, is_bot_message=False)
+
+        # check if the user is a bot and ignore the message if they are
+        try: user_id = message.user_id
+        except ValueError: user_id = None
+        if isinstance(user_id, str) and await self.get_user_is_bot(user_id): return
+
+        response_context.set(self.update_last_message(message)) # responses from this task go to this message, even if other messages arrive in the meantime
+
+        # save recent text messages
+        self.recent_messages.add_message(message)
+
+        for plugin in self.get_candidate_plugins(message):
+            if await self.run_plugin_handler(plugin.on_message, message):
+                self.logger.info("message handled by %s: %s", plugin.__class__.__name__, LogExcerpt(message))
+                break
+
+    async def respond(self, sendable_text, *, as_thread=True):
+        """Say `sendable_text` in the channel/thread of the message being handled, returning the message ID (unique within each `SlackBot` instance). If `as_thread` is truthy, this will create a thread for the message being responsed to if it wasn't in a thread."""
+        channel_id, thread_id = self.get_response_destination(as_thread)
+        return await self.say(sendable_text, channel_id=channel_id, thread_id=thread_id, priority="interactive")
+
+    async def respond_complete(self, sendable_text, *, as_thread=True):
+        """Say `sendable_text` in the channel (and thread, if applicable) of the message being handled, waiting until the message is successfully sent, returning the message timestamp. If `as_thread` is truthy, this will create a thread for the message being responsed to if it wasn't in a thread."""
+        channel_id, thread_id = self.get_response_destination(as_thread)
+        return await self.say_complete(sendable_text, channel_id=channel_id, thread_id=thread_id)
+
+    async def reply(self, emoticon):
+        """React with `emoticon` to the message being handled."""
+        return await self.react(*self.get_reply_target(), emoticon)
+
+    async def unreply(self, emoticon):
+        """Remove `emoticon` reaction from the message being handled."""
+        return await self.unreact(*self.get_reply_target(), emoticon)
+
+class ShardWorker:
+    """Worker process of a `ShardedBotty`, along with the owning process's end of the pipe connected to it."""
+    def __init__(self, index, process, connection):
+        self.index, self.process, self.connection = index, process, connection
+        self.start_time = time.monotonic()
+        self.outbox = queue.Queue() # messages waiting to be written to the pipe, so that a busy worker never blocks the main loop
+
+class ShardedBotty(SlackBot):
+    """
+    Botty split across several processes, for chats that are too busy for plugins to keep up in a single Python process.
+
+    This process owns the RTM connection, the channel and user directory, and the outbound message queue, so every message still goes through the same rate limits. Plugins run in `process_count` worker processes instead, each a `ShardWorkerBotty` with its own plugin instances. Each event goes to the worker chosen by a hash of its channel ID, so all of a channel's events are handled by the same worker, in the order they were received. Events that aren't in a channel go to the first worker, and events that change the directory are also passed to every other worker so that their copies of the directory stay up to date.
+    """
+    def __init__(self, token, process_count, message_workers=0):
+        super().__init__(token)
+        assert isinstance(process_count, int) and process_count > 0, "`process_count` must be a positive integer rather than \"{}\"".format(process_count)
+        self.token, self.process_count, self.message_workers = token, process_count, message_workers
+        self.context = multiprocessing.get_context("spawn") # start workers from scratch, rather than forking a process that already has threads and sockets
+        self.workers = [] # list of `ShardWorker` instances, indexed by shard
+        self.worker_restart_delay = 10 # minimum number of seconds between starting a worker and restarting it after it exits, so a worker that crashes on startup doesn't get restarted in a tight loop
+        self.directory_sent = False # whether the workers have been sent the directory after connecting
+        self.log_queue = self.context.Queue() # log records from the workers, written out by this process's log handlers
+        self.log_listener = None
+        self.metrics.add_gauge("bot.inbound_backlog", self.get_inbound_backlog)
+
+    def start_loop(self):
+        self.start_workers()
+        super().start_loop()
+
+    def get_inbound_backlog(self):
+        return sum(worker.outbox.qsize() for worker in self.workers) # events that workers have already received but haven't handled aren't counted, since they're in other processes
+
+    def start_workers(self):
+        """Start the worker processes, if they haven't been started already. Workers are started before connecting, so that they can import and register plugins in the meantime."""
+        if self.workers: return
+        self.log_listener = logging.handlers.QueueListener(self.log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+        self.log_listener.start()
+        self.workers = [self.start_worker(index) for index in range(self.process_count)]
+
+    def start_worker(self, index):
+        """Start the worker process for shard `index`, returning its `ShardWorker` instance."""
+        connection, worker_connection = self.context.Pipe()
+        metrics_path = None
+        if self.metrics_path is not None:
+            base_path, extension = os.path.splitext(self.metrics_path)
+            metrics_path = "{}-worker-{}{}".format(base_path, index + 1, extension)
+        process = self.context.Process(
+            target=run_shard_worker, name="ShardWorker-{}".format(index + 1), daemon=True, # daemon processes are stopped when this process exits
+            args=(self.token, index, worker_connection, self.log_queue, logging.getLogger().level, self.logger.name, self.message_workers, metrics_path),
+        )
+        process.start()
+        worker_connection.close() # the worker has its own copy of its end of the pipe
+        worker = ShardWorker(index, process, connection)
+        threading.Thread(target=self.send_to_worker_loop, args=(worker,), name="ShardSender-{}".format(index + 1), daemon=True).start()
+        threading.Thread(target=self.receive_from_worker_loop, args=(worker,), name="ShardReceiver-{}".format(index + 1), daemon=True).start()
+        self.logger.info("started worker {} with process ID {}".format(index + 1, process.pid))
+        if self.directory_sent: self.send_directory(worker) # restarted after connecting, so it won't get the directory otherwise
+        return worker
+
+    def send_directory(self, worker):
+        # pickle the directory right away, since it might change before the sender thread gets to it
+        worker.outbox.put(("directory", pickle.dumps(self.directory), self.bot_user_id))
+
+    def send_to_worker_loop(self, worker):
+        """Write the messages in the outbox of `worker` to its pipe until the worker exits, or until a `None` is put in the outbox."""
+        while True:
+            message = worker.outbox.get()
+            if message is None: break
+            try: worker.connection.send(message)
+            except (EOFError, OSError): break # the worker exited, it'll be restarted by `on_step`
+            except Exception:
+                self.logger.error("sending to worker %s threw exception:\n%s\n\nmessage contents:\n%s", worker.index + 1, traceback.format_exc(), LogExcerpt(message))
+
+    def receive_from_worker_loop(self, worker):
+        """Handle requests from `worker` until it exits."""
+        while True:
+            try: request = worker.connection.recv()
+            except (EOFError, OSError): break # the worker exited, it'll be restarted by `on_step`
+            try: self.handle_worker_request(worker, request)
+            except Exception:
+                self.logger.error("worker {} request processing threw exception:\n{}\n\nrequest contents:\n{}".format(worker.index + 1, traceback.format_exc(), request))
+
+    def handle_worker_request(self, worker, request):
+        """Perform `request` on behalf of `worker`, sending the results back to it as they become available."""
+        request_type = request[0]
+        if request_type == "say":
+            _, message_id, sendable_text, channel_id, thread_id, priority = request
+            try: outgoing_message = self.queue_message(sendable_text, channel_id=channel_id, thread_id=thread_id, priority=priority)
+            except Exception as e:
+                worker.outbox.put(("message_result", message_id, "sent", None, e))
+                worker.outbox.put(("message_result", message_id, "reply", None, e))
+                raise
+            outgoing_message.sent.add_done_callback(functools.partial(self.send_future_result, worker, ("message_result", message_id, "sent")))
+            outgoing_message.reply.add_done_callback(functools.partial(self.send_future_result, worker, ("message_result", message_id, "reply")))
+        elif request_type in {"react", "unreact"}:
+            _, call_id, channel_id, timestamp, emoticon = request
+            try: response_future = getattr(self, request_type)(channel_id, timestamp, emoticon)
+            except Exception as e:
+                worker.outbox.put(("call_result", call_id, None, e))
+                raise
+            response_future.add_done_callback(functools.partial(self.send_future_result, worker, ("call_result", call_id)))
+        elif request_type == "direct_message_channel": # the worker opened a direct message, which we need to know about before it sends anything there
+            _, user_id, channel_id = request
+            self.directory.direct_message_channel_ids_by_user_id[user_id] = channel_id
+            self.directory.add_direct_message_channel(channel_id)
+        else:
+            raise ValueError("Unknown worker request type: {}".format(request_type))
+
+    def send_future_result(self, worker, prefix, future):
+        """Send the result or exception of the completed `future` to `worker`, as a message starting with the values in the tuple `prefix`."""
+        try: result, exception = future.result(), None
+        except Exception as e: result, exception = None, e
+        worker.outbox.put(prefix + (result, exception))
+
+    def on_connected(self):
+        super().on_connected()
+        if not self.directory_sent: # after reconnecting, the directory is sent again by `on_step` once it's been refreshed
+            for worker in self.workers: self.send_directory(worker)
+            self.directory_sent = True
+
+    def on_directory_refreshed(self):
+        self.directory_sent = False # the directory is sent from the main loop, since events might be changing it in the meantime
+
+    def on_step(self):
+        if not self.directory_sent and self.bot_user_id is not None:
+            for worker in self.workers: self.send_directory(worker)
+            self.directory_sent = True
+        for index, worker in enumerate(self.workers):
+            if worker.process.is_alive() or time.monotonic() - worker.start_time < self.worker_restart_delay: continue
+            self.logger.error("worker {} exited with code {}, restarting it".format(index + 1, worker.process.exitcode))
+            worker.outbox.put(None) # stop its sender thread
+            self.workers[index] = self.start_worker(index)
+
+    def on_message(self, message_dict):
+        message = IncomingMessage(message_dict, is_bot_message=False)
+        try: shard = zlib.crc32(message.channel_id.encode("utf-8")) % len(self.workers)
+        except ValueError: shard = 0 # events that aren't in a channel are handled in order with each other
+        for worker in self.workers:
+            if worker.index == shard: worker.outbox.put(("event", message_dict))
+            elif message.event_type in SlackDirectory.EVENT_TYPES: worker.outbox.put(("directory_event", message_dict))
+
+class ShardWorkerBotty(Botty):
+    """`Botty` running in a worker process of a `ShardedBotty`. It receives events and directory updates through `connection` from the process that owns the RTM connection, rather than connecting to Slack itself, and sends messages and reactions back through it to be sent by that process."""
+    def __init__(self, token, connection, message_workers=0):
+        super().__init__(token, message_workers)
+        self.connection = connection
+        self.connection_lock = threading.Lock() # requests to the owning process are sent from plugin threads as well as the main loop
+        self.owner_messages = queue.Queue() # events and directory updates from the owning process, waiting to be handled by the main loop
+        self.forwarded_messages = {} # mapping from message IDs to `OutgoingMessage` instances that the owning process is sending for us, until they're acknowledged
+        self.pending_calls = {} # mapping from call IDs to `Future` instances for reactions that the owning process is making for us
+        self.call_ids = itertools.count()
+
+    def start_loop(self):
+        threading.Thread(target=self.receive_from_owner_loop, name="OwnerReceiver", daemon=True).start()
+        last_step = time.monotonic()
+        while True:
+            try: message = self.owner_messages.get(timeout=max(0, self.get_next_step_time(last_step) - time.monotonic()))
+            except queue.Empty: message = None
+            if message is not None:
+                if message[0] == "stop": break
+                self.handle_owner_message(message)
+            if time.monotonic() >= self.get_next_step_time(last_step):
+                try: self.on_step()
+                except Exception:
+                    self.logger.error("step processing threw exception:\n{}".format(traceback.format_exc()))
+                last_step = time.monotonic()
+                self.dump_metrics_if_due()
+        self.logger.info("shutting down...")
+
+    def receive_from_owner_loop(self):
+        """Receive messages from the owning process until it exits. Results for our requests are resolved right away, so that plugins waiting on them don't depend on the main loop, and everything else is left for the main loop."""
+        while True:
+            try: message = self.connection.recv()
+            except (EOFError, OSError): break # the owning process exited
+            if message[0] == "message_result":
+                _, message_id, field, result, exception = message
+                outgoing_message = self.forwarded_messages.get(message_id) if field == "sent" else self.forwarded_messages.pop(message_id, None)
+                if outgoing_message is not None: set_future_result(getattr(outgoing_message, field), result, exception)
+            elif message[0] == "call_result":
+                _, call_id, result, exception = message
+                future = self.pending_calls.pop(call_id, None)
+                if future is not None: set_future_result(future, result, exception)
+            else:
+                self.owner_messages.put(message)
+        self.owner_messages.put(("stop",))
+
+    def handle_owner_message(self, message):
+        message_type = message[0]
+        if message_type == "event":
+            message_dict = message[1]
+            self.metrics.increment("bot.events_received")
+            if self.directory.update_from_event(message_dict): self.text_codec.clear_name_cache()
+            try: self.on_message(message_dict)
+            except Exception:
+                self.logger.error("message processing threw exception:\n%s\n\nmessage contents:\n%s", traceback.format_exc(), LogExcerpt(message_dict))
+        elif message_type == "wake_up": pass # only meant to interrupt waiting for the next message, such as after a call is scheduled
+        elif message_type == "directory_event":
+            if self.directory.update_from_event(message[1]): self.text_codec.clear_name_cache()
+        elif message_type == "directory": # the owning process connected to Slack
+            self.directory, self.bot_user_id = pickle.loads(message[1]), message[2]
+            self.text_codec.clear_name_cache()
+            self.on_connected()
+
+    def wake_up(self):
+        self.owner_messages.put(("wake_up",)) # the main loop waits on the message queue rather than the RTM websocket
+
+    def send_to_owner(self, request):
+        with self.connection_lock: self.connection.send(request)
+
+    def queue_message(self, sendable_text, *, channel_id, thread_id = None, priority = "normal"):
+        outgoing_message = self.create_outgoing_message(sendable_text, channel_id=channel_id, thread_id=thread_id, priority=priority)
+        self.forwarded_messages[outgoing_message.message_id] = outgoing_message
+        self.send_to_owner(("say", outgoing_message.message_id, sendable_text, channel_id, thread_id, priority))
+        return outgoing_message
+
+    def call_owner(self, request_type, *args):
+        """Ask the owning process to perform the request `request_type` with arguments `args`, returning a `concurrent.futures.Future` that resolves to the result."""
+        call_id = next(self.call_ids)
+        future = self.pending_calls[call_id] = Future()
+        self.send_to_owner((request_type, call_id) + args)
+        return future
+
+    def react(self, channel_id, timestamp, emoticon):
+        return self.call_owner("react", channel_id, timestamp, emoticon) # the owning process checks the arguments, since we can't raise its exceptions here
+
+    def unreact(self, channel_id, timestamp, emoticon):
+        return self.call_owner("unreact", channel_id, timestamp, emoticon)
+
+    def get_direct_message_channel_id_by_user_id(self, user_id):
+        is_new = user_id not in self.directory.direct_message_channel_ids_by_user_id
+        channel_id = super().get_direct_message_channel_id_by_user_id(user_id)
+        if is_new and channel_id is not None: self.send_to_owner(("direct_message_channel", user_id, channel_id)) # sent before any messages to the channel, so the owning process knows about the channel by the time they arrive
+        return channel_id
+
+def set_future_result(future, result, exception):
+    if future.done(): return
+    if exception is None: future.set_result(result)
+    else: future.set_exception(exception)
+
+def run_shard_worker(token, index, connection, log_queue, log_level, logger_name, message_workers, metrics_path):
+    """Entry point of the worker process for shard `index` of a `ShardedBotty`."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # keyboard interrupts go to the owning process, which stops the workers when it exits
+    root_logger = logging.getLogger()
+    root_logger.handlers = [logging.handlers.QueueHandler(log_queue)] # the owning process writes our log records to its own log
+    root_logger.setLevel(log_level)
+    start_background_logging() # records are pickled to be sent to the owning process, which is worth keeping off the main loop too
+    botty = ShardWorkerBotty(token, connection, message_workers=message_workers)
+    botty.logger = logging.getLogger("{}.worker-{}".format(logger_name, index + 1))
+    botty.metrics_path = metrics_path
+    initialize_plugins(botty)
+    botty.start_loop()
 
 class IncomingMessage:
-    """Represents a single incoming message event."""
+    """
+    Represents a single incoming message event.
+
+    The event is parsed once when the instance is created: edited messages (`message_changed` events, where the fields are in a nested `message` dictionary), reactions (where the channel and timestamp are in a nested `item` dictionary), and threaded messages are all normalized into the same fields, so the properties below are just attribute lookups no matter how many plugins use them. The original event dictionary is kept as `message_dict`, without being copied.
+    """
+    __slots__ = ("message_dict", "is_bot_message", "event_type", "subtype", "_timestamp", "_text", "_user_id", "_channel_id", "_thread_id", "_reaction", "is_text_message")
+    NON_ACTION_EVENT_TYPES = frozenset({"ping", "pong", "presence_change", "user_typing", "reconnect_url"}) # event types that represent things we usually don't consider user actions
+
     def __init__(self, message_dict, is_bot_message):
         self.message_dict = message_dict
         self.is_bot_message = is_bot_message
+        get = message_dict.get
+        self.event_type, self.subtype = get("type"), get("subtype")
+        submessage, item = get("message"), get("item")
+        if not isinstance(submessage, dict): submessage = {}
+        if not isinstance(item, dict): item = {}
+
+        # these are the raw values, which might not be strings - the properties check them and raise a `ValueError` if they aren't
+        self._timestamp = get("ts", item.get("ts"))
+        self._text = get("text", submessage.get("text"))
+        self._user_id = get("user", submessage.get("user"))
+        self._channel_id = get("channel", submessage.get("channel", item.get("channel")))
+        self._thread_id = get("thread_ts", submessage.get("thread_ts"))
+        self._reaction = get("reaction")
+
+        self.is_text_message = ( # whether the message represents a text message - if this is `True`, the `timestamp`, `text`, `user_id`, and `channel_id` properties will be available
+            self.event_type == "message" and isinstance(get("ts"), str) and isinstance(get("channel"), str) and (
+                (isinstance(get("text"), str) and isinstance(get("user"), str)) or # ordinary message
+                (self.subtype == "message_changed" and isinstance(submessage.get("user"), str) and isinstance(submessage.get("channel"), str) and isinstance(submessage.get("text"), str)) # edited message
+            )
+        )
 
     def __repr__(self): return "<Message {}>".format(self.message_dict)
 
@@ -117,36 +763,12 @@ class IncomingMessage:
     @property
     def is_action_message(self):
         """Returns `True` if the message represents an action by a user, as opposed to things we usually don't consider user actions, like server pings or going offline, `False` otherwise."""
-        return self.message_dict.get("type") not in {"ping", "pong", "presence_change", "user_typing", "reconnect_url"}
-
-    @property
-    def is_text_message(self):
-        """Returns `True` if the message represents a text message, `False` otherwise. If this returns `True`, the `Message.timestamp`, `Message.text`, `Message.user_id`, and `Message.channel_id` methods will be available."""
-        if self.message_dict.get("type") != "message": return False
-        if not isinstance(self.message_dict.get("ts"), str): return False
-        if not isinstance(self.message_dict.get("channel"), str): return False
-        if isinstance(self.message_dict.get("text"), str) and isinstance(self.message_dict.get("user"), str):
-            return True # ordinary message
-        if (
-            self.message_dict.get("subtype") == "message_changed" and
-            isinstance(self.message_dict.get("message"), dict) and
-            isinstance(self.message_dict["message"].get("user"), str) and
-            isinstance(self.message_dict["message"].get("channel"), str) and
-            isinstance(self.message_dict["message"].get("text"), str)
-        ):
-            return True # edited message
-        return False # not a text message
+        return self.event_type not in self.NON_ACTION_EVENT_TYPES
 
     @property
     def is_user_message(self):
         """Returns `True` if the message represents a message sent by a real user (i.e., not a bot), `False` otherwise."""
-        if self.is_bot_message: return False
-
-        try:
-            self.timestamp, self.user_id, self.channel_id
-            return True
-        except ValueError:
-            return False
+        return not self.is_bot_message and isinstance(self._timestamp, str) and isinstance(self._user_id, str) and isinstance(self._channel_id, str)
 
     @property
     def is_user_text_message(self):
@@ -156,122 +778,176 @@ class IncomingMessage:
     @property
     def is_reaction_addition(self):
         """Returns `True` if the message represents a reaction being added, `False` otherwise."""
-        return self.message_dict.get("type") == "reaction_added" and self.channel_id and self.user_id
+        return self.event_type == "reaction_added" and isinstance(self._channel_id, str) and isinstance(self._user_id, str)
 
     @property
     def is_reaction_removal(self):
         """Returns `True` if the message represents a reaction being removed, `False` otherwise."""
-        return self.message_dict.get("type") == "reaction_removed" and self.channel_id and self.user_id
+        return self.event_type == "reaction_removed" and isinstance(self._channel_id, str) and isinstance(self._user_id, str)
 
     @property
     def timestamp(self):
         """Returns the timestamp of the message, or raises a `ValueError` if there is none."""
-        reaction_timestamp = self.message_dict.get("item", {}).get("ts")
-        timestamp = self.message_dict.get("ts", reaction_timestamp)
-        if not isinstance(timestamp, str): raise ValueError("Message timestamp should be a string, but is \"{}\" instead".format(repr(timestamp)))
-        return timestamp
+        if not isinstance(self._timestamp, str): raise ValueError("Message timestamp should be a string, but is \"{}\" instead".format(repr(self._timestamp)))
+        return self._timestamp
 
     @property
     def text(self):
         """Returns the text content of the message as a string, or raises a `ValueError` if there is none."""
-        submessage_text = self.message_dict.get("message", {}).get("text")
-        text = self.message_dict.get("text", submessage_text)
-        if not isinstance(text, str): raise ValueError("Message text should be a string, but is \"{}\" instead".format(repr(text)))
-        return text
+        if not isinstance(self._text, str): raise ValueError("Message text should be a string, but is \"{}\" instead".format(repr(self._text)))
+        return self._text
 
     @property
     def user_id(self):
         """Returns the ID of the user that sent the message, or raises a `ValueError` if there is none."""
-        submessage_channel = self.message_dict.get("message", {}).get("user")
-        user_id = self.message_dict.get("user", submessage_channel)
-        if not isinstance(user_id, str): raise ValueError("Message user ID should be a string, but is \"{}\" instead".format(repr(user_id)))
-        return user_id
+        if not isinstance(self._user_id, str): raise ValueError("Message user ID should be a string, but is \"{}\" instead".format(repr(self._user_id)))
+        return self._user_id
 
     @property
     def channel_id(self):
         """Returns the ID of the channel that the message is in, or raises a `ValueError` if there is none."""
-        reaction_channel = self.message_dict.get("item", {}).get("channel")
-        submessage_channel = self.message_dict.get("message", {}).get("channel", reaction_channel)
-        channel_id = self.message_dict.get("channel", submessage_channel)
-        if not isinstance(channel_id, str): raise ValueError("Message channel ID should be a string, but is \"{}\" instead".format(repr(channel_id)))
-        return channel_id
+        if not isinstance(self._channel_id, str): raise ValueError("Message channel ID should be a string, but is \"{}\" instead".format(repr(self._channel_id)))
+        return self._channel_id
 
     @property
     def thread_id(self):
         """Returns the ID of the thread that the message is in, or `None` if the message is not in a thread."""
-        submessage_thread = self.message_dict.get("message", {}).get("thread_ts")
-        thread_id = self.message_dict.get("thread_ts", submessage_thread)
-        if thread_id is not None and not isinstance(thread_id, str): raise ValueError("Message thread ID should be a string, but is \"{}\" instead".format(repr(thread_id)))
-        return thread_id
+        if self._thread_id is not None and not isinstance(self._thread_id, str): raise ValueError("Message thread ID should be a string, but is \"{}\" instead".format(repr(self._thread_id)))
+        return self._thread_id
 
     @property
     def reaction(self):
         """Returns the name of the reaction for the reaction addition/removal message, or raises a `ValueError` if there is none."""
-        reaction = self.message_dict.get("reaction")
-        if not isinstance(reaction, str): raise ValueError("Message reaction value should be a string, but is \"{}\" instead".format(repr(reaction)))
-        return reaction
-
-botty = Botty(SLACK_TOKEN)
-initialize_plugins(botty)
-
-# start administrator console in production mode
-if not DEBUG:
-    def say(channel, text):
-        """Say `text` in `channel` where `text` is a sendable text string and `channel` is a channel name like #general."""
-        botty.say(text, channel_id=botty.get_channel_id_by_name(channel))
-
-    def reload_plugin(package_name, class_name):
-        """Reload plugin from its plugin class `class_name` from package `package_name`."""
-        # obtain the new plugin
-        import importlib
-        plugin_module = importlib.import_module(package_name) # this will not re-initialize the module, since it's been previously imported
-        importlib.reload(plugin_module) # re-initialize the module
-        PluginClass = getattr(plugin_module, class_name)
-
-        # replace the old plugin with the new one
-        for i, plugin in enumerate(botty.plugins):
-            if isinstance(plugin, PluginClass):
-                del botty.plugins[i]
-                break
-        botty.register_plugin(PluginClass(botty))
-
-    def sane():
-        """Force the administrator's console into a reasonable default - useful for recovering from weird terminal states."""
-        import os
-        os.system("stty sane")
-
-    from datetime import datetime
-    from plugins.utilities import BasePlugin
-    def on_message_default(plugin, message): return False
-    def on_message_disabled(plugin, message): return True
-    def on_message_print(plugin, message):
-        """Print out all incoming events - useful for interactive RTM API debugging."""
-        if message.get("type") == "message":
-            timestamp = datetime.fromtimestamp(int(message["ts"].split(".")[0]))
-            channel_name = botty.get_channel_name_by_id(message.get("channel", message.get("previous_message", {}).get("channel")))
-            user_name = botty.get_user_name_by_id(message.get("user", message.get("previous_message", {}).get("user")))
-            text = message.get("text", message.get("previous_message", {}).get("text"))
-            new_text = message.get("message", {}).get("text")
-            if new_text:
-                print("{timestamp} #{channel} | @{user} {subtype}: {text} -> {new_text}".format(
-                    timestamp=timestamp, channel=channel_name, user=user_name,
-                    subtype=message.get("subtype", "message"), text=text, new_text=new_text
-                ))
-            else:
-                print("{timestamp} #{channel} | @{user} {subtype}: {text}".format(
-                    timestamp=timestamp, channel=channel_name, user=user_name,
-                    subtype=message.get("subtype", "message"), text=text
-                ))
-        elif message.get("type") not in {"ping", "pong", "presence_change", "user_typing", "reconnect_url"}:
-            print(message)
-        return False
-    on_message = on_message_default
-    class AdHocPlugin(BasePlugin):
-        def __init__(self, bot): super().__init__(bot)
-        def on_message(self, message): return on_message(self, message)
-    if not any(isinstance(plugin, AdHocPlugin) for plugin in botty.plugins): # plugin hasn't already been added
-        botty.plugins.insert(0, AdHocPlugin(botty)) # the plugin should go before everything else to be able to influence every message
-
-    botty.administrator_console(globals())
-
-botty.start_loop()
+        if not isinstance(self._reaction, str): raise ValueError("Message reaction value should be a string, but is \"{}\" instead".format(repr(self._reaction)))
+        return self._reaction
+
+if __name__ == "__main__":
+    # process settings
+    #logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    logging.basicConfig(filename="botty.log", level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    log_handler = start_background_logging() # log records are formatted and written in a background thread, so a slow disk doesn't hold up the bot
+
+    ASYNC = "--async" in sys.argv[1:]
+    if ASYNC: sys.argv.remove("--async")
+    PROCESSES = None # number of worker processes to run plugins in, or `None` to run them in this process
+    for argument in sys.argv[1:]:
+        match = re.match(r"--processes=(\d+)$", argument)
+        if match:
+            PROCESSES = int(match.group(1))
+            sys.argv.remove(argument)
+
+    if (len(sys.argv) >= 2 and sys.argv[1] in {"--help", "-h", "-?"}) or ((ASYNC or PROCESSES is not None) and len(sys.argv) < 2) or (ASYNC and PROCESSES is not None) or PROCESSES == 0:
+        print("Usage: {} --help".format(sys.argv[0]))
+        print("    Show this help message")
+        print("Usage: {}".format(sys.argv[0]))
+        print("    Start the Botty chatbot for Slack in testing mode with a console chat interface")
+        print("Usage: {} SLACK_BOT_TOKEN".format(sys.argv[0]))
+        print("    Start the Botty chatbot for the Slack chat associated with SLACK_BOT_TOKEN, and enter the in-process Python REPL")
+        print("    SLACK_BOT_TOKEN is a Slack API token (can be obtained from https://api.slack.com/)")
+        print("Usage: {} --async SLACK_BOT_TOKEN".format(sys.argv[0]))
+        print("    Same as above, but run Botty on an asyncio event loop, so that slow plugins don't hold up other messages")
+        print("Usage: {} [--async] SLACK_BOT_TOKEN_1 SLACK_BOT_TOKEN_2 ...".format(sys.argv[0]))
+        print("    Same as above, but run Botty in several Slack chats at once from a single process, one for each token")
+        print("    Each chat gets its own connection and plugin instances, while read-only plugin data is loaded once and shared")
+        print("Usage: {} --processes=N SLACK_BOT_TOKEN_1 SLACK_BOT_TOKEN_2 ...".format(sys.argv[0]))
+        print("    Same as above, but run plugins in N worker processes for each chat, with each channel's messages always handled by the same worker")
+        print("    Messages and reactions are still sent by the main process, so they stay within the chat's rate limits")
+        sys.exit(1)
+
+    DEBUG = len(sys.argv) < 2
+    if DEBUG:
+        SLACK_TOKENS = [""]
+        print("No Slack API token specified in command line arguments; starting in local debug mode...")
+        print()
+    else:
+        SLACK_TOKENS = sys.argv[1:]
+
+    botties = [] # one Botty instance for each Slack chat
+    for i, token in enumerate(SLACK_TOKENS):
+        if ASYNC: botty = AsyncBotty(token)
+        elif PROCESSES is not None: botty = ShardedBotty(token, process_count=PROCESSES, message_workers=8)
+        elif DEBUG: botty = DebugBotty(token, message_workers=0) # the debug bot's console expects each message to be fully handled before showing the next prompt
+        else: botty = Botty(token, message_workers=8)
+        if len(SLACK_TOKENS) == 1:
+            botty.metrics_path = "botty-metrics.json" # written next to botty.log every minute
+        else:
+            botty.logger = logging.getLogger("{}.{}".format(botty.__class__.__name__, i + 1)) # tell the chats apart in the log
+            botty.metrics_path = "botty-metrics-{}.json".format(i + 1)
+        botty.metrics.add_gauge("log.dropped_records", lambda: log_handler.dropped_count)
+        if PROCESSES is None: initialize_plugins(botty) # with worker processes, each worker registers its own plugins
+        botties.append(botty)
+    botty = botties[0] # the administrator console acts on the first chat, but `botty` can be set to any element of `botties` in the console to switch chats
+    if DEBUG: botty.load_plugins_in_background() # the debug bot doesn't connect to anything, so start loading plugins right away
+
+    # start administrator console in production mode
+    if not DEBUG:
+        def say(channel, text):
+            """Say `text` in `channel` where `text` is a sendable text string and `channel` is a channel name like #general."""
+            bot = botty.synchronous_adapter if ASYNC else botty # the administrator console runs in its own thread, so it can't await coroutines directly
+            bot.say(text, channel_id=bot.get_channel_id_by_name(channel))
+
+        def show_metrics():
+            """Print a summary of Botty's performance metrics, such as per-plugin handler latencies and queue depths. Use `botty.metrics.snapshot()` to get the raw values."""
+            print(botty.metrics.format_summary())
+
+        if PROCESSES is None: # with worker processes, plugins are loaded and registered in the workers, which the console can't reach
+            def show_startup_profile():
+                """Print how long Botty took to connect, and how long each plugin took to import and initialize."""
+                print(format_startup_profile(botty))
+
+            def reload_plugin(package_name, class_name):
+                """Reload plugin from its plugin class `class_name` from package `package_name`."""
+                # obtain the new plugin
+                import importlib
+                plugin_module = importlib.import_module(package_name) # this will not re-initialize the module, since it's been previously imported
+                importlib.reload(plugin_module) # re-initialize the module
+                PluginClass = getattr(plugin_module, class_name)
+
+                # replace the old plugin with the new one
+                for i, plugin in enumerate(botty.plugins):
+                    if isinstance(plugin, PluginClass) or (isinstance(plugin, LazyPlugin) and plugin.class_name == class_name):
+                        del botty.plugins[i]
+                        break
+                botty.register_plugin(PluginClass(botty))
+
+        def sane():
+            """Force the administrator's console into a reasonable default - useful for recovering from weird terminal states."""
+            import os
+            os.system("stty sane")
+
+        from datetime import datetime
+        def on_message_default(plugin, message): return False
+        def on_message_disabled(plugin, message): return True
+        def on_message_print(plugin, message):
+            """Print out all incoming events - useful for interactive RTM API debugging."""
+            if message.get("type") == "message":
+                timestamp = datetime.fromtimestamp(int(message["ts"].split(".")[0]))
+                channel_name = botty.get_channel_name_by_id(message.get("channel", message.get("previous_message", {}).get("channel")))
+                user_name = botty.get_user_name_by_id(message.get("user", message.get("previous_message", {}).get("user")))
+                text = message.get("text", message.get("previous_message", {}).get("text"))
+                new_text = message.get("message", {}).get("text")
+                if new_text:
+                    print("{timestamp} #{channel} | @{user} {subtype}: {text} -> {new_text}".format(
+                        timestamp=timestamp, channel=channel_name, user=user_name,
+                        subtype=message.get("subtype", "message"), text=text, new_text=new_text
+                    ))
+                else:
+                    print("{timestamp} #{channel} | @{user} {subtype}: {text}".format(
+                        timestamp=timestamp, channel=channel_name, user=user_name,
+                        subtype=message.get("subtype", "message"), text=text
+                    ))
+            elif message.get("type") not in {"ping", "pong", "presence_change", "user_typing", "reconnect_url"}:
+                print(message)
+            return False
+        on_message = on_message_default
+        class AdHocPlugin(BasePlugin):
+            def __init__(self, bot): super().__init__(bot)
+            def on_message(self, message): return on_message(self, message)
+        if PROCESSES is None and not any(isinstance(plugin, AdHocPlugin) for plugin in botty.plugins): # plugin hasn't already been added, and plugins run in this process
+            botty.plugins.insert(0, AdHocPlugin(botty.synchronous_adapter if ASYNC else botty)) # the plugin should go before everything else to be able to influence every message
+
+        botty.administrator_console(globals())
+
+    # the first chat runs on the main thread so that it receives keyboard interrupts, and the process exits along with it
+    for other_botty in botties[1:]: threading.Thread(target=other_botty.start_loop, name=other_botty.logger.name, daemon=True).start()
+    botty.start_loop()
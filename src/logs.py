@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import logging, logging.handlers
+import queue, atexit
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Log handler that puts log records in a queue as they are, to be formatted and written out by a `logging.handlers.QueueListener` in a background thread.
+
+    Unlike `logging.handlers.QueueHandler`, records aren't formatted before they're queued, so logging from a busy thread costs about as much as creating the record. This only works for queues within a single process, since the records' arguments aren't made picklable. If the queue is full (such as when the disk stalls for a while), records are dropped and counted in `dropped_count` rather than blocking the thread that logged them.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped_count = 0 # number of records dropped because the queue was full
+
+    def prepare(self, record): return record
+
+    def enqueue(self, record):
+        try: self.queue.put_nowait(record)
+        except queue.Full: self.dropped_count += 1
+
+def start_background_logging(max_queued_records=100000):
+    """Move the root logger's handlers to a background thread, which formats and writes each log record after the thread that logged it puts it in a queue of up to `max_queued_records` records. Returns the `DeferredQueueHandler` that replaces them. Queued records are written out before the process exits."""
+    root_logger = logging.getLogger()
+    handler = DeferredQueueHandler(queue.Queue(max_queued_records))
+    listener = logging.handlers.QueueListener(handler.queue, *root_logger.handlers, respect_handler_level=True)
+    root_logger.handlers = [handler]
+    listener.start()
+    atexit.register(listener.stop)
+    return handler
+
+class LogExcerpt:
+    """Stands in for `value` in the arguments of a log message, like `logger.info("received %s", LogExcerpt(message_dict))`. The value is only converted to a string if the record is actually written, and is cut down to at most `max_length` characters when it is."""
+    __slots__ = ("value", "max_length")
+
+    def __init__(self, value, max_length=1000):
+        self.value, self.max_length = value, max_length
+
+    def __str__(self):
+        text = str(self.value)
+        if len(text) <= self.max_length: return text
+        return "{}... ({} more characters)".format(text[:self.max_length], len(text) - self.max_length)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import os, json, time
+import bisect
+import threading
+
+class LatencyHistogram:
+    """Histogram of durations in seconds, using fixed buckets that grow roughly exponentially from 100 microseconds to 10 seconds, so recording a value takes constant time and memory."""
+    BUCKET_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")) # upper bound of each bucket, in seconds
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(self.BUCKET_BOUNDS)
+        self.count, self.total, self.maximum = 0, 0.0, 0.0
+
+    def record(self, duration):
+        self.bucket_counts[bisect.bisect_left(self.BUCKET_BOUNDS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.maximum: self.maximum = duration
+
+    def get_percentile(self, percentile):
+        """Returns an upper bound on the `percentile`th percentile duration (between 0 and 100), or `None` if nothing has been recorded."""
+        if self.count == 0: return None
+        target, seen = self.count * percentile / 100, 0
+        for bound, bucket_count in zip(self.BUCKET_BOUNDS, self.bucket_counts):
+            seen += bucket_count
+            if seen >= target: return min(bound, self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {
+            "count": self.count, "total": self.total, "max": self.maximum,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.get_percentile(50), "p90": self.get_percentile(90), "p99": self.get_percentile(99),
+            "buckets": {str(bound): bucket_count for bound, bucket_count in zip(self.BUCKET_BOUNDS, self.bucket_counts) if bucket_count},
+        }
+
+class Metrics:
+    """
+    Thread-safe collection of named counters, latency histograms, and gauges.
+
+    Counters and histograms are updated as things happen, while gauges are functions that are only called when a snapshot is taken, for values like queue depths that are cheap to read but change constantly. Names are dotted paths like `plugin.PollPlugin.on_message`.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.counters = {} # mapping from counter names to counts
+        self.histograms = {} # mapping from histogram names to `LatencyHistogram` instances
+        self.gauges = {} # mapping from gauge names to functions that return the current value
+
+    def increment(self, name, amount=1):
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name, duration):
+        """Record a duration of `duration` seconds in the histogram named `name`."""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None: histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(duration)
+
+    def add_gauge(self, name, function):
+        """Report the result of calling `function` as the gauge named `name` in every snapshot."""
+        self.gauges[name] = function
+
+    def snapshot(self):
+        """Returns a JSON-serializable dictionary containing the current values of all the metrics."""
+        gauges = {}
+        for name, function in list(self.gauges.items()):
+            try: gauges[name] = function()
+            except Exception: gauges[name] = None # gauges shouldn't be able to break metrics reporting
+        with self.lock:
+            return {
+                "time": time.time(), "uptime": time.time() - self.start_time,
+                "counters": dict(self.counters),
+                "gauges": gauges,
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            }
+
+    def dump(self, path):
+        """Write a snapshot of the metrics to the file at `path` as JSON, replacing the file all at once so that readers never see a partially written file."""
+        temporary_path = "{}.tmp".format(path)
+        with open(temporary_path, "w") as f: json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+        os.replace(temporary_path, path)
+
+    def format_summary(self):
+        """Returns a human-readable table summarizing the metrics, one line per histogram, followed by the counters and gauges."""
+        snapshot = self.snapshot()
+        def milliseconds(seconds): return "-" if seconds is None else "{:.1f}".format(seconds * 1000)
+        lines = ["{:<45} {:>8} {:>8} {:>8} {:>8} {:>8} {:>9}".format("HISTOGRAM (ms)", "COUNT", "MATCHES", "P50", "P90", "P99", "MAX")]
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            matches = snapshot["counters"].get("{}.matches".format(name), "")
+            lines.append("{:<45} {:>8} {:>8} {:>8} {:>8} {:>8} {:>9}".format(
+                name, histogram["count"], matches, milliseconds(histogram["p50"]), milliseconds(histogram["p90"]), milliseconds(histogram["p99"]), milliseconds(histogram["max"])
+            ))
+        for name, value in sorted(snapshot["counters"].items()):
+            if not name.endswith(".matches"): lines.append("{:<45} {:>8}".format(name, value))
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append("{:<45} {:>8}".format(name, "-" if value is None else value))
+        return "\n".join(lines)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-import re, json, time, random
+import re, json, random
+import threading
 from math import floor, ceil
 from collections import namedtuple
 
@@ -11,10 +12,13 @@ class AgarioPlugin(BasePlugin):
     """
     1D agar.io game plugin for Botty.
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)^\s*pls\s+agar\s+me\b", r"(?i)\b(?:stop|end|terminate|off|disable)\b", r"(?i)^\s*(?:&lt;|v|&gt;)\s*(?:-|/|)\s*$"] # game commands, matched against server text where "<" and ">" are escaped
     def __init__(self, bot):
         super().__init__(bot)
 
-        self.last_step_time = 0
+        self.game_lock = threading.RLock() # game commands can be handled on message worker threads while the game timer steps the game on the main loop
+        self.game_timer = None # scheduled call that steps the game every 0.2 seconds while a game is going on
         self.player_locations = {}
         self.player_movement = {}
         self.player_index = {}
@@ -26,17 +30,6 @@ class AgarioPlugin(BasePlugin):
         self.empty = " "
         self.food = "\u25E6"
 
-    def on_step(self):
-        current_time = time.time()
-        if current_time - self.last_step_time < 0.2: return False
-        self.last_step_time = current_time
-
-        if self.game_channel is None: return # no game going on
-
-        self.step_game()
-
-        return True
-
     def on_message(self, m):
         if not m.is_user_text_message: return False
         text = self.sendable_text_to_text(m.text)
@@ -59,34 +52,40 @@ class AgarioPlugin(BasePlugin):
             self.initialize_game(m.channel_id, m.thread_id, players)
             return True
 
-        if self.game_channel is None: return False # no game going on
-        if m.channel_id != self.game_channel: return False # message isn't in the right channel
-
-        # game stop command
-        match = re.search(r"\b(stop|end|terminate|off|disable)\b", text, re.IGNORECASE)
-        if match:
-            self.end_game()
-            return True
-
-        if user_name not in self.player_locations: return False # player isn't in the game
-
-        # directional commands
-        match = re.search(r"^\s*([<v>])\s*(-|/|)\s*$", text, re.IGNORECASE)
-        if match:
-            direction, action = match.groups()
-            offset = {"<": -1, "v": 0, ">": 1}[direction]
-            if action == "-": # fire some mass in the desired direction
-                self.fire(user_name, offset * 2)
-            elif action == "/":
-                self.split(user_name, offset * 4)
-            else:
-                self.player_movement[user_name] = offset
-            return True
+        with self.game_lock:
+            if self.game_channel is None: return False # no game going on
+            if m.channel_id != self.game_channel: return False # message isn't in the right channel
+
+            # game stop command
+            match = re.search(r"\b(stop|end|terminate|off|disable)\b", text, re.IGNORECASE)
+            if match:
+                self.end_game()
+                return True
+
+            if user_name not in self.player_locations: return False # player isn't in the game
+
+            # directional commands
+            match = re.search(r"^\s*([<v>])\s*(-|/|)\s*$", text, re.IGNORECASE)
+            if match:
+                direction, action = match.groups()
+                offset = {"<": -1, "v": 0, ">": 1}[direction]
+                if action == "-": # fire some mass in the desired direction
+                    self.fire(user_name, offset * 2)
+                elif action == "/":
+                    self.split(user_name, offset * 4)
+                else:
+                    self.player_movement[user_name] = offset
+                return True
 
         return False
 
     def end_game(self):
+        """End the game, announcing the results in the game's channel and thread. Must be called with `game_lock` held."""
+        game_channel, game_thread = self.game_channel, self.game_thread
         self.game_channel, self.game_thread = None, None
+        if self.game_timer is not None:
+            self.game_timer.cancel()
+            self.game_timer = None
         masses = sorted(
             (
                 (player, sum(location[1] for location in locations))
@@ -95,7 +94,7 @@ class AgarioPlugin(BasePlugin):
             key = lambda pair: -pair[1]
         )
 
-        self.respond(
+        self.say(
             "*{} wins!*\n"
             "{}".format(
                 untag_word(masses[0][0]),
@@ -103,32 +102,41 @@ class AgarioPlugin(BasePlugin):
                     "> *{}* has total mass {}".format(untag_word(player), total_mass)
                     for player, total_mass in masses
                 )
-            )
+            ),
+            channel_id=game_channel, thread_id=game_thread # the game might be ended by the game timer, which isn't responding to any message
         )
 
     def initialize_game(self, channel, thread, players):
-        self.game_channel, self.game_thread = channel, thread
-        self.player_locations = {}
-        self.player_movement = {}
-        self.player_index = {}
-        self.player_split_cooldown = {}
-        current_position = random.randrange(0, 8)
-        for i, player in enumerate(players):
-            self.player_locations[player] = [[current_position, 1]]
-            self.player_movement[player] = 0
-            self.player_index[player] = i
-            self.player_split_cooldown[player] = 0
-            current_position = (current_position + random.randrange(10, 30)) % self.map_size
-        self.game_map = [self.food if random.random() < 0.3 else self.empty for i in range(self.map_size)]
-
-        self.say(
-            "*AGAR.IO GAME STARTED* (players from left to right: {})\nSTARTING MAP: `{}`".format(
-                ", ".join(players), self.render_map()
-            ),
-            channel_id=channel, thread_id=thread
-        )
+        with self.game_lock:
+            if self.game_timer is not None: self.game_timer.cancel() # replace any game that's already going on
+            self.game_channel, self.game_thread = channel, thread
+            self.player_locations = {}
+            self.player_movement = {}
+            self.player_index = {}
+            self.player_split_cooldown = {}
+            current_position = random.randrange(0, 8)
+            for i, player in enumerate(players):
+                self.player_locations[player] = [[current_position, 1]]
+                self.player_movement[player] = 0
+                self.player_index[player] = i
+                self.player_split_cooldown[player] = 0
+                current_position = (current_position + random.randrange(10, 30)) % self.map_size
+            self.game_map = [self.food if random.random() < 0.3 else self.empty for i in range(self.map_size)]
+
+            self.say(
+                "*AGAR.IO GAME STARTED* (players from left to right: {})\nSTARTING MAP: `{}`".format(
+                    ", ".join(players), self.render_map()
+                ),
+                channel_id=channel, thread_id=thread
+            )
+            self.game_timer = self.call_every(0.2, self.step_game)
 
     def step_game(self):
+        with self.game_lock:
+            if self.game_channel is None: return # the game ended after this step was scheduled
+            self.advance_game()
+
+    def advance_game(self):
         # occasionally spawn food in random places
         if random.random() < 0.3:
             self.game_map[random.randrange(self.map_size)] = self.food
@@ -208,7 +216,7 @@ class AgarioPlugin(BasePlugin):
                         else:
                             self.player_locations[player][blob2][0] = (position2 + amount) % self.map_size
 
-        self.say("`{}`".format(self.render_map()), channel_id=self.game_channel, thread_id=self.game_thread)
+        self.say("`{}`".format(self.render_map()), channel_id=self.game_channel, thread_id=self.game_thread, priority="background") # game frames shouldn't hold up replies to people
 
     def fire(self, player, offset):
         locations = self.player_locations[player]
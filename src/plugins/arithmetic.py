@@ -81,6 +81,8 @@ class ArithmeticPlugin(BasePlugin):
         #general    | Me: eval solve(Eq(x**2, 6), x)
         #general    | Botty: solve(Eq(x**2, 6), x) :point_right: [-sqrt(6), sqrt(6)]
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)^\s*\b(?:ca(?:lc(?:ulate)?)?|eval(?:uate)?)\s"]
     def __init__(self, bot):
         super().__init__(bot)
 
@@ -28,6 +28,8 @@ class BigTextPlugin(BasePlugin):
         |_  _ || _  
         | |(/_||(_)```
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)^\s*\bbiggify\s"]
     def __init__(self, bot):
         super().__init__(bot)
 
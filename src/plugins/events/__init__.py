@@ -37,6 +37,8 @@ class EventsPlugin(BasePlugin):
         
         • *Movie Night: Gun Woman Reloaded* _from_ :date: 19:00 2015-10-28 (Wednesday) _to_ :date: 00:30 2015-10-29 (Thursday) (http://tinyurl.com/sdfklea)
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)\bbotty\b", r"(?i)\bwhat\s+are\s+the\s+haps\b"]
     def __init__(self, bot):
         super().__init__(bot)
 
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 import re, random, sqlite3
+import threading
 from os import path
+from urllib.request import pathname2url
 
 from ..utilities import BasePlugin
+from ..utilities import load_shared_asset
 from .markov import Markov
 
 SQLITE_DATABASE = path.join(path.dirname(path.realpath(__file__)), "chains.db") # Markov chain values, generated by `src/plugins/generate_text/generate_chains_db.py`
@@ -50,15 +53,17 @@ class GenerateTextPlugin(BasePlugin):
         #general    | Me: botty don't
         #general    | Botty: don't think i saw the ride
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)\bbotty\b"]
     def __init__(self, bot):
         super().__init__(bot)
 
         if not path.exists(SQLITE_DATABASE):
             self.logger.warning("can't find SQLite Markov chain database `{}` - try running `python3 src/plugins/generate_text/generate_chains_db.py`".format(SQLITE_DATABASE))
-            self.connection = None
+            self.connections = None
             return
 
-        self.connection = sqlite3.connect(SQLITE_DATABASE)
+        self.connections = load_shared_asset("generate_text.connections", threading.local) # each thread opens its own read-only connection on first use (see `get_connection`), shared by every Slack chat in the process
 
     def on_message(self, m):
         if not m.is_user_text_message: return False
@@ -67,7 +72,7 @@ class GenerateTextPlugin(BasePlugin):
         query = self.sendable_text_to_text(match.group(1) or "")
 
         # fail gracefully if user has not configured this plugin yet
-        if self.connection is None:
+        if self.connections is None:
             self.respond_raw("oops, I can't find the Markov chain database `chains.db` :( try running `python3 src/plugins/generate_text/generate_chains_db.py`")
             return True
 
@@ -79,4 +84,10 @@ class GenerateTextPlugin(BasePlugin):
     def generate_sentence_starting_with(self, first_part = ""):
         first_part = first_part.strip()
         words = Markov.tokenize_text(first_part) if first_part != "" else []
-        return Markov.format_words(words + speak_db(self.connection, LOOKBEHIND_LENGTH, words))
+        return Markov.format_words(words + speak_db(self.get_connection(), LOOKBEHIND_LENGTH, words))
+
+    def get_connection(self):
+        """Returns the current thread's read-only connection to the Markov chain database, opening it if this thread hasn't used the database yet. SQLite connections can't safely be shared between threads unless SQLite was built in serialized mode, which isn't guaranteed."""
+        connection = getattr(self.connections, "connection", None)
+        if connection is None: connection = self.connections.connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(SQLITE_DATABASE)), uri=True)
+        return connection
@@ -3,6 +3,7 @@
 import os, json, re, random
 
 from ..utilities import BasePlugin
+from ..utilities import load_shared_asset
 
 JSON_LINES_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "haiku_lines.json") # haiku candidate lines, generated by `src/plugins/haiku/generate_haiku_lines.py`
 
@@ -29,18 +30,21 @@ class HaikuPlugin(BasePlugin):
         "accidentally"
         ```
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)\b(?:pls\s+haiku\s+me|haiku\s+me\s+pls)\b"]
     def __init__(self, bot):
         super().__init__(bot)
+        self.five_syllable_messages, self.seven_syllable_messages = load_shared_asset("haiku.lines", self.load_lines)
 
+    def load_lines(self):
+        """Returns lists of five syllable and seven syllable haiku lines, which are empty if the haiku lines JSON file hasn't been generated."""
         try:
             with open(JSON_LINES_FILE) as f:
                 result = json.load(f)
-                self.five_syllable_messages = result["five_syllables"] or ["refrigerator"]
-                self.seven_syllable_messages = result["seven_syllables"] or ["seven refrigerators"]
+                return result["five_syllables"] or ["refrigerator"], result["seven_syllables"] or ["seven refrigerators"]
         except FileNotFoundError:
             self.logger.warning("can't find haiku lines JSON file `{}` - try running `python3 src/plugins/haiku/generate_haiku_lines.py`".format(JSON_LINES_FILE))
-            self.five_syllable_messages = []
-            self.seven_syllable_messages = []
+            return [], []
 
     def on_message(self, m):
         if not m.is_user_text_message: return False
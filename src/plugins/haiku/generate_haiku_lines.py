@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
-import os, json, re
+import os, sys, json, re
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+from slack_text import SlackTextCodec
 
 JSON_LINES_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "haiku_lines.json")
 
@@ -36,27 +39,7 @@ def get_metadata():
 
 USER_NAMES_BY_ID, USER_REAL_NAMES_BY_ID, CHANNEL_NAMES_BY_ID = get_metadata()
 
-def server_text_to_text(server_text):
-    """Returns `server_text`, a string in Slack server message format, converted into a plain text string. The transformation can lose some information for escape sequences, such as link labels."""
-    assert isinstance(server_text, str), "`server_text` must be a string rather than \"{}\"".format(server_text)
-    text_without_special_sequences = re.sub(r"<[^<>]*>", "", server_text)
-    assert "<" not in text_without_special_sequences and ">" not in text_without_special_sequences, "Invalid special sequence in server text \"{}\", perhaps some text needs to be escaped"
-
-    # process link references
-    def process_special_sequence(match):
-        original, body = match.group(0), match.group(1).split("|")[0]
-        if body.startswith("#"): # channel reference
-            return "#" + CHANNEL_NAMES_BY_ID[body[1:]] if body[1:] in CHANNEL_NAMES_BY_ID else original
-        if body.startswith("@"): # user reference
-            return "@" + USER_NAMES_BY_ID[body[1:]] if body[1:] in USER_NAMES_BY_ID else original
-        if body.startswith("!"): # special command
-            if body == "!channel": return "@channel"
-            if body == "!group": return "@group"
-            if body == "!everyone": return "@everyone"
-        return body # link, should remove angle brackets and label in order to allow it to linkify
-    raw_text = re.sub(r"<(.*?)>", process_special_sequence, server_text)
-
-    return raw_text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+server_text_to_text = SlackTextCodec(CHANNEL_NAMES_BY_ID.get, USER_NAMES_BY_ID.get).server_text_to_text
 
 def get_message_text(message):
     """Returns the text value of `message` if it is a valid text message, or `None` otherwise"""
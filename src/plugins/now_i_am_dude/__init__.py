@@ -4,10 +4,41 @@ import re, random
 from os import path
 
 from ..utilities import BasePlugin
+from ..utilities import load_shared_asset
 
 PARTS_OF_SPEECH_FILE = path.join(path.dirname(path.realpath(__file__)), "mobypos.txt")
 PRONOUNCIATION_FILE = path.join(path.dirname(path.realpath(__file__)), "mobypron.txt")
 
+def load_dictionaries():
+    """Returns lists of nouns and adjectives, a mapping from last syllables to words ending in them, and a mapping from words to their last syllables, from the Moby part-of-speech and pronounciation dictionaries."""
+    vowel_sounds = {"a", "e", "i", "o", "u", "A", "E", "I", "O", "U", "aI", "eI", "Oi", "oU", "AU", "@", "(@)", "[@]", "&"}
+
+    nouns, adjectives = [], []
+    with open(PARTS_OF_SPEECH_FILE, "r") as f:
+        for line in f:
+            word, parts_of_speech = line.split("\\")
+            if "A" in parts_of_speech: adjectives.append(word)
+            if "N" in parts_of_speech: nouns.append(word)
+
+    last_syllable_words, word_last_syllables = {}, {}
+    with open(PRONOUNCIATION_FILE, "r") as f:
+        for line in f:
+            word, pronounciation = line.split(" ", 1)
+            syllables, index = [[]], 0
+            for phoneme in pronounciation.strip("/\n").split("/"):
+                if phoneme in vowel_sounds:
+                    index += 1
+                    syllables.append([phoneme])
+                elif phoneme != "": # consonant sound
+                    syllables[index].append(phoneme)
+            if len(syllables[-1]) == 0: del syllables[-1] # delete last blank syllable if present
+            if len(syllables) > 1: last_syllable = (tuple(syllables[-2]), tuple(syllables[-1]))
+            else: last_syllable = tuple(syllables[-1])
+            if last_syllable not in last_syllable_words: last_syllable_words[last_syllable] = []
+            last_syllable_words[last_syllable].append(word)
+            word_last_syllables[word] = last_syllable
+    return nouns, adjectives, last_syllable_words, word_last_syllables
+
 class NowIAmDudePlugin(BasePlugin):
     """
     "I was born A but now I am B" plugin for Botty.
@@ -21,37 +52,11 @@ class NowIAmDudePlugin(BasePlugin):
         #general    | Me: dude me
         #general    | Botty: I was born tender but now I am ascender
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)\bdu+de+\s+me+\b"]
     def __init__(self, bot):
         super().__init__(bot)
-
-        vowel_sounds = {"a", "e", "i", "o", "u", "A", "E", "I", "O", "U", "aI", "eI", "Oi", "oU", "AU", "@", "(@)", "[@]", "&"}
-
-        nouns, adjectives = [], []
-        with open(PARTS_OF_SPEECH_FILE, "r") as f:
-            for line in f:
-                word, parts_of_speech = line.split("\\")
-                if "A" in parts_of_speech: adjectives.append(word)
-                if "N" in parts_of_speech: nouns.append(word)
-        self.nouns, self.adjectives = nouns, adjectives
-
-        last_syllable_words, word_last_syllables = {}, {}
-        with open(PRONOUNCIATION_FILE, "r") as f:
-            for line in f:
-                word, pronounciation = line.split(" ", 1)
-                syllables, index = [[]], 0
-                for phoneme in pronounciation.strip("/\n").split("/"):
-                    if phoneme in vowel_sounds:
-                        index += 1
-                        syllables.append([phoneme])
-                    elif phoneme != "": # consonant sound
-                        syllables[index].append(phoneme)
-                if len(syllables[-1]) == 0: del syllables[-1] # delete last blank syllable if present
-                if len(syllables) > 1: last_syllable = (tuple(syllables[-2]), tuple(syllables[-1]))
-                else: last_syllable = tuple(syllables[-1])
-                if last_syllable not in last_syllable_words: last_syllable_words[last_syllable] = []
-                last_syllable_words[last_syllable].append(word)
-                word_last_syllables[word] = last_syllable
-        self.last_syllable_words, self.word_last_syllables = last_syllable_words, word_last_syllables
+        self.nouns, self.adjectives, self.last_syllable_words, self.word_last_syllables = load_shared_asset("now_i_am_dude.dictionaries", load_dictionaries)
 
     def get_rhyming_pair(self):
         while True:
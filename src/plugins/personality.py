@@ -3,7 +3,7 @@
 import re, random
 from collections import defaultdict
 
-from .utilities import BasePlugin
+from .utilities import BasePlugin, ExpiringDict
 
 class PersonalityPlugin(BasePlugin):
     """
@@ -39,14 +39,15 @@ class PersonalityPlugin(BasePlugin):
         #general    | Me: ???
         #general    | Botty: ????
     """
+    trigger_event_types = {"message"} # every text message counts towards repetitions, so there are no trigger patterns
     def __init__(self, bot):
         super().__init__(bot)
         
-        self.last_entries = {} # mapping from (channel ID, thread ID) to [last message in that channel, sender of last message, number of repetitions]
+        self.last_entries = self.register_state("last_entries", ExpiringDict(max_size=5000, ttl=60 * 60)) # mapping from (channel ID, thread ID) to [last message in that channel, sender of last message, number of repetitions], forgotten after an hour without messages
         self.message_repeated_threshold = 2 # minimum number of message repeats in a channel before we repeat it as well
 
-        self.simple_pattern_actions = {
-            r"(?i)\bbotty\s+(?:help|halp|\?+)\b":    lambda match: self.respond_raw(
+        self.simple_pattern_actions = [ # list of (name, case-insensitive pattern, action) tuples, where the first pattern that matches a message has its action called with the match
+            ("help", r"\bbotty\s+(?:help|halp|\?+)\b", lambda match: self.respond_raw(
                 "botty's got you covered yo\n"
                 "say `botty help` to get a light bedtime read\n"
                 "say `calc SYMPY_EXPRESSION` to do some math\n"
@@ -65,43 +66,48 @@ class PersonalityPlugin(BasePlugin):
                 "say `pls agar me PLAYER1, PLAYER2, ...` if you hate being productive (`<`/`>` to move, `<-`/`>-` to fire mass, `</`/`>/` to split)\n"
                 "say `thanks botty`, just because you should\n"
                 "plus a bunch of other secret ~bugs~ undocumented features to discover"
-            ),
-            r"(?i)\b(?:thanks|thx|ty)\b.*\bbotty\b": lambda match: self.respond_raw(random.choice(
-                ["np", "np br0", "no prob", "don't mention it", "anytime"]
             )),
-            r"(?i)\bdrink\s+some\s+water\b":    lambda match: self.reply("water_buffalo"),
-            r"(?i)\bfor\s+the\s+(cd|record)\b": lambda match: self.reply("cd"),
-            r"(?i)\begg":                       lambda match: self.reply("eggplant"),
-            r"(?i)\b(nugget|nugs?|chicken)\b":  lambda match: self.reply("chicken"),
-            r"(?i)\baha\b":                     lambda match: self.reply("aha"),
-        }
+            ("thanks", r"\b(?:thanks|thx|ty)\b.*\bbotty\b", lambda match: self.respond_raw(random.choice(
+                ["np", "np br0", "no prob", "don't mention it", "anytime"]
+            ))),
+            ("water", r"\bdrink\s+some\s+water\b",      lambda match: self.reply("water_buffalo")),
+            ("cd", r"\bfor\s+the\s+(cd|record)\b",      lambda match: self.reply("cd")),
+            ("egg", r"\begg",                           lambda match: self.reply("eggplant")),
+            ("chicken", r"\b(nugget|nugs?|chicken)\b",  lambda match: self.reply("chicken")),
+            ("aha", r"\baha\b",                         lambda match: self.reply("aha")),
+        ]
+        self.compiled_pattern_actions = [(name, re.compile(pattern, re.IGNORECASE), action) for name, pattern, action in self.simple_pattern_actions]
+        self.any_pattern = re.compile("|".join("(?:{})".format(pattern) for _, pattern, _ in self.simple_pattern_actions), re.IGNORECASE) # matches exactly the messages that at least one pattern matches, so that most messages only need this one search (about 3 times faster than searching for each of these patterns, unlike Botty's trigger patterns - see `PluginTriggerIndex`)
 
     def on_message(self, m):
         if not m.is_user_text_message: return False
         key = (m.channel_id, m.thread_id) # index states by channel and thread
 
         # compute the number of times different people have repeated it
-        if key in self.last_entries and m.text == self.last_entries[key][0] and m.user_id != self.last_entries[key][1]:
-            self.last_entries[key][2] += 1
+        entry = self.last_entries.get(key)
+        if entry is not None and m.text == entry[0] and m.user_id != entry[1]:
+            entry[2] += 1
         else:
-            self.last_entries[key] = [m.text, m.user_id, 1]
+            entry = self.last_entries[key] = [m.text, m.user_id, 1]
 
-        for pattern, action in self.simple_pattern_actions.items():
-            match = re.search(pattern, m.text)
-            if match:
-                try:
-                    action(match)
-                    return True
-                except: # simple responses shouldn't be able to crash us
-                    pass
+        if self.any_pattern.search(m.text): # one of the patterns matches, so find the first one that does
+            for name, pattern, action in self.compiled_pattern_actions:
+                match = pattern.search(m.text)
+                if match:
+                    self.bot.metrics.increment("plugin.PersonalityPlugin.patterns.{}".format(name))
+                    try:
+                        action(match)
+                        return True
+                    except: # simple responses shouldn't be able to crash us
+                        pass
 
         if random.random() < 0.001:
             self.reply(random.choice(["lenny", "boredparrot", "pugrun", "chart_with_downwards_trend"]))
 
         # repeat this message if other people have repeated it enough times, 50% of the time
-        if self.last_entries[key][2] >= self.message_repeated_threshold and random.random() < 0.5:
+        if entry[2] >= self.message_repeated_threshold and random.random() < 0.5:
             self.respond(m.text) # repeat the message
-            del self.last_entries[key]
+            self.last_entries.pop(key)
             return True
 
         return False
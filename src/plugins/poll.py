@@ -2,7 +2,7 @@
 
 import re
 
-from .utilities import BasePlugin
+from .utilities import BasePlugin, ExpiringDict
 from .utilities import untag_word
 
 class PollPlugin(BasePlugin):
@@ -33,9 +33,11 @@ class PollPlugin(BasePlugin):
         #general    | Botty: *POLL STATUS:* test
         Nobody voted :(
     """
+    trigger_event_types = {"message", "reaction_added"} # reactions are votes
+    trigger_patterns = [r"(?i)^\s*\bpoll\s"]
     def __init__(self, bot):
         super().__init__(bot)
-        self.current_polls = {} # mapping from channel IDs to poll entries
+        self.current_polls = self.register_state("current_polls", ExpiringDict(max_size=1000, ttl=7 * 24 * 60 * 60)) # mapping from channel IDs to poll entries, forgotten after a week without votes or status checks
 
     def on_message(self, m):
         if not m.is_user_message: return False
@@ -43,18 +45,19 @@ class PollPlugin(BasePlugin):
 
         # reaction voting
         if m.is_reaction_addition and m.user_id != self.get_bot_user_id():
-            if m.channel_id not in self.current_polls: return False # check if reaction was posted in a channel with an active poll
-            message_timestamp = self.current_polls[m.channel_id]["message_timestamp"]
+            poll = self.current_polls.get(m.channel_id)
+            if poll is None: return False # check if reaction was posted in a channel with an active poll
+            message_timestamp = poll["message_timestamp"]
             try: # check if message is a reaction on the poll message
                 if m.timestamp != message_timestamp: return False
             except ValueError: # reaction doesn't have a timestamp
                 return False
 
             if m.reaction == "+1": # vote to agree
-                self.current_polls[m.channel_id]["user_votes"][user_name] = 1
+                poll["user_votes"][user_name] = 1
                 return True
             elif m.reaction == "-1": # vote to disagree
-                self.current_polls[m.channel_id]["user_votes"][user_name] = 0
+                poll["user_votes"][user_name] = 0
                 return True
             return False
 
@@ -117,21 +120,22 @@ class PollPlugin(BasePlugin):
             else:
                 new_channel = m.channel_id
 
-            if new_channel not in self.current_polls:
+            poll = self.current_polls.get(new_channel)
+            if poll is None:
                 self.respond_raw("there's no poll going on right now in {}".format(self.get_channel_name_by_id(new_channel)), as_thread=True)
                 return True
 
-            self.current_polls[new_channel]["user_votes"][user_name] = 1 if match_y else 0 # apply the vote
+            poll["user_votes"][user_name] = 1 if match_y else 0 # apply the vote
             return True
 
         # poll checking command
         match = re.search(r"^\s*\bpoll\s+(?:check|status|ready)\b", m.text, re.IGNORECASE)
         if match:
-            if m.channel_id not in self.current_polls:
+            poll = self.current_polls.get(m.channel_id)
+            if poll is None:
                 self.respond_raw("there's no poll going on right now in {}".format(self.get_channel_name_by_id(m.channel_id)), as_thread=True)
                 return True
 
-            poll = self.current_polls[m.channel_id]
             voters = poll["user_votes"]
             if not voters:
                 self.respond(("*POLL STATUS*\n" if poll["description"] is None else "*POLL STATUS:* {}\n".format(poll["description"])) + "Nobody voted :(")
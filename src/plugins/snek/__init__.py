@@ -29,6 +29,8 @@ class SnekPlugin(BasePlugin):
         #general    | Me: sneeeeeeeeeeeeeeeekeeeee
         #general    | Botty: :snake_tail0::snake_body1::snake_body0::snake_body3::snake_body5::snake_body0::snake_body0::snake_body0::snake_body5::snake_body1::snake_body9::snake_body0::snake_body1::snake_body1::snake_body1::snake_body7::snake_body0::snake_head:
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)\bs+n+[aeiou]{3,}k"]
     def __init__(self, bot):
         super().__init__(bot)
         self.snake_head = [
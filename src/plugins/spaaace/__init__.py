@@ -22,6 +22,8 @@ class SpaaacePlugin(BasePlugin):
         #general    | Me: don't quote me on this, but botty's really got some cool features
         #general    | Botty: http://i.imgur.com/29eKFrz.jpg
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)\bquote\s+me\b"]
     def __init__(self, bot):
         super().__init__(bot)
         with open(IMGUR_CREDENTIALS_FILE, "r") as f:
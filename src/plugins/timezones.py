@@ -46,6 +46,8 @@ class TimezonesPlugin(BasePlugin):
         #general    | Me: 8pm toronto
         #general    | Botty: *TORONTO* :clock8: 20:00 :point_right: *TORONTO* :clock8: 20:00 - *VANCOUVER* :clock5: 17:00 - *UTC* :clock12: 0:00 (tomorrow)
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)\d(?::\d\d|\s*[ap]m)"] # a time of day with minutes or am/pm
     def __init__(self, bot):
         super().__init__(bot)
 
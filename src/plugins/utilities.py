@@ -6,16 +6,23 @@ Utilities and classes for Botty plugins.
 Should be imported by all Botty plugins.
 """
 
-import os, re
+import os, re, time
 import functools
+import threading
+from collections import OrderedDict
 
 CHAT_HISTORY_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "@history")
 
 class BasePlugin:
     """Base class for Botty plugins. Should be imported from plugins using `from .utilities import BasePlugin`."""
+    # events that `on_message` might handle, so that Botty can skip calling it for everything else - by default, every event is passed to `on_message`
+    trigger_event_types = None # set of RTM event types (like "message" or "reaction_added") to pass to `on_message`, or `None` for every event type
+    trigger_patterns = None # regular expressions, at least one of which has to match the server text of "message" events for them to be passed to `on_message`, or `None` for every message
+
     def __init__(self, bot):
         self.bot = bot
         self.logger = bot.logger.getChild(self.__class__.__name__)
+        self.handler_lock = threading.RLock() # held by Botty while calling this plugin's handlers and scheduled calls, so that they never run at the same time as each other
 
         self.flows = {}
 
@@ -30,42 +37,167 @@ class BasePlugin:
             return result
         return {}
 
-    def on_step(self): return False
+    def on_step(self):             return False
     def on_message(self, message): return False
 
-    def say(self, sendable_text, *, channel_id, thread_id=None):          return self.bot.say(sendable_text, channel_id=channel_id, thread_id=thread_id)
-    def say_raw(self, text, *, channel_id, thread_id=None):               return self.bot.say(self.text_to_sendable_text(text), channel_id=channel_id, thread_id=thread_id)
-    def say_complete(self, sendable_text, *, channel_id, thread_id=None): return self.bot.say_complete(sendable_text, channel_id=channel_id, thread_id=thread_id)
-    def say_raw_complete(self, text, *, channel_id, thread_id=None):      return self.bot.say_complete(self.text_to_sendable_text(text), channel_id=channel_id, thread_id=thread_id)
-    def respond(self, sendable_text, *, as_thread=False):                 return self.bot.respond(sendable_text, as_thread=as_thread)
-    def respond_raw(self, text, *, as_thread=False):                      return self.bot.respond(self.text_to_sendable_text(text), as_thread=as_thread)
-    def respond_complete(self, sendable_text, *, as_thread=False):        return self.bot.respond_complete(sendable_text, as_thread=as_thread)
-    def respond_raw_complete(self, text, *, as_thread=False):             return self.bot.respond_complete(self.text_to_sendable_text(text), as_thread=as_thread)
-    def react(self, channel_id, timestamp, emoticon):                     return self.bot.react(channel_id, timestamp, emoticon)
-    def unreact(self, channel_id, timestamp, emoticon):                   return self.bot.unreact(channel_id, timestamp, emoticon)
-    def reply(self, emoticon):                                            return self.bot.reply(emoticon)
-    def unreply(self, emoticon):                                          return self.bot.unreply(emoticon)
-    def get_channel_name_by_id(self, channel_id):                         return self.bot.get_channel_name_by_id(channel_id)
-    def get_channel_id_by_name(self, channel_name):                       return self.bot.get_channel_id_by_name(channel_name)
-    def get_user_id_by_name(self, user_name):                             return self.bot.get_user_id_by_name(user_name)
-    def get_user_name_by_id(self, user_id):                               return self.bot.get_user_name_by_id(user_id)
-    def get_direct_message_channel_id_by_user_id(self, user_id):          return self.bot.get_direct_message_channel_id_by_user_id(user_id)
-    def get_user_info_by_id(self, user_id):                               return self.bot.get_user_info_by_id(user_id)
-    def get_user_is_bot(self, user_id):                                   return self.bot.get_user_is_bot(user_id)
-    def text_to_sendable_text(self, text):                                return self.bot.text_to_sendable_text(text)
-    def sendable_text_to_text(self, sendable_text):                       return self.bot.sendable_text_to_text(sendable_text)
-    def get_bot_user_id(self):                                            return self.bot.bot_user_id
+    def say(self, sendable_text, *, channel_id, thread_id=None, priority="normal"): return self.bot.say(sendable_text, channel_id=channel_id, thread_id=thread_id, priority=priority)
+    def say_raw(self, text, *, channel_id, thread_id=None, priority="normal"):      return self.bot.say(self.text_to_sendable_text(text), channel_id=channel_id, thread_id=thread_id, priority=priority)
+    def say_complete(self, sendable_text, *, channel_id, thread_id=None):           return self.bot.say_complete(sendable_text, channel_id=channel_id, thread_id=thread_id)
+    def say_raw_complete(self, text, *, channel_id, thread_id=None):                return self.bot.say_complete(self.text_to_sendable_text(text), channel_id=channel_id, thread_id=thread_id)
+    def say_future(self, sendable_text, *, channel_id, thread_id=None):             return self.bot.say_future(sendable_text, channel_id=channel_id, thread_id=thread_id)
+    def respond(self, sendable_text, *, as_thread=False):                           return self.bot.respond(sendable_text, as_thread=as_thread)
+    def respond_raw(self, text, *, as_thread=False):                                return self.bot.respond(self.text_to_sendable_text(text), as_thread=as_thread)
+    def respond_complete(self, sendable_text, *, as_thread=False):                  return self.bot.respond_complete(sendable_text, as_thread=as_thread)
+    def respond_raw_complete(self, text, *, as_thread=False):                       return self.bot.respond_complete(self.text_to_sendable_text(text), as_thread=as_thread)
+    def respond_future(self, sendable_text, *, as_thread=False):                    return self.bot.respond_future(sendable_text, as_thread=as_thread)
+    def react(self, channel_id, timestamp, emoticon):                               return self.bot.react(channel_id, timestamp, emoticon)
+    def unreact(self, channel_id, timestamp, emoticon):                             return self.bot.unreact(channel_id, timestamp, emoticon)
+    def reply(self, emoticon):                                                      return self.bot.reply(emoticon)
+    def unreply(self, emoticon):                                                    return self.bot.unreply(emoticon)
+    def get_channel_name_by_id(self, channel_id):                                   return self.bot.get_channel_name_by_id(channel_id)
+    def get_channel_id_by_name(self, channel_name):                                 return self.bot.get_channel_id_by_name(channel_name)
+    def get_user_id_by_name(self, user_name):                                       return self.bot.get_user_id_by_name(user_name)
+    def get_user_name_by_id(self, user_id):                                         return self.bot.get_user_name_by_id(user_id)
+    def get_direct_message_channel_id_by_user_id(self, user_id):                    return self.bot.get_direct_message_channel_id_by_user_id(user_id)
+    def get_user_info_by_id(self, user_id):                                         return self.bot.get_user_info_by_id(user_id)
+    def get_user_is_bot(self, user_id):                                             return self.bot.get_user_is_bot(user_id)
+    def text_to_sendable_text(self, text):                                          return self.bot.text_to_sendable_text(text)
+    def sendable_text_to_text(self, sendable_text):                                 return self.bot.sendable_text_to_text(sendable_text)
+    def get_bot_user_id(self):                                                      return self.bot.bot_user_id
+    def get_recent_message(self, channel_id, timestamp):                            return self.bot.recent_messages.get(channel_id, timestamp)
+    def get_recent_messages(self, channel_id, thread_id=None, count=10):            return self.bot.recent_messages.get_recent(channel_id, thread_id=thread_id, count=count)
+    def call_later(self, delay, function, *args):                                   return self.bot.scheduler.call_later(delay, function, *args)
+    def call_every(self, interval, function, *args):                                return self.bot.scheduler.call_every(interval, function, *args)
+
+    def register_state(self, name, state):
+        """Report the size and eviction counts of `state`, an `ExpiringDict` holding plugin state or a `Flow`, in the bot's metrics as gauges named like `state.PLUGIN_CLASS.NAME.size`. Returns `state`."""
+        prefix = "state.{}.{}".format(self.__class__.__name__, name)
+        entries = state.generator_iterators if isinstance(state, Flow) else state # a flow's running generator iterators are its state
+        self.bot.metrics.add_gauge(prefix + ".size", lambda: len(entries))
+        self.bot.metrics.add_gauge(prefix + ".evicted", lambda: entries.evicted_count)
+        self.bot.metrics.add_gauge(prefix + ".expired", lambda: entries.expired_count)
+        return state
+
+class AsyncBasePlugin(BasePlugin):
+    """
+    Base class for asynchronous Botty plugins, which run directly on the event loop of an `AsyncBotty` instance. Should be imported from plugins using `from .utilities import AsyncBasePlugin`.
+
+    The `on_step` and `on_message` handlers are coroutines, as are all methods that might wait on the network, like `say`, `react`, and `get_user_info_by_id`. Lookups that don't need the network, like `get_channel_name_by_id`, are still ordinary methods.
+    """
+    async def on_step(self):             return False
+    async def on_message(self, message): return False
+
+    async def say(self, sendable_text, *, channel_id, thread_id=None, priority="normal"): return await self.bot.say(sendable_text, channel_id=channel_id, thread_id=thread_id, priority=priority)
+    async def say_raw(self, text, *, channel_id, thread_id=None, priority="normal"):      return await self.bot.say(self.text_to_sendable_text(text), channel_id=channel_id, thread_id=thread_id, priority=priority)
+    async def say_complete(self, sendable_text, *, channel_id, thread_id=None):           return await self.bot.say_complete(sendable_text, channel_id=channel_id, thread_id=thread_id)
+    async def say_raw_complete(self, text, *, channel_id, thread_id=None):                return await self.bot.say_complete(self.text_to_sendable_text(text), channel_id=channel_id, thread_id=thread_id)
+    async def respond(self, sendable_text, *, as_thread=False):                           return await self.bot.respond(sendable_text, as_thread=as_thread)
+    async def respond_raw(self, text, *, as_thread=False):                                return await self.bot.respond(self.text_to_sendable_text(text), as_thread=as_thread)
+    async def respond_complete(self, sendable_text, *, as_thread=False):                  return await self.bot.respond_complete(sendable_text, as_thread=as_thread)
+    async def respond_raw_complete(self, text, *, as_thread=False):                       return await self.bot.respond_complete(self.text_to_sendable_text(text), as_thread=as_thread)
+    async def react(self, channel_id, timestamp, emoticon):                               return await self.bot.react(channel_id, timestamp, emoticon)
+    async def unreact(self, channel_id, timestamp, emoticon):                             return await self.bot.unreact(channel_id, timestamp, emoticon)
+    async def reply(self, emoticon):                                                      return await self.bot.reply(emoticon)
+    async def unreply(self, emoticon):                                                    return await self.bot.unreply(emoticon)
+    async def get_direct_message_channel_id_by_user_id(self, user_id):                    return await self.bot.get_direct_message_channel_id_by_user_id(user_id)
+    async def get_user_info_by_id(self, user_id):                                         return await self.bot.get_user_info_by_id(user_id)
+    async def get_user_is_bot(self, user_id):                                             return await self.bot.get_user_is_bot(user_id)
+
+class ExpiringDict:
+    """
+    Thread-safe dictionary for plugin state keyed by things that keep coming and going, like channels, threads, or users, which would otherwise grow without bound over the lifetime of the bot.
+
+    Entries expire `ttl` seconds after they were last set or looked up (or never, if `ttl` is `None`), and when there are more than `max_size` entries, the least recently used ones are evicted. Entries are kept in least recently used order, so that expired entries are always at the front and can be removed in constant time per entry as the dictionary is used. If `on_evict` isn't `None`, it's called as `on_evict(key, value)` for every entry that expires or is evicted (but not for entries that are deleted or replaced). The numbers of expired and evicted entries are kept in `expired_count` and `evicted_count`.
+
+    Values are returned as they are, so mutable values (like lists) can be updated in place.
+    """
+    def __init__(self, max_size=1000, ttl=None, on_evict=None):
+        assert isinstance(max_size, int) and max_size > 0, "`max_size` must be a positive integer rather than \"{}\"".format(max_size)
+        assert ttl is None or ttl > 0, "`ttl` must be `None` or a positive number rather than \"{}\"".format(ttl)
+        self.max_size, self.ttl, self.on_evict = max_size, ttl, on_evict
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # mapping from keys to (value, monotonic expiry time) tuples, least recently used first
+        self.expired_count = 0 # number of entries removed because they expired
+        self.evicted_count = 0 # number of entries removed to stay within `max_size`
+
+    def __len__(self):
+        with self.lock:
+            removed_entries = self.remove_expired_entries() # expired entries shouldn't be counted
+            size = len(self.entries)
+        self.notify_evicted(removed_entries)
+        return size
+
+    def __contains__(self, key):
+        with self.lock:
+            removed_entries = self.remove_expired_entries()
+            is_present = key in self.entries
+        self.notify_evicted(removed_entries)
+        return is_present
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self: raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, None if self.ttl is None else time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            removed_entries = self.remove_expired_entries()
+            while len(self.entries) > self.max_size:
+                removed_entries.append(self.entries.popitem(last=False))
+                self.evicted_count += 1
+        self.notify_evicted(removed_entries)
+
+    def __delitem__(self, key):
+        with self.lock: del self.entries[key]
+
+    def get(self, key, default=None):
+        """Returns the value for `key`, or `default` if there isn't one. Looking up an entry counts as using it, which resets its expiry time."""
+        with self.lock:
+            removed_entries = self.remove_expired_entries()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries[key] = (entry[0], None if self.ttl is None else time.monotonic() + self.ttl)
+                self.entries.move_to_end(key)
+        self.notify_evicted(removed_entries)
+        return default if entry is None else entry[0]
+
+    def pop(self, key, default=None):
+        with self.lock: entry = self.entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self.lock: self.entries.clear()
+
+    def remove_expired_entries(self):
+        """Remove expired entries, returning a list of their (key, (value, expiry time)) pairs. Must be called with `lock` held."""
+        removed_entries = []
+        if self.ttl is None: return removed_entries
+        current_time = time.monotonic()
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry[1] > current_time: break
+            del self.entries[key]
+            removed_entries.append((key, entry))
+            self.expired_count += 1
+        return removed_entries
+
+    def notify_evicted(self, removed_entries):
+        """Call `on_evict` for each of the (key, (value, expiry time)) pairs in `removed_entries`. Called without `lock` held, so that `on_evict` can use the dictionary."""
+        if self.on_evict is None: return
+        for key, (value, _) in removed_entries: self.on_evict(key, value)
 
 class Flow:
-    """Create a new `Flow` instance (which map keys to generator iterators) with `generator_function` as its generator function. This class can be used to replace many complex message handling state machines with clean and concise Python code."""
-    def __init__(self, generator_function):
+    """Create a new `Flow` instance (which map keys to generator iterators) with `generator_function` as its generator function. This class can be used to replace many complex message handling state machines with clean and concise Python code. Flows that haven't been stepped for `ttl` seconds are abandoned, as are the least recently stepped flows when there are more than `max_flows` of them."""
+    def __init__(self, generator_function, max_flows=1000, ttl=24 * 60 * 60):
         self.generator_function = generator_function
-        self.generator_iterators = {}
+        self.generator_iterators = ExpiringDict(max_size=max_flows, ttl=ttl, on_evict=self.close_generator_iterator) # mapping from flow keys to generator iterators
 
     def start(self, flow_key, parameter_data = None):
         """Discards the current generator iterator associated with key `flow_key`, creates a new state machine from the generator function by calling it with `parameter_data` as an argument, then runs the state machine until it first yields."""
-        self.generator_iterators[flow_key] = self.generator_function(parameter_data)
-        next(self.generator_iterators[flow_key]) # run the generator all the way up until it first yields
+        generator_iterator = self.generator_iterators[flow_key] = self.generator_function(parameter_data)
+        next(generator_iterator) # run the generator all the way up until it first yields
 
     def is_running(self, flow_key):
         """Returns `True` if there is currently a generator iterator associated with key `flow_key`, `False` otherwise."""
@@ -73,14 +205,32 @@ class Flow:
 
     def step(self, flow_key, yield_data = None):
         """Returns the result of running the generator iterator associated with key `flow_key` (sending the iterator `yield_data` in the process), or `False` if there is no such generator iterator."""
-        if flow_key not in self.generator_iterators: return False
+        generator_iterator = self.generator_iterators.get(flow_key)
+        if generator_iterator is None: return False
         try:
-            return self.generator_iterators[flow_key].send(yield_data)
+            return generator_iterator.send(yield_data)
         except StopIteration as e:
-            del self.generator_iterators[flow_key] # remove the completed flow
+            if self.generator_iterators.get(flow_key) is generator_iterator: self.generator_iterators.pop(flow_key) # remove the completed flow, unless it was restarted in the meantime
             return e.value
         return False
 
+    def close_generator_iterator(self, flow_key, generator_iterator):
+        """Close the abandoned flow `generator_iterator`, so that its `finally` blocks run."""
+        try: generator_iterator.close()
+        except ValueError: pass # the flow is running right now in another thread, so it'll just be garbage collected once it yields
+
+shared_assets = {} # mapping from asset names to read-only data loaded by `load_shared_asset`, shared by every Botty instance in the process
+shared_asset_locks = {} # mapping from asset names to locks that are held while the asset is being loaded
+shared_asset_locks_lock = threading.Lock()
+
+def load_shared_asset(name, load):
+    """Returns the asset named `name`, calling `load()` to load it if it hasn't been loaded yet by any plugin in this process. Useful for big read-only data like dictionaries or word lists, so that running Botty in several Slack chats from one process doesn't load a copy for each chat. Assets are shared between plugin instances, so they must never be modified."""
+    if name in shared_assets: return shared_assets[name]
+    with shared_asset_locks_lock: lock = shared_asset_locks.setdefault(name, threading.Lock())
+    with lock: # if another plugin instance is loading the asset right now, wait for it rather than loading it twice
+        if name not in shared_assets: shared_assets[name] = load()
+        return shared_assets[name]
+
 def untag_word(word):
     """Returns `word` where characters are modified to appear the same but not tag users."""
     assert isinstance(word, str), "`word` must be a string"
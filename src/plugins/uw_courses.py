@@ -27,6 +27,8 @@ class UWCoursesPlugin(BasePlugin):
         #general    | Me: uw course cs341
         #general    | Botty: *CS 341* _(offered F, W, S)_: Algorithms (http://www.ucalendar.uwaterloo.ca/1516/COURSE/course-CS.html#CS341)
     """
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)^\s*uw\s+courses?\s"]
     def __init__(self, bot):
         super().__init__(bot)
 
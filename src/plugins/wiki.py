@@ -20,6 +20,8 @@ import wikipedia
 from .utilities import BasePlugin
 
 class WikiPlugin(BasePlugin):
+    trigger_event_types = {"message"}
+    trigger_patterns = [r"(?i)\bbotty\s+(?:what|who|wtf)"]
     def __init__(self, bot):
         super().__init__(bot)
 
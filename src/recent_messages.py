@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import deque
+
+class RecentMessage:
+    """Compact record of a text message, as stored by `RecentMessageStore`. `text` is in server format, and `thread_id` is `None` for messages that aren't in a thread."""
+    __slots__ = ("timestamp", "channel_id", "thread_id", "user_id", "text", "size", "buffer_count")
+
+    def __init__(self, timestamp, channel_id, thread_id, user_id, text):
+        self.timestamp, self.channel_id, self.thread_id, self.user_id, self.text = timestamp, channel_id, thread_id, user_id, text
+        self.size = RecentMessageStore.MESSAGE_OVERHEAD + len(text) # approximate memory used by the message, in bytes
+        self.buffer_count = 0 # number of ring buffers the message is in
+
+    def get_buffer_keys(self):
+        """Returns the keys of the ring buffers that the message belongs in - the one for its channel, and the one for its thread if it's in a thread."""
+        if self.thread_id is None: return [(self.channel_id, None)]
+        return [(self.channel_id, None), (self.channel_id, self.thread_id)]
+
+    def __repr__(self): return "<RecentMessage {} in {}/{} by {}: {}>".format(self.timestamp, self.channel_id, self.thread_id, self.user_id, repr(self.text))
+
+class RecentMessageStore:
+    """
+    Thread-safe store of recently received text messages, kept in a ring buffer for each channel and each thread.
+
+    Every message goes into the ring buffer for its channel (whether or not it's in a thread), and threaded messages also go into the ring buffer for their thread, each holding up to `buffer_size` messages. Across all buffers, the store keeps at most about `max_size` bytes of messages (estimated from the length of their text plus a fixed overhead) - when the limit is exceeded, the oldest messages are dropped first, no matter which channel they're in, so busy channels don't need a separate limit. Buffers that become empty are removed, so quiet channels and old threads don't use any memory.
+
+    Messages can be looked up by channel and timestamp in constant time with `get`, and the most recent messages in a channel or thread can be retrieved with `get_recent`.
+    """
+    MESSAGE_OVERHEAD = 300 # rough number of bytes used by each stored message besides its text, such as the IDs and the record itself
+
+    def __init__(self, max_size=4000000, buffer_size=200):
+        assert isinstance(max_size, int) and max_size > 0, "`max_size` must be a positive integer rather than \"{}\"".format(max_size)
+        assert isinstance(buffer_size, int) and buffer_size > 0, "`buffer_size` must be a positive integer rather than \"{}\"".format(buffer_size)
+        self.max_size, self.buffer_size = max_size, buffer_size
+        self.lock = threading.Lock()
+        self.buffers = {} # mapping from (channel ID, thread ID) tuples to deques of `RecentMessage` instances, oldest first, where the thread ID is `None` for the channel's buffer
+        self.messages_by_key = {} # mapping from (channel ID, timestamp) tuples to `RecentMessage` instances, for every message in at least one buffer
+        self.messages = deque() # every stored message, oldest first, for dropping the oldest messages when the store is too big
+        self.size = 0 # estimated total size of the stored messages, in bytes
+        self.evicted_count = 0 # number of messages that were dropped to stay under `max_size`
+
+    def __len__(self): return len(self.messages_by_key)
+
+    def add_message(self, message):
+        """Store the `IncomingMessage` instance `message` if it's a text message, or update the stored text if it's an edit of a stored message. Returns the stored `RecentMessage` instance, or `None` if nothing was stored."""
+        if not message.is_text_message: return None
+        if message.subtype == "message_changed":
+            original_timestamp = message.message_dict["message"].get("ts") # the event's own timestamp is for the edit, not the message being edited
+            with self.lock:
+                recent_message = self.messages_by_key.get((message.channel_id, original_timestamp))
+                if recent_message is not None:
+                    self.size += len(message.text) - len(recent_message.text)
+                    recent_message.text = message.text
+                    recent_message.size = self.MESSAGE_OVERHEAD + len(message.text)
+                    self.evict_old_messages()
+            return recent_message
+
+        recent_message = RecentMessage(message.timestamp, message.channel_id, message.thread_id, message.user_id, message.text)
+        with self.lock:
+            key = (recent_message.channel_id, recent_message.timestamp)
+            if key in self.messages_by_key: return None # already stored, such as when the same event is received twice after a reconnection
+            self.messages_by_key[key] = recent_message
+            self.messages.append(recent_message)
+            self.size += recent_message.size
+            for buffer_key in recent_message.get_buffer_keys(): self.append_to_buffer(buffer_key, recent_message)
+            self.evict_old_messages()
+        return recent_message
+
+    def append_to_buffer(self, buffer_key, recent_message):
+        """Append `recent_message` to the ring buffer at `buffer_key`, dropping the buffer's oldest message if it's full. Must be called with `lock` held."""
+        buffer = self.buffers.get(buffer_key)
+        if buffer is None: buffer = self.buffers[buffer_key] = deque()
+        buffer.append(recent_message)
+        recent_message.buffer_count += 1
+        if len(buffer) > self.buffer_size:
+            dropped_message = buffer.popleft()
+            dropped_message.buffer_count -= 1
+            if dropped_message.buffer_count == 0: self.forget_message(dropped_message) # not in any other buffer
+
+    def evict_old_messages(self):
+        """Drop the oldest messages from every buffer they're in until the store is within `max_size`. Must be called with `lock` held."""
+        while self.size > self.max_size and self.messages:
+            oldest_message = self.messages.popleft()
+            if oldest_message.buffer_count == 0: continue # already forgotten after being dropped from its ring buffers
+            for buffer_key in oldest_message.get_buffer_keys(): # every message older than this one is already gone, so it's the oldest in each buffer it's still in
+                buffer = self.buffers.get(buffer_key)
+                if not buffer or buffer[0] is not oldest_message: continue # already dropped from this buffer, like threaded messages that were pushed out of their channel's buffer
+                buffer.popleft()
+                if not buffer: del self.buffers[buffer_key]
+            oldest_message.buffer_count = 0
+            self.forget_message(oldest_message)
+            self.evicted_count += 1
+
+    def forget_message(self, recent_message):
+        """Remove `recent_message`, which isn't in any buffer anymore, from the lookup table. Must be called with `lock` held."""
+        del self.messages_by_key[(recent_message.channel_id, recent_message.timestamp)]
+        self.size -= recent_message.size
+
+        # forgotten messages are only removed from `messages` when they reach the front, so compact it if there are too many waiting behind a message in a quiet channel
+        if len(self.messages) > 2 * len(self.messages_by_key) + 1000:
+            self.messages = deque(message for message in self.messages if message.buffer_count > 0)
+
+    def get(self, channel_id, timestamp):
+        """Returns the stored `RecentMessage` in the channel with ID `channel_id` with timestamp `timestamp`, or `None` if it isn't stored."""
+        return self.messages_by_key.get((channel_id, timestamp))
+
+    def get_recent(self, channel_id, thread_id=None, count=10):
+        """Returns a list of up to `count` of the most recent `RecentMessage` instances in the channel with ID `channel_id` (including messages in threads), or in the thread with ID `thread_id` in that channel if it's not `None`, oldest first."""
+        with self.lock:
+            buffer = self.buffers.get((channel_id, thread_id))
+            if buffer is None: return []
+            if count >= len(buffer): return list(buffer)
+            return [buffer[i] for i in range(len(buffer) - count, len(buffer))]
+
+    def clear(self):
+        with self.lock:
+            self.buffers.clear()
+            self.messages_by_key.clear()
+            self.messages.clear()
+            self.size = 0
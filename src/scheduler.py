@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import time, heapq, itertools
+import threading
+
+class ScheduledCall:
+    """Handle for a function call scheduled with a `Scheduler`. The call can be cancelled with `cancel`, which stops repeating calls from being made again too."""
+    __slots__ = ("scheduler", "time", "interval", "function", "args", "cancelled", "in_heap")
+
+    def __init__(self, scheduler, time, interval, function, args):
+        self.scheduler, self.time, self.interval, self.function, self.args = scheduler, time, interval, function, args
+        self.cancelled = False
+        self.in_heap = False # whether the call is waiting in the scheduler's heap
+
+    def cancel(self):
+        """Stop the call from being made, if it hasn't been made already. Safe to call more than once, and from any thread."""
+        self.scheduler.cancel(self)
+
+    def __repr__(self): return "<ScheduledCall {} at {:.3f}{}>".format(getattr(self.function, "__qualname__", self.function), self.time, " (cancelled)" if self.cancelled else "")
+
+class Scheduler:
+    """
+    Thread-safe heap of function calls to make at particular monotonic times, so that the bot's main loop only has to wake up when a call is due, rather than checking every plugin on every iteration.
+
+    The scheduler doesn't make calls itself - the main loop asks for the time of the next call with `get_next_time`, and takes the calls that are due with `pop_due_calls`. Whenever a newly scheduled call becomes the next one due, `wake_up` is called (if it isn't `None`), so that a main loop waiting for the previous next call can wake up and wait for the new one instead. Repeating calls are rescheduled relative to when they were due rather than when they were made, so they don't drift, but if the loop falls more than a whole interval behind, the missed calls are skipped rather than made in a burst.
+    """
+    def __init__(self, wake_up=None):
+        self.wake_up = wake_up
+        self.lock = threading.Lock()
+        self.heap = [] # heap of (monotonic time, sequence number, `ScheduledCall` instance) tuples, where the sequence number makes calls due at the same time happen in the order they were scheduled
+        self.sequence_numbers = itertools.count()
+        self.cancelled_count = 0 # number of cancelled calls still in the heap, which are removed once they reach the top, or all at once if there are too many
+
+    def __len__(self): return len(self.heap) - self.cancelled_count
+
+    def call_at(self, when, function, *args):
+        """Schedule `function` to be called with arguments `args` at monotonic time `when`, returning a `ScheduledCall` handle."""
+        return self.schedule(ScheduledCall(self, when, None, function, args))
+
+    def call_later(self, delay, function, *args):
+        """Schedule `function` to be called with arguments `args` once, after `delay` seconds, returning a `ScheduledCall` handle."""
+        assert delay >= 0, "`delay` must be a non-negative number rather than \"{}\"".format(delay)
+        return self.call_at(time.monotonic() + delay, function, *args)
+
+    def call_every(self, interval, function, *args):
+        """Schedule `function` to be called with arguments `args` every `interval` seconds, starting `interval` seconds from now, returning a `ScheduledCall` handle that can be used to stop it."""
+        assert interval > 0, "`interval` must be a positive number rather than \"{}\"".format(interval)
+        return self.schedule(ScheduledCall(self, time.monotonic() + interval, interval, function, args))
+
+    def schedule(self, scheduled_call):
+        with self.lock:
+            self.push(scheduled_call)
+            is_next_call = self.heap[0][2] is scheduled_call
+        if is_next_call and self.wake_up is not None: self.wake_up()
+        return scheduled_call
+
+    def push(self, scheduled_call):
+        """Add `scheduled_call` to the heap. Must be called with `lock` held."""
+        heapq.heappush(self.heap, (scheduled_call.time, next(self.sequence_numbers), scheduled_call))
+        scheduled_call.in_heap = True
+
+    def pop(self):
+        """Remove and return the `ScheduledCall` at the top of the heap. Must be called with `lock` held."""
+        _, _, scheduled_call = heapq.heappop(self.heap)
+        scheduled_call.in_heap = False
+        if scheduled_call.cancelled: self.cancelled_count -= 1
+        return scheduled_call
+
+    def cancel(self, scheduled_call):
+        with self.lock:
+            if scheduled_call.cancelled: return
+            scheduled_call.cancelled = True
+            if not scheduled_call.in_heap: return # one-off call that was already made, or is being made right now
+            self.cancelled_count += 1
+            self.remove_cancelled_calls()
+
+    def remove_cancelled_calls(self):
+        """Remove cancelled calls from the top of the heap, and rebuild the heap without any cancelled calls if they make up most of it. Must be called with `lock` held."""
+        while self.heap and self.heap[0][2].cancelled: self.pop()
+        if self.cancelled_count > 100 and self.cancelled_count > len(self.heap) // 2:
+            for entry in self.heap:
+                if entry[2].cancelled: entry[2].in_heap = False
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled_count = 0
+
+    def retry(self, scheduled_call, when):
+        """Make `scheduled_call`, which was returned by `pop_due_calls` but couldn't be made right then, at monotonic time `when` instead. Repeating calls have already been rescheduled by `pop_due_calls`, so they just skip this turn, like calls missed by falling behind."""
+        if scheduled_call.interval is not None: return
+        with self.lock:
+            if scheduled_call.cancelled or scheduled_call.in_heap: return
+            scheduled_call.time = when
+            self.push(scheduled_call)
+
+    def get_next_time(self):
+        """Returns the monotonic time at which the next call is due, or `None` if there are no calls scheduled."""
+        with self.lock:
+            self.remove_cancelled_calls()
+            return self.heap[0][0] if self.heap else None
+
+    def pop_due_calls(self, current_time):
+        """Returns a list of the `ScheduledCall` instances that are due at monotonic time `current_time`, in the order they're due, removing one-off calls and rescheduling repeating calls. Calls might be cancelled after they're returned, so callers should check `cancelled` right before making each one."""
+        due_calls = []
+        with self.lock:
+            self.remove_cancelled_calls()
+            while self.heap and self.heap[0][0] <= current_time:
+                scheduled_call = self.pop()
+                due_calls.append(scheduled_call)
+                if scheduled_call.interval is not None:
+                    scheduled_call.time += scheduled_call.interval
+                    if scheduled_call.time <= current_time: scheduled_call.time = current_time + scheduled_call.interval # fell more than an interval behind, so skip the missed calls
+                    self.push(scheduled_call)
+                self.remove_cancelled_calls()
+        return due_calls
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+Conversions between the three kinds of Slack message text, shared by the bot, the history utilities, and the history server.
+
+* Server text is what Slack sends us. It contains special sequences like `<#CHANNEL_ID>`, `<@USER_ID>`, `<!channel>`, and `<http://example.com|label>`, and escapes `&`, `<`, and `>` as `&amp;`, `&lt;`, and `&gt;`.
+* Sendable text is what we send to Slack. It's the same as server text, except links are written out without angle brackets or labels so that Slack linkifies them itself.
+* Plain text is what people actually see, with channel and user references replaced by their names and everything unescaped.
+
+Each conversion scans the text once, using a single compiled pattern that matches both special sequences and stray angle brackets, so validation and conversion happen in the same pass. Entity escapes are then replaced using string methods, which is much faster than calling back into Python for each one. Text without any angle brackets or ampersands is returned as-is without being scanned at all.
+"""
+
+import re
+from functools import lru_cache
+
+TOKEN_MATCHER = re.compile(r"<([^<>]*)>|[<>]") # special sequence, or stray angle bracket (only matched when not part of a special sequence)
+SPECIAL_COMMAND_NAMES = {"!channel": "@channel", "!group": "@group", "!everyone": "@everyone"}
+
+def text_to_sendable_text(text):
+    """Returns `text`, a plain text string, converted into a string in Slack sendable message format."""
+    assert isinstance(text, str), "`text` must be a string rather than \"{}\"".format(text)
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def unescape_entities(text):
+    """Returns `text` with Slack's `&amp;`, `&lt;`, and `&gt;` entity escapes replaced by the characters they represent."""
+    if "&" not in text: return text
+    return text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+class SlackTextCodec:
+    """
+    Converts message text between Slack server, sendable, and plain text formats, resolving channel and user references to names.
+
+    `get_channel_name_by_id`, `get_user_name_by_id`, and `get_user_real_name_by_id` are functions that return the name for an ID, or `None` if the ID is unknown. Their results are memoized (up to `cache_size` entries each), so `clear_name_cache` should be called whenever channels or users are renamed.
+    """
+    def __init__(self, get_channel_name_by_id=None, get_user_name_by_id=None, get_user_real_name_by_id=None, cache_size=4096):
+        self.get_channel_name_by_id = lru_cache(cache_size)(get_channel_name_by_id or (lambda channel_id: None))
+        self.get_user_name_by_id = lru_cache(cache_size)(get_user_name_by_id or (lambda user_id: None))
+        self.get_user_real_name_by_id = lru_cache(cache_size)(get_user_real_name_by_id or (lambda user_id: None))
+
+    def clear_name_cache(self):
+        """Forget all memoized channel and user names."""
+        self.get_channel_name_by_id.cache_clear()
+        self.get_user_name_by_id.cache_clear()
+        self.get_user_real_name_by_id.cache_clear()
+
+    def server_text_to_sendable_text(self, server_text):
+        """Returns `server_text`, a string in Slack server message format, converted into a string in Slack sendable message format."""
+        assert isinstance(server_text, str), "`server_text` must be a string rather than \"{}\"".format(server_text)
+        if "<" not in server_text and ">" not in server_text: return server_text # no special sequences, and entity escapes stay as they are
+
+        def process_token(match):
+            original, body = match.group(0), match.group(1)
+            assert body is not None, "Invalid special sequence in server text \"{}\", perhaps some text needs to be escaped".format(server_text)
+            body = body.split("|", 1)[0]
+            if body.startswith(("#", "@", "!")): return original # channel reference, user reference, or special command, should send unchanged
+            return body # link, should remove angle brackets and label in order to allow it to linkify
+        return TOKEN_MATCHER.sub(process_token, server_text)
+
+    def sendable_text_to_text(self, sendable_text):
+        """Returns `sendable_text`, a string in Slack sendable message format, converted into a plain text string. The transformation can lose some information for escape sequences, such as link labels."""
+        assert isinstance(sendable_text, str), "`sendable_text` must be a string rather than \"{}\"".format(sendable_text)
+        if "<" not in sendable_text and ">" not in sendable_text: return unescape_entities(sendable_text) # no special sequences
+
+        def process_token(match):
+            original, body = match.group(0), match.group(1)
+            assert body is not None, "Invalid special sequence in sendable text \"{}\", perhaps some text needs to be escaped".format(sendable_text)
+            body = body.split("|", 1)[0]
+            if body.startswith("#"): # channel reference
+                channel_name = self.get_channel_name_by_id(body[1:])
+                return original if channel_name is None else "#" + channel_name
+            if body.startswith("@"): # user reference
+                user_name = self.get_user_name_by_id(body[1:])
+                return original if user_name is None else "@" + user_name
+            return SPECIAL_COMMAND_NAMES.get(body, original) # special command
+        return unescape_entities(TOKEN_MATCHER.sub(process_token, sendable_text))
+
+    def server_text_to_text(self, server_text):
+        """Returns `server_text`, a string in Slack server message format, converted into a plain text string. The transformation can lose some information for escape sequences, such as link labels."""
+        assert isinstance(server_text, str), "`server_text` must be a string rather than \"{}\"".format(server_text)
+        if "<" not in server_text and ">" not in server_text: return unescape_entities(server_text) # no special sequences
+
+        def process_token(match):
+            original, body = match.group(0), match.group(1)
+            assert body is not None, "Invalid special sequence in server text \"{}\", perhaps some text needs to be escaped".format(server_text)
+            body = body.split("|", 1)[0]
+            if body.startswith("#"): # channel reference
+                channel_name = self.get_channel_name_by_id(body[1:])
+                return original if channel_name is None else "#" + channel_name
+            if body.startswith("@"): # user reference
+                user_name = self.get_user_name_by_id(body[1:])
+                return original if user_name is None else "@" + user_name
+            return SPECIAL_COMMAND_NAMES.get(body, body) # special command, or link (should remove angle brackets and label)
+        return unescape_entities(TOKEN_MATCHER.sub(process_token, server_text))
+
+    def replace_special_sequences(self, sendable_text, process_special_sequence):
+        """Returns `sendable_text` with each special sequence replaced by the result of calling `process_special_sequence(original, body)`, where `original` is the whole sequence and `body` is the part before any label. Entity escapes are left unchanged."""
+        assert isinstance(sendable_text, str), "`sendable_text` must be a string rather than \"{}\"".format(sendable_text)
+        if "<" not in sendable_text: return sendable_text # no special sequences
+
+        def process_token(match):
+            body = match.group(1)
+            if body is None: return match.group(0) # stray angle bracket, leave unchanged
+            return process_special_sequence(match.group(0), body.split("|", 1)[0])
+        return TOKEN_MATCHER.sub(process_token, sendable_text)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+import threading
+import concurrent.futures
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class SlackWebClient:
+    """
+    Client for the [Slack Web API](https://api.slack.com/web), for use alongside the RTM connection managed by the Slack library.
+
+    Requests go through a single `requests.Session`, so connections to Slack are kept alive and reused instead of being opened for every call. At most `max_workers` requests are in flight at once. `api_call` blocks until the response arrives, while `submit` returns a `concurrent.futures.Future` immediately - requests submitted with the same `ordering_key` are still made one after another, in the order they were submitted.
+
+    Rate limited requests (HTTP 429) are retried up to `max_retries` times, after waiting as long as the `Retry-After` header says to. `base_url` can be changed to point at a local server for testing.
+    """
+    def __init__(self, token, base_url="https://slack.com/api/", max_workers=4, timeout=10, max_retries=3, logger=None):
+        assert isinstance(token, str), "`token` must be a valid Slack API token"
+        assert isinstance(base_url, str) and base_url.endswith("/"), "`base_url` must be a URL ending in \"/\" rather than \"{}\"".format(base_url)
+        assert isinstance(max_workers, int) and max_workers > 0, "`max_workers` must be a positive integer rather than \"{}\"".format(max_workers)
+        self.token, self.base_url, self.timeout, self.max_retries = token, base_url, timeout, max_retries
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers) # keep one connection alive for each worker
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="SlackWebClient")
+
+        self.ordering_lock = threading.Lock()
+        self.last_futures_by_ordering_key = {} # mapping from ordering keys to the most recently submitted future for that key
+        self.rate_limited_count = 0 # number of responses that were rate limited and had to be retried
+
+    def api_call(self, method, **kwargs):
+        """Returns the response dictionary from calling the Slack Web API method `method` with arguments `kwargs`, waiting for the response."""
+        for attempt in range(self.max_retries + 1):
+            response = self.session.post(self.base_url + method, data=dict(kwargs, token=self.token), timeout=self.timeout)
+            if response.status_code != 429 or attempt == self.max_retries: break
+            self.rate_limited_count += 1
+            retry_after = float(response.headers.get("Retry-After", 1))
+            self.logger.warning("Slack API method {} was rate limited, retrying in {} seconds".format(method, retry_after))
+            time.sleep(retry_after)
+        if response.status_code == 429: return {"ok": False, "error": "ratelimited"}
+        response.raise_for_status()
+        return response.json()
+
+    def submit(self, method, *, ordering_key=None, **kwargs):
+        """Start calling the Slack Web API method `method` with arguments `kwargs` in the background, returning a `concurrent.futures.Future` that resolves to the response dictionary. Calls with the same non-`None` `ordering_key` are made one at a time, in the order they were submitted."""
+        future = concurrent.futures.Future()
+        def run():
+            if not future.set_running_or_notify_cancel(): return
+            try: future.set_result(self.api_call(method, **kwargs))
+            except Exception as e: future.set_exception(e)
+
+        if ordering_key is None:
+            self.executor.submit(run)
+            return future
+
+        with self.ordering_lock:
+            previous_future = self.last_futures_by_ordering_key.get(ordering_key)
+            self.last_futures_by_ordering_key[ordering_key] = future
+        def forget_ordering_key(_):
+            with self.ordering_lock:
+                if self.last_futures_by_ordering_key.get(ordering_key) is future: del self.last_futures_by_ordering_key[ordering_key]
+        future.add_done_callback(forget_ordering_key)
+        if previous_future is None: self.executor.submit(run)
+        else: previous_future.add_done_callback(lambda previous_future: self.executor.submit(run)) # runs right away if the previous call already finished
+        return future
+
+    def close(self):
+        """Wait for submitted calls to finish, then close all connections."""
+        self.executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import os, sys, re
+import argparse
+import json, random, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+from slack_text import SlackTextCodec
+
+parser = argparse.ArgumentParser(description="Compare the shared Slack text codec against the previous two-pass text conversion functions.")
+parser.add_argument("--history", help="Directory to look for JSON chat history files in (e.g., \"~/.slack-history\"); if not specified, randomly generated messages are used instead.")
+parser.add_argument("-n", "--count", type=int, default=20000, help="Number of messages to convert in each run.")
+parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of runs to take the best time from.")
+args = parser.parse_args()
+
+def legacy_server_text_to_sendable_text(server_text):
+    assert isinstance(server_text, str), "`server_text` must be a string rather than \"{}\"".format(server_text)
+    text_without_special_sequences = re.sub(r"<[^<>]*>", "", server_text)
+    assert "<" not in text_without_special_sequences and ">" not in text_without_special_sequences, "Invalid special sequence in server text \"{}\", perhaps some text needs to be escaped"
+    def process_special_sequence(match):
+        original, body = match.group(0), match.group(1).split("|")[0]
+        if body.startswith("#"): return original
+        if body.startswith("@"): return original
+        if body.startswith("!"): return original
+        return body
+    return re.sub(r"<(.*?)>", process_special_sequence, server_text)
+
+def legacy_sendable_text_to_text(sendable_text, channel_names_by_id, user_names_by_id):
+    assert isinstance(sendable_text, str), "`sendable_text` must be a string rather than \"{}\"".format(sendable_text)
+    text_without_special_sequences = re.sub(r"<[^<>]*>", "", sendable_text)
+    assert "<" not in text_without_special_sequences and ">" not in text_without_special_sequences, "Invalid special sequence in sendable text \"{}\", perhaps some text needs to be escaped"
+    def process_special_sequence(match):
+        original, body = match.group(0), match.group(1).split("|")[0]
+        if body.startswith("#"):
+            channel_name = channel_names_by_id.get(body[1:])
+            if channel_name is None: return original
+            return "#" + channel_name
+        if body.startswith("@"):
+            user_name = user_names_by_id.get(body[1:])
+            if user_name is None: return original
+            return "@" + user_name
+        if body.startswith("!"):
+            if body == "!channel": return "@channel"
+            if body == "!group": return "@group"
+            if body == "!everyone": return "@everyone"
+        return original
+    raw_text = re.sub(r"<(.*?)>", process_special_sequence, sendable_text)
+    return raw_text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+def legacy_server_text_to_text(server_text, channel_names_by_id, user_names_by_id):
+    assert isinstance(server_text, str), "`server_text` must be a string rather than \"{}\"".format(server_text)
+    text_without_special_sequences = re.sub(r"<[^<>]*>", "", server_text)
+    assert "<" not in text_without_special_sequences and ">" not in text_without_special_sequences, "Invalid special sequence in server text \"{}\", perhaps some text needs to be escaped"
+    def process_special_sequence(match):
+        original, body = match.group(0), match.group(1).split("|")[0]
+        if body.startswith("#"):
+            return "#" + channel_names_by_id[body[1:]] if body[1:] in channel_names_by_id else original
+        if body.startswith("@"):
+            return "@" + user_names_by_id[body[1:]] if body[1:] in user_names_by_id else original
+        if body.startswith("!"):
+            if body == "!channel": return "@channel"
+            if body == "!group": return "@group"
+            if body == "!everyone": return "@everyone"
+        return body
+    raw_text = re.sub(r"<(.*?)>", process_special_sequence, server_text)
+    return raw_text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+def load_history_messages(history_directory, count):
+    with open(os.path.join(history_directory, "metadata", "users.json"), "r") as f:
+        user_names_by_id = {entry["id"]: entry["name"] for entry in json.load(f)}
+    with open(os.path.join(history_directory, "metadata", "channels.json"), "r") as f:
+        channel_names_by_id = {entry["id"]: entry["name"] for entry in json.load(f)}
+    texts = []
+    for dirpath, _, filenames in os.walk(history_directory):
+        for history_file in filenames:
+            if not history_file.endswith(".json"): continue
+            with open(os.path.join(dirpath, history_file), "r") as f:
+                for line in f:
+                    try: message = json.loads(line)
+                    except ValueError: break # metadata files are single JSON documents rather than one message per line
+                    if isinstance(message, dict) and isinstance(message.get("text"), str): texts.append(message["text"])
+                    if len(texts) >= count: return texts, channel_names_by_id, user_names_by_id
+    return texts, channel_names_by_id, user_names_by_id
+
+def generate_messages(count):
+    random.seed(0)
+    channel_names_by_id = {"C{:08}".format(i): "channel{}".format(i) for i in range(50)}
+    user_names_by_id = {"U{:08}".format(i): "user{}".format(i) for i in range(200)}
+    channel_ids, user_ids = list(channel_names_by_id), list(user_names_by_id)
+    words = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "botty", "haiku", "poll", "&lt;3", "a &amp; b", "x &gt; y"]
+    texts = []
+    for _ in range(count):
+        parts = [random.choice(words) for _ in range(random.randint(3, 20))]
+        for _ in range(random.choice([0, 0, 0, 1, 2, 3])): # most messages have no special sequences
+            parts.insert(random.randrange(len(parts) + 1), random.choice([
+                "<@{}>".format(random.choice(user_ids)),
+                "<#{}|{}>".format(random.choice(channel_ids), "label"),
+                "<http://example.com/?a=1&amp;b=2|example>",
+                "<https://example.com/some/path>",
+                "<!channel>", "<!here|@here>",
+            ]))
+        texts.append(" ".join(parts))
+    return texts, channel_names_by_id, user_names_by_id
+
+if args.history:
+    texts, channel_names_by_id, user_names_by_id = load_history_messages(args.history, args.count)
+else:
+    texts, channel_names_by_id, user_names_by_id = generate_messages(args.count)
+codec = SlackTextCodec(channel_names_by_id.get, user_names_by_id.get)
+
+comparisons = [
+    ("server text to sendable text", lambda text: legacy_server_text_to_sendable_text(text), codec.server_text_to_sendable_text),
+    ("sendable text to text", lambda text: legacy_sendable_text_to_text(text, channel_names_by_id, user_names_by_id), codec.sendable_text_to_text),
+    ("server text to text", lambda text: legacy_server_text_to_text(text, channel_names_by_id, user_names_by_id), codec.server_text_to_text),
+]
+print("{} messages, best of {} runs".format(len(texts), args.repeat))
+for name, legacy_function, codec_function in comparisons:
+    if name == "sendable text to text":
+        inputs = [legacy_server_text_to_sendable_text(text) for text in texts] # the bot only ever converts sendable text to text
+    else:
+        inputs = texts
+    mismatches = sum(1 for text in inputs if legacy_function(text) != codec_function(text))
+    legacy_time = min(timeit.repeat(lambda: [legacy_function(text) for text in inputs], number=1, repeat=args.repeat))
+    codec_time = min(timeit.repeat(lambda: [codec_function(text) for text in inputs], number=1, repeat=args.repeat))
+    print("{:<30} legacy {:8.1f} ms   codec {:8.1f} ms   speedup {:5.2f}x   mismatches {}".format(name, legacy_time * 1000, codec_time * 1000, legacy_time / codec_time, mismatches))
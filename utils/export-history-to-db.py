@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
-import os, re, json
+import os, sys, json
 import sqlite3
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+from slack_text import SlackTextCodec
+
 parser = argparse.ArgumentParser()
 parser.add_argument("--rebuild", help="Completely rebuild the database from the chat history; if not specified, only new chat history is added to the database (slow, but useful if there end up being database issues).", dest="rebuild", action="store_true")
 parser.add_argument("--database", help="Path to SQLite database to export chat history to.", required=True)
@@ -13,20 +16,7 @@ CHAT_HISTORY_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)
 REBUILD_DATABASE = args.rebuild
 SQLITE_DATABASE = args.database
 
-def server_text_to_sendable_text(server_text):
-    """Returns `server_text`, a string in Slack server message format, converted into a string in Slack sendable message format."""
-    assert isinstance(server_text, str), "`server_text` must be a string rather than \"{}\"".format(server_text)
-    text_without_special_sequences = re.sub(r"<[^<>]*>", "", server_text)
-    assert "<" not in text_without_special_sequences and ">" not in text_without_special_sequences, "Invalid special sequence in server text \"{}\", perhaps some text needs to be escaped"
-
-    # process link references
-    def process_special_sequence(match):
-        original, body = match.group(0), match.group(1).split("|")[0]
-        if body.startswith("#C"): return original # channel reference, should send unchanged
-        if body.startswith("@U"): return original # user reference, should send unchanged
-        if body.startswith("!"): return original # special command, should send unchanged
-        return body # link, should remove angle brackets and label in order to allow it to linkify
-    return re.sub(r"<(.*?)>", process_special_sequence, server_text)
+server_text_to_sendable_text = SlackTextCodec().server_text_to_sendable_text
 
 def get_history_files():
     """Returns a mapping from channel IDs to absolute file paths of their history entries"""